@@ -1,15 +1,21 @@
 # Modified from: https://stackoverflow.com/questions/20358217/opencv-drawing-matches-in-top-and-bottom-configuration
+# For a run already done with checkpoints, explore_matches.py draws the matches of any pair from the stored results
 
 # Librairies
 try:
-    from tools import utils, filtering, spectro, image_matching
+    from tools import pipeline, image_matching
 except:
-    from LagoPObs.tools import utils, filtering, spectro, image_matching
+    from LagoPObs.tools import pipeline, image_matching
 
 import cv2
+import matplotlib.pyplot as plt
 
 # parameters
 input_dir = "LagoPObs/Examples"
+list_wavs = [
+    "rock_ptarmigan_1.wav",
+    "rock_ptarmigan_2.wav",
+]  # only the two ptarmigan sounds here
 wlt_filt = "Yes"  # Wavelet filtering?
 f_filt = [950, 2800]  # frequency bandwidth
 wlen = 281  # Window length
@@ -19,33 +25,18 @@ ovlp_env = 90  # overlap spectro enveloppe
 n_matches = 53  # number of matches
 detector_methode = "ORB custom"  # Feature extraction algorithm
 
-# Perform analysis
-# filter the WAV filenames in the input directory
-list_wavs = utils.filter_wavs(input_dir)
-list_wavs = list_wavs[1:]  # only the two ptarmigan sounds here
-
-# Import the sounds, transform them in float64 arrays
-# and normalize them by their RMS
-list_arr, sf = utils.import_wavs(list_wavs, input_dir, f_filt[1])
-# Bandpass filtering
-list_arr_filt = [filtering.butterfilter(a, sf, f_filt) for a in list_arr]
-# Wavelet filtering if wlt_fit == "Yes"
-if wlt_filt == "Yes":
-    list_arr_filt = [filtering.wlt_denoise(a) for a in list_arr_filt]
-arr_filt = utils.pad_signals(list_arr_filt)
-# Drawing the spectrograms
-spectros = [
-    spectro.draw_specs(
-        a,
-        int(wlen),
-        int(ovlp),
-        int(wlen_env),
-        int(ovlp_env),
-        sf,
-        f_filt,
-    )
-    for a in arr_filt
-]
+# Perform analysis up to the spectrograms
+pipe = pipeline.Pipeline(
+    input_dir,
+    list_wavs=list_wavs,
+    wlt_filt=wlt_filt,
+    f_filt=f_filt,
+    wlen=wlen,
+    ovlp=ovlp,
+    wlen_env=wlen_env,
+    ovlp_env=ovlp_env,
+)
+spectros = pipe.result("spectrogram")
 # Transformation in 8 bits images for compatibility with OpenCV
 spec_8bits = [image_matching.transfo_8bits(s) for s in spectros]
 # Initiate the detector and matcher
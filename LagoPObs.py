@@ -1,14 +1,15 @@
 import sys
 import os
 import time
+import base64
 import tkinter as tk
 from tkinter import ttk
 from tkinter.messagebox import showwarning, showerror, askyesno
 from tkinter import filedialog
 from tkinter import font
 import numpy as np
-import pandas as pd
-from tools import utils, filtering, spectro, image_matching, pop_estimation
+import cv2  # opencv-python
+from tools import pipeline, checkpoint, resources, utils, match_explorer, planner
 
 # Variables
 # List of choices for overlap
@@ -26,6 +27,9 @@ default_lago_vars = [
     "ORB custom",
     "Affinity Propagation",
     "Yes",
+    "HQ",
+    "auto",
+    "No",
 ]
 # Option for wavelet filtering
 wlt_filt_list = ["Yes", "No"]
@@ -43,6 +47,8 @@ algo_clustering_list = [
 ]
 # Choice for the estimation of population
 estim_pop_list = ["Yes", "No"]
+# Choice for the quality of the resampling
+resample_quality_list = ["HQ", "MQ", "LQ"]
 
 
 # Main window
@@ -51,7 +57,7 @@ class LagoPopObsUI(tk.Tk):
         tk.Tk.__init__(self)
         # Prepare the grid
         # Rows
-        for i in range(21):
+        for i in range(25):
             self.grid_rowconfigure(i, weight=0)
         # Columns
         self.grid_columnconfigure(0, weight=1, uniform="same_group")
@@ -78,6 +84,9 @@ class LagoPopObsUI(tk.Tk):
         self.algo_features = tk.StringVar(self, default_lago_vars[8])
         self.algo_clustering = tk.StringVar(self, default_lago_vars[9])
         self.estim_pop = tk.StringVar(self, default_lago_vars[10])
+        self.resample_quality = tk.StringVar(self, default_lago_vars[11])
+        self.resources = tk.StringVar(self, default_lago_vars[12])
+        self.store_checkpoints = tk.StringVar(self, default_lago_vars[13])
         # Welcome text
         lab_welcome = ttk.Label(
             self,
@@ -187,17 +196,45 @@ class LagoPopObsUI(tk.Tk):
         combo_estim_pop["values"] = estim_pop_list
         combo_estim_pop["state"] = "readonly"
         combo_estim_pop.grid(row=19, column=1, **default_grid)
+        # Quality of the resampling
+        lab_resample_quality = ttk.Label(text="Resampling quality:")
+        lab_resample_quality.grid(row=20, column=0, **default_grid)
+        combo_resample_quality = ttk.Combobox(self, textvariable=self.resample_quality)
+        combo_resample_quality["values"] = resample_quality_list
+        combo_resample_quality["state"] = "readonly"
+        combo_resample_quality.grid(row=20, column=1, **default_grid)
+        # Split of the processors between workers and threads
+        lab_resources = ttk.Label(text="Workers x threads (e.g. 4x2, auto):")
+        lab_resources.grid(row=21, column=0, **default_grid)
+        entry_resources = ttk.Entry(self, textvariable=self.resources)
+        entry_resources.grid(row=21, column=1, **default_grid)
+        # Storage of the results of each stage, to resume the run or explore its matches
+        check_checkpoints = ttk.Checkbutton(
+            self,
+            text="Store the checkpoints (resume the run, explore its matches; hashes the files and takes disk space)",
+            variable=self.store_checkpoints,
+            onvalue="Yes",
+            offvalue="No",
+        )
+        check_checkpoints.grid(row=22, column=0, columnspan=2, **default_grid)
         # Button to validate the parameters and proceed to analysis
         button_proceed = ttk.Button(
             self, text="Validate and proceed to analysis", command=self.validate_proceed
         )
-        button_proceed.grid(row=20, column=0, columnspan=2, **default_separator)
+        button_proceed.grid(row=23, column=0, columnspan=2, **default_separator)
+        # Button to draw the matches of the run saved in the output folder
+        button_explore = ttk.Button(
+            self,
+            text="Explore the matches of the run in the output folder",
+            command=self.explore_matches,
+        )
+        button_explore.grid(row=24, column=0, columnspan=2, **default_grid)
 
     def input_folder(self):
         folder = filedialog.askdirectory(initialdir=self.dir_input.get())
         if folder != ():
             files = os.listdir(folder)
-            wav_check = any([f.endswith(".wav") for f in files])
+            wav_check = any([utils.is_audio_file(f) for f in files])
             if wav_check:
                 self.text_dir_input.configure(state="normal")
                 self.text_dir_input.delete("0.0", tk.END)
@@ -207,7 +244,7 @@ class LagoPopObsUI(tk.Tk):
             else:
                 showwarning(
                     title="Wrong input folder!",
-                    message="No WAV files in your input folder!",
+                    message="No WAV, FLAC or OGG files in your input folder!",
                 )
 
     def output_folder(self):
@@ -219,6 +256,96 @@ class LagoPopObsUI(tk.Tk):
             self.dir_output.set(folder)
             self.text_dir_input.configure(state="disabled")
 
+    def explore_matches(self):
+        # The spectrograms and keypoints are read from the checkpoints of the run
+        try:
+            self.run = match_explorer.open_run(self.dir_output.get())
+        except (ValueError, FileNotFoundError):
+            showerror(
+                title="No run to explore!",
+                message="The output folder does not contain the results of a run with its checkpoints. Run the analysis with the checkpoints stored to explore its matches.",
+            )
+            return
+        explorer = tk.Toplevel()
+        explorer.title("Match explorer")
+        files = list(self.run["files"])
+        clusters = [
+            str(int(c)) for c in np.unique(self.run["clusters"]) if not np.isnan(c)
+        ]
+        self.explore_file_1 = tk.StringVar(explorer, files[0])
+        self.explore_file_2 = tk.StringVar(explorer, files[min(1, len(files) - 1)])
+        self.explore_cluster = tk.StringVar(explorer, clusters[0] if clusters else "")
+        self.explore_text = tk.StringVar(explorer, "")
+        ttk.Label(explorer, text="First file:").grid(row=0, column=0, sticky="w")
+        ttk.Combobox(
+            explorer, textvariable=self.explore_file_1, values=files, width=50
+        ).grid(row=0, column=1, sticky="ew")
+        ttk.Label(explorer, text="Second file:").grid(row=1, column=0, sticky="w")
+        ttk.Combobox(
+            explorer, textvariable=self.explore_file_2, values=files, width=50
+        ).grid(row=1, column=1, sticky="ew")
+        ttk.Button(explorer, text="Draw the pair", command=self.draw_pair).grid(
+            row=2, column=0, columnspan=2, sticky="ew"
+        )
+        ttk.Label(explorer, text="Cluster:").grid(row=3, column=0, sticky="w")
+        ttk.Combobox(explorer, textvariable=self.explore_cluster, values=clusters).grid(
+            row=3, column=1, sticky="ew"
+        )
+        ttk.Button(
+            explorer,
+            text="Save the pairs of the cluster in the matches folder",
+            command=self.draw_cluster,
+        ).grid(row=4, column=0, columnspan=2, sticky="ew")
+        ttk.Label(explorer, textvariable=self.explore_text, wraplength=600).grid(
+            row=5, column=0, columnspan=2
+        )
+        self.explore_image = ttk.Label(explorer)
+        self.explore_image.grid(row=6, column=0, columnspan=2)
+
+    def draw_pair(self):
+        try:
+            i = match_explorer.file_index(self.run, self.explore_file_1.get())
+            j = match_explorer.file_index(self.run, self.explore_file_2.get())
+        except ValueError as e:
+            showerror(title="Unknown file!", message=str(e))
+            return
+        img, dist = match_explorer.draw_pair(self.run, i, j)
+        # Displayed at most 800 pixels high
+        scale = min(1.0, 800 / img.shape[0])
+        if scale < 1:
+            img = cv2.resize(
+                img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        png = base64.b64encode(cv2.imencode(".png", img)[1].tobytes())
+        self.explore_photo = tk.PhotoImage(data=png)
+        self.explore_image.configure(image=self.explore_photo)
+        self.explore_text.set(f"Distance: {dist:.2f}")
+
+    def draw_cluster(self):
+        try:
+            pairs = match_explorer.cluster_pairs(
+                self.run, int(self.explore_cluster.get())
+            )
+        except ValueError:
+            showerror(title="Unknown cluster!", message="This cluster has no file.")
+            return
+        try:
+            n_workers, threads_per_worker = resources.parse_resources(
+                self.resources.get()
+            )
+        except ValueError:
+            n_workers, threads_per_worker = None, None
+        df_pairs = match_explorer.render_pairs(
+            self.run["output_dir"],
+            pairs,
+            executor="thread",
+            n_workers=n_workers,
+            threads_per_worker=threads_per_worker,
+        )
+        self.explore_text.set(
+            f"{len(df_pairs)} pairs saved in {os.path.join(self.run['output_dir'], 'matches')}, mean distance: {df_pairs.Distance.mean():.2f}"
+        )
+
     def update_progress(self, new_text="", add_value=20):
         value = self.progress_var.get()
         value += add_value
@@ -230,6 +357,23 @@ class LagoPopObsUI(tk.Tk):
         text += new_text
         self.text_pop.set(text)
 
+    def pipeline_progress(self, stage, event, info):
+        # Texts displayed at the end of the stages of the analysis
+        texts = {
+            "wavelet": " done!\nDrawing spectrograms and detecting keypoints...",
+            "detect": " done!\nClustering spectrograms...",
+            "save": " saved!\nAnalysis finished!",
+        }
+        if event == "end" and stage == "cluster":
+            n_clust = len(np.unique(self.pipe.result("cluster")))
+            self.update_progress(
+                new_text=f" done, {n_clust} clusters found!\nSaving files..."
+            )
+        elif event == "end" and stage in texts:
+            self.update_progress(new_text=texts[stage])
+        # Keep the window responsive
+        self.popup.update()
+
     def validate_proceed(self):
         # Config font size
         font1 = font.Font(name="TkCaptionFont", exists=True)
@@ -241,9 +385,11 @@ class LagoPopObsUI(tk.Tk):
         # Check that input folder exists and contains WAV
         if os.path.isdir(self.dir_input.get()):
             files_input = os.listdir(self.dir_input.get())
-            wav_check = any([f.endswith(".wav") for f in files_input])
+            wav_check = any([utils.is_audio_file(f) for f in files_input])
             if not wav_check:
-                list_problems.append("- Your input folder does not contain WAV files.")
+                list_problems.append(
+                    "- Your input folder does not contain WAV, FLAC or OGG files."
+                )
         else:
             list_problems.append("- Your input folder does not exist.")
         # Check that output folder exists
@@ -284,6 +430,13 @@ class LagoPopObsUI(tk.Tk):
                 list_problems.append(
                     "- The number of matches is too high (>500) compared to the number of extracted features."
                 )
+        # Check the split of the processors between workers and threads
+        try:
+            resources.parse_resources(self.resources.get())
+        except ValueError:
+            list_problems.append(
+                "- The workers x threads must be auto, a number of workers or two numbers separated by x (e.g. 4x2)."
+            )
         # if there are any errors or warnings, display them
         if list_problems:
             list_problems += list_warnings
@@ -311,6 +464,9 @@ class LagoPopObsUI(tk.Tk):
                 "Feature extraction algorithm: ",
                 "Clustering algorithm: ",
                 "Estimation of population: ",
+                "Resampling quality: ",
+                "Workers x threads: ",
+                "Store the checkpoints: ",
             ]
             param_values = [
                 self.dir_input.get(),
@@ -326,21 +482,57 @@ class LagoPopObsUI(tk.Tk):
                 self.algo_features.get(),
                 self.algo_clustering.get(),
                 self.estim_pop.get(),
+                self.resample_quality.get(),
+                self.resources.get(),
+                self.store_checkpoints.get(),
             ]
             param_valid = [p[0] + p[1] for p in zip(param_list, param_values)]
             param_valid = [
                 "Do you wish to proceed with the following parameters?"
             ] + param_valid
+            # Estimate the cost of the run from the headers of the files, and the workers fitting in memory
+            n_workers, threads_per_worker = resources.parse_resources(param_values[14])
+            chunk_size = 16
+            try:
+                plan = planner.plan_run(
+                    param_values[0],
+                    n_workers=n_workers,
+                    f_filt=[int(param_values[3]), int(param_values[4])],
+                    wlen=int(param_values[5]),
+                    ovlp=int(param_values[6]),
+                    wlen_env=int(param_values[7]),
+                    ovlp_env=int(param_values[8]),
+                    n_matches=int(param_values[9]),
+                    detector_methode=param_values[10],
+                    clustering=param_values[11],
+                )
+            except (ValueError, OSError) as e:
+                # The run is not planned if a header cannot be read
+                param_valid += ["", "Estimated cost of the run: unavailable (%s)" % e]
+            else:
+                n_workers, chunk_size = plan["n_workers"], plan["chunk_size"]
+                param_valid += ["", "Estimated cost of the run:"]
+                param_valid += planner.plan_summary(plan).split("\n")
             answer = askyesno(
                 title="Validation of parameters", message="\n".join(param_valid)
             )
             if answer:
+                # A previous run in the same output folder can be resumed
+                resume = False
+                manifest_path = os.path.join(
+                    param_values[1], checkpoint.checkpoint_dir_name, "manifest.json"
+                )
+                if os.path.isfile(manifest_path):
+                    resume = askyesno(
+                        title="Resume previous run",
+                        message="A previous run was found in the output folder. Do you wish to resume it? The steps already done with the same files and parameters will not be computed again.",
+                    )
                 # Display a secondary window
                 self.popup = tk.Toplevel()
                 self.popup.title("State")
                 self.popup.grab_set()  # Main window is disabled
                 # Text to display in popup
-                self.text_pop = tk.StringVar(self, "Importing files...")
+                self.text_pop = tk.StringVar(self, "Importing and filtering files...")
                 lab_popup = ttk.Label(self.popup, textvariable=self.text_pop)
                 lab_popup.grid(row=1, column=0, rowspan=11, columnspan=2)
                 # Progress bar
@@ -354,115 +546,46 @@ class LagoPopObsUI(tk.Tk):
                     length=350,
                 )
                 self.progress_bar.grid(row=0, column=0, columnspan=2, sticky="nsew")
-                # Import list of WAVs
-                list_wavs = utils.filter_wavs(param_values[0])
-                list_arr, sf = utils.import_wavs(
-                    list_wavs, param_values[0], int(param_values[4])
-                )
-                # Update window
-                self.update_progress(new_text=" done!\nFiltering...")
-                self.popup.update()
-                # Filter with bandpass
-                band_freq = [int(param_values[3]), int(param_values[4])]
-                list_arr_filt = [
-                    filtering.butterfilter(a, sf, band_freq) for a in list_arr
-                ]
-                # if wavelet filtering selected
-                if param_values[2] == "Yes":
-                    list_arr_filt = [filtering.wlt_denoise(a) for a in list_arr_filt]
-                # Pad signals so that they have the same length
-                arr_filt = utils.pad_signals(list_arr_filt)
-                # Update window
-                self.update_progress(new_text=" done!\nDrawing spectrograms...")
-                self.popup.update()
-                # Calculate spectrograms
-                wlen = int(param_values[5])
-                ovlp = int(param_values[6])
-                wlen_env = int(param_values[7])
-                ovlp_env = int(param_values[8])
-                spectros = [
-                    spectro.draw_specs(a, wlen, ovlp, wlen_env, ovlp_env, sf, band_freq)
-                    for a in arr_filt
-                ]
-                # Update window
-                self.update_progress(new_text=" done!\nClustering spectrograms...")
-                self.popup.update()
-                # Clustering spectrograms
-                clusters, kp_desc = image_matching.cluster_spectro(
-                    spectros, int(param_values[9]), param_values[10], param_values[11]
+                # Prepare the analysis
+                self.pipe = pipeline.Pipeline(
+                    param_values[0],
+                    param_values[1],
+                    executor="thread",
+                    n_workers=n_workers,
+                    threads_per_worker=threads_per_worker,
+                    chunk_size=chunk_size,
+                    wlt_filt=param_values[2],
+                    f_filt=[int(param_values[3]), int(param_values[4])],
+                    wlen=int(param_values[5]),
+                    ovlp=int(param_values[6]),
+                    wlen_env=int(param_values[7]),
+                    ovlp_env=int(param_values[8]),
+                    n_matches=int(param_values[9]),
+                    detector_methode=param_values[10],
+                    clustering=param_values[11],
+                    resample_quality=param_values[13],
+                    checkpoint=param_values[15] == "Yes",
+                    resume=resume,
                 )
-                n_clust = len(np.unique(clusters))
-                # Update window
-                self.update_progress(
-                    new_text=f" done, {n_clust} clusters found!\nSaving files..."
-                )
-                self.popup.update()
-                # Save the clustering results
-                # It is really important to create the DataFrame with a dict here
-                # otherwise, you will create dobjects and it can impede the cluster order in the following result and thus impede the quality of the results.
-                df_res = pd.DataFrame({"File": list_wavs, "Cluster": clusters})
-                df_res.to_csv(param_values[1] + "/clustering_results.csv", index=False)
-                # Save the spectrograms with the keypoints in it
-                image_matching.save_spectros_keypoints(
-                    spectros, kp_desc, list_wavs, param_values[1]
-                )
-                # Update window
-                self.update_progress(new_text=" saved!\nAnalysis finished!")
-                self.popup.update()
+                self.pipe.add_hook(self.pipeline_progress)
+                # Import, filter, draw the spectrograms, cluster them and save the results
+                self.pipe.result("save")
                 # If population estimation is asked
                 if param_values[12] == "Yes":
                     self.update_progress(new_text="\nPopulation estimation...")
                     self.popup.update()
                     try:
-                        df_res_with_date = pop_estimation.add_date_to_df(df_res)
+                        dict_pop = self.pipe.result("population")
                     except ValueError:
                         showerror(
                             title="Wrong filename format!",
                             message="Population estimation not performed as the filenames format is wrong. Filenames must be split in different parts, separated by undescores, with the date in the second position and with the following format: yearmonthday. For example: 'xxxxx_20230619_xxxxxx.wav' means that the following file was recorded in June 13, 2023.",
                         )
                     else:
-                        n_clusts_per_day = pop_estimation.daily_vocalize_clusters(
-                            df_res_with_date
-                        )
-                        n_clusts_per_day.to_csv(
-                            param_values[1] + "/number_of_clusters_per_day.csv",
-                            index=False,
-                        )
-                        pres = pop_estimation.presence_clusters(df_res_with_date)
-                        pres.to_csv(
-                            param_values[1]
-                            + "/number_of_sounds_per_cluster_per_date.csv"
-                        )
-                        pi_arr = pop_estimation.presence_index_arr(df_res_with_date)
-                        pi_df = pd.DataFrame(
-                            pi_arr,
-                            columns=[
-                                "Cluster",
-                                "Days_of_presence",
-                                "Number_of_sounds",
-                                "Presence_index",
-                            ],
-                        )
-                        sorted_pi_df = pi_df.sort_values(
-                            by="Presence_index", ascending=False
-                        )
-                        sorted_pi_df.to_csv(
-                            param_values[1] + "/presence_index.csv", index=False
-                        )
-                        # Estimation of resident individuals according to Presence Index
-                        n_indiv_pi = np.count_nonzero(pi_arr[:, 3] >= 0.01)
-                        # Estimation of the whole population using Population Information Criterion
-                        pi_pop = pop_estimation.population_presence_index(pi_arr, pres)
-                        n_indiv_pic, df_pic = (
-                            pop_estimation.estimate_number_of_individuals(pi_pop)
-                        )
-                        df_pic.to_csv(param_values[1] + "/PPI_PIC.csv", index=False)
                         # Update window
-                        res_print = f"done!\nEstimated number of individuals using PI: {n_indiv_pi}\nEstimated number of individuals using PIC: {n_indiv_pic}"
+                        res_print = "done!\n" + pipeline.population_summary(dict_pop)
                         self.update_progress(new_text=res_print)
                         self.popup.update()
-                        # Print results in file
-                        print(res_print, open(param_values[1] + "/results.txt", "w"))
 
                 # Button to close the popup
                 button_finish = ttk.Button(
@@ -0,0 +1,49 @@
+### Benchmark of the bag-of-visual-words similarity against the pairwise matching
+# Compare the clusters found using the embeddings (linear in the number of files) with the ones
+# found by matching all the pairs of spectrograms, and the runtime of both
+import time
+from sklearn.metrics import adjusted_rand_score, adjusted_mutual_info_score
+
+try:
+    from tools import pipeline
+except:
+    from LagoPObs.tools import pipeline
+
+# Variables
+input_dir = "Examples"  # directory with sounds, ideally a few hundred files
+detector_methode = "ORB custom"
+clustering = "Affinity Propagation"
+list_n_words = [64, 256]  # sizes of vocabulary to test
+list_encodings = ["histogram", "vlad"]
+
+pipe = pipeline.Pipeline(
+    input_dir,
+    executor="thread",
+    detector_methode=detector_methode,
+    clustering=clustering,
+)
+# The upstream stages are shared by all the runs
+start = time.perf_counter()
+pipe.result("detect")
+print(
+    f"{len(pipe.list_wavs)} files, import to keypoints: {time.perf_counter() - start:.2f} s"
+)
+
+# Reference: pairwise matching
+start = time.perf_counter()
+ref_labels = pipe.result("cluster")
+t_ref = time.perf_counter() - start
+print(f"matching: {t_ref:.2f} s, {len(set(ref_labels))} clusters")
+
+for encoding in list_encodings:
+    for n_words in list_n_words:
+        pipe.set_params(similarity="bovw", encoding=encoding, n_words=n_words)
+        start = time.perf_counter()
+        labels = pipe.result("cluster")
+        t_bovw = time.perf_counter() - start
+        print(
+            f"bovw {encoding}, {n_words} words: {t_bovw:.2f} s ({t_ref / t_bovw:.1f}x), "
+            f"{len(set(labels))} clusters, "
+            f"ARI: {adjusted_rand_score(ref_labels, labels):.3f}, "
+            f"AMI: {adjusted_mutual_info_score(ref_labels, labels):.3f}"
+        )
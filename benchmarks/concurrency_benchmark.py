@@ -0,0 +1,56 @@
+### Benchmark of the split of the processors between workers and threads
+# Run the pipeline up to the clustering with several numbers of workers and threads per worker,
+# and print the throughput of each stage (files per second) for each split
+import os
+import time
+
+try:
+    from tools import pipeline, resources
+except:
+    from LagoPObs.tools import pipeline, resources
+
+# Variables
+input_dir = "Examples"  # directory with sounds, ideally a few hundred files
+executor = "process"  # "thread" or "process" for the per-file stages
+detector_methode = "ORB custom"
+clustering = "Affinity Propagation"
+n_cpus = os.cpu_count()
+# Splits to test, as workers x threads per worker
+list_splits = dict.fromkeys(
+    [(n_cpus, 1), (max(1, n_cpus // 2), 2), (max(1, n_cpus // 4), 4), (1, n_cpus)]
+)
+list_stages = ["wavelet", "spectrogram", "detect", "match", "cluster"]
+
+
+def main():
+    """
+    Run the pipeline with each split and print the throughputs.
+    """
+    print(f"{n_cpus} processors, executor: {executor}")
+    print("workers x threads: " + ", ".join(f"{s} (files/s)" for s in list_stages))
+    for n_workers, threads_per_worker in list_splits:
+        res_config = resources.resource_config(n_workers, threads_per_worker)
+        pipe = pipeline.Pipeline(
+            input_dir,
+            executor=executor,
+            n_workers=res_config["n_workers"],
+            threads_per_worker=res_config["threads_per_worker"],
+            detector_methode=detector_methode,
+            clustering=clustering,
+        )
+        start = time.perf_counter()
+        pipe.result("cluster")
+        total = time.perf_counter() - start
+        n_files = len(pipe.list_wavs)
+        throughputs = ", ".join(
+            f"{n_files / max(pipe.timings[s], 1e-9):.1f}" for s in list_stages
+        )
+        print(
+            f"{res_config['n_workers']} x {res_config['threads_per_worker']}: {throughputs}, "
+            f"total {total:.2f} s ({n_files / total:.1f} files/s)"
+        )
+
+
+# Only in the main process: the workers of the process executor (started with spawn on Windows and macOS) import this script again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+### Benchmark of the import of WAV files against the same sounds stored as FLAC
+# The WAV files of input_dir are converted to FLAC in a temporary directory, then both directories are
+# imported (decoding, resampling and normalization by the RMS) and the throughput of each is printed
+import os
+import tempfile
+import time
+import scipy.io.wavfile as wav
+import soundfile
+
+try:
+    from tools import pipeline, utils
+except:
+    from LagoPObs.tools import pipeline, utils
+
+# Variables
+input_dir = "Examples"  # directory with WAV files, ideally a few hundred files
+executor = "process"  # "serial", "thread" or "process"
+n_workers = None  # None to use all processors
+n_runs = 3  # the best run is kept
+
+
+def main():
+    """
+    Convert the WAV files to FLAC, import both and print the throughputs.
+    """
+    list_wavs = [w for w in utils.filter_wavs(input_dir) if w.lower().endswith(".wav")]
+    with tempfile.TemporaryDirectory() as flac_dir:
+        for w in list_wavs:
+            sf, sound = wav.read(os.path.join(input_dir, w))
+            soundfile.write(
+                os.path.join(flac_dir, os.path.splitext(w)[0] + ".flac"), sound, sf
+            )
+        for name, directory in [("WAV", input_dir), ("FLAC", flac_dir)]:
+            files = [
+                f
+                for f in utils.filter_wavs(directory)
+                if f.lower().endswith(name.lower())
+            ]
+            size = sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+            list_times = []
+            for _ in range(n_runs):
+                pipe = pipeline.Pipeline(
+                    directory, executor=executor, n_workers=n_workers, list_wavs=files
+                )
+                start = time.perf_counter()
+                list_arr = pipe.result("import")
+                list_times.append(time.perf_counter() - start)
+            duration = min(list_times)
+            n_samples = sum(len(a) for a in list_arr)
+            print(
+                f"{name}: {len(files)} files, {size / 1e6:.1f} MB, {duration:.2f} s "
+                f"({len(files) / duration:.1f} files/s, {size / 1e6 / duration:.1f} MB/s, "
+                f"{n_samples / duration / 1e6:.1f} M resampled samples/s)"
+            )
+
+
+# Only in the main process: the workers of the process executor (started with spawn on Windows and macOS) import this script again
+if __name__ == "__main__":
+    main()
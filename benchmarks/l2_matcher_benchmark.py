@@ -0,0 +1,83 @@
+### Validation of the BLAS matcher and of the compressed descriptors of SIFT and KAZE against the OpenCV matcher
+# Match the descriptors of the same files with the brute-force matcher of OpenCV, the L2Matcher and the
+# L2Matcher on PCA-reduced and 8-bit descriptors, then report how much the distances, the nearest
+# neighbour of each file and the clusters change, with the memory of the descriptors and the runtime
+import time
+import numpy as np
+import pandas as pd
+from sklearn.metrics import adjusted_rand_score
+
+try:
+    from tools import image_matching, pipeline
+except:
+    from LagoPObs.tools import image_matching, pipeline
+
+# Variables
+input_dir = "Examples"  # directory with sounds, ideally a few hundred files
+detector_methode = "SIFT"  # "SIFT" or "KAZE"
+n_matches = 53
+n_components = 32  # principal components kept by the "pca" compression
+clustering = "Affinity Propagation"
+csv_path = None  # path of a CSV file where the report is saved, None to only print it
+
+pipe = pipeline.Pipeline(
+    input_dir, executor="thread", detector_methode=detector_methode
+)
+descriptors = [kd[1] for kd in pipe.result("detect")]
+n_files = len(descriptors)
+print(
+    f"{n_files} files, {np.mean([0 if d is None else len(d) for d in descriptors]):.0f} keypoints per file"
+)
+
+runs = [
+    ("opencv", "No"),
+    ("blas", "No"),
+    ("blas", "pca"),
+    ("blas", "int8"),
+]
+reports = []
+for matcher_name, compression in runs:
+    _, matcher = image_matching.feature_detector_matcher(
+        detector_methode, matcher=matcher_name
+    )
+    start = time.perf_counter()
+    matched = descriptors
+    if compression != "No":
+        matched, matcher.scale = image_matching.compress_descriptors(
+            descriptors, compression, n_components
+        )
+    dist = image_matching.distance_matrix(matched, matcher, n_matches)
+    duration = time.perf_counter() - start
+    labels = image_matching.clustering_matches(dist, clustering_name=clustering)
+    if matcher_name == "opencv":
+        dist_ref, labels_ref = dist, labels
+    # Pairs matched in both runs, off the diagonal
+    finite = (dist_ref < 1e10) & (dist < 1e10) & ~np.eye(n_files, dtype=bool)
+    error = np.abs(dist - dist_ref)[finite]
+    rel_error = error / np.maximum(dist_ref[finite], np.finfo(float).tiny)
+    # Closest other file of each file
+    off_diag = np.eye(n_files) * 1e20
+    same_nn = np.argmin(dist + off_diag, axis=1) == np.argmin(
+        dist_ref + off_diag, axis=1
+    )
+    reports.append(
+        {
+            "Matcher": matcher_name,
+            "Compression": compression,
+            "Runtime_s": duration,
+            "Descriptors_MB": sum(d.nbytes for d in matched if d is not None) / 1e6,
+            "Max_relative_difference": np.max(rel_error, initial=0),
+            "Mean_relative_difference": np.mean(rel_error) if len(error) else 0,
+            "Distance_correlation": (
+                np.corrcoef(dist[finite], dist_ref[finite])[0, 1]
+                if len(error) > 1
+                else 1
+            ),
+            "Same_nearest_file": np.mean(same_nn),
+            "Adjusted_Rand_index": adjusted_rand_score(labels_ref, labels),
+        }
+    )
+df_report = pd.DataFrame(reports)
+print(df_report.to_string(index=False, float_format="%.4g"))
+if csv_path is not None:
+    df_report.to_csv(csv_path, index=False)
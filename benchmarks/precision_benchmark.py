@@ -0,0 +1,90 @@
+### Validation of the float32 precision mode against the float64 path
+# Run the analysis in double and in single precision on the same files, then report how often the
+# cluster labels differ between both runs, the memory of the signals, spectrograms and distances and the runtime
+import time
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from sklearn.metrics import adjusted_rand_score
+
+try:
+    from tools import pipeline
+except:
+    from LagoPObs.tools import pipeline
+
+# Variables
+input_dir = "Examples"  # directory with sounds, ideally a few hundred files
+detector_methode = "ORB custom"
+clustering = "Affinity Propagation"
+executor = "thread"  # "serial", "thread" or "process"
+csv_path = None  # path of a CSV file where the report is saved, None to only print it
+
+
+def run(precision):
+    pipe = pipeline.Pipeline(
+        input_dir,
+        executor=executor,
+        detector_methode=detector_methode,
+        clustering=clustering,
+        precision=precision,
+    )
+    start = time.perf_counter()
+    labels = pipe.result("cluster")
+    duration = time.perf_counter() - start
+    nbytes = {
+        "Signals_MB": sum(a.nbytes for a in pipe.result("wavelet")) / 1e6,
+        "Padded_MB": pipe.result("pad").nbytes / 1e6,
+        "Distances_MB": getattr(pipe.result("match"), "nbytes", 0) / 1e6,
+    }
+    return pipe, np.asarray(labels), duration, nbytes
+
+
+pipe64, labels64, t64, nbytes64 = run("float64")
+pipe32, labels32, t32, nbytes32 = run("float32")
+
+# The labels of both runs are only defined up to a permutation: each float32 cluster is paired
+# with the float64 cluster it shares the most files with before counting the differing files
+clusters64, inv64 = np.unique(labels64, return_inverse=True)
+clusters32, inv32 = np.unique(labels32, return_inverse=True)
+contingency = np.zeros((len(clusters64), len(clusters32)), dtype=int)
+np.add.at(contingency, (inv64, inv32), 1)
+rows, cols = linear_sum_assignment(-contingency)
+n_files = len(labels64)
+n_differ = n_files - contingency[rows, cols].sum()
+# Pairs of files put together in one run and apart in the other
+same64 = inv64[:, None] == inv64[None, :]
+same32 = inv32[:, None] == inv32[None, :]
+n_pairs = n_files * (n_files - 1) // 2
+pair_differ = np.triu(same64 != same32, k=1).sum() / max(n_pairs, 1)
+# The 8-bit spectrograms differ where the rounding of a pixel changed, which can move the keypoints
+spec_differ = pipe64.result("spectrogram") != pipe32.result("spectrogram")
+n_spec_differ = np.any(spec_differ, axis=(1, 2)).sum()
+dist64, dist32 = pipe64.result("match"), pipe32.result("match")
+if hasattr(dist64, "toarray"):
+    dist64, dist32 = dist64.toarray(), dist32.toarray()
+finite = (dist64 < 1e10) & (dist32 < 1e10)
+dist_error = np.max(np.abs(dist64[finite] - dist32[finite]), initial=0)
+
+print(
+    f"{n_files} files, {len(clusters64)} clusters in float64, {len(clusters32)} in float32"
+)
+print(
+    f"Adjusted Rand index between both runs: {adjusted_rand_score(labels64, labels32):.4f}"
+)
+print(f"Files with a different cluster: {n_differ} ({100 * n_differ / n_files:.2f} %)")
+print(f"Pairs of files grouped differently: {100 * pair_differ:.2f} %")
+print(
+    f"Spectrogram pixels differing: {spec_differ.sum()} ({100 * spec_differ.mean():.4f} %), in {n_spec_differ} files"
+)
+print(f"Largest difference of the distances: {dist_error:.4g}")
+df_report = pd.DataFrame(
+    [
+        {"Precision": "float64", "Runtime_s": t64, **nbytes64},
+        {"Precision": "float32", "Runtime_s": t32, **nbytes32},
+    ]
+)
+print(df_report.to_string(index=False, float_format="%.2f"))
+if csv_path is not None:
+    df_report["Files_differing"] = [0, n_differ]
+    df_report["Adjusted_Rand_index"] = [1, adjusted_rand_score(labels64, labels32)]
+    df_report.to_csv(csv_path, index=False)
@@ -0,0 +1,5 @@
+# Makes the tools package importable by the tests in tests/, whatever the directory pytest is run from
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -1,12 +1,9 @@
 ### Demo script
 # Import
-import numpy as np
-import pandas as pd
-
 try:
-    from tools import utils, filtering, spectro, image_matching, pop_estimation
+    from tools import pipeline, planner
 except:
-    from LagoPObs.tools import utils, filtering, spectro, image_matching, pop_estimation
+    from LagoPObs.tools import pipeline, planner
 
 # Variables: same as the default in the GUI
 input_dir = ""  # directory with sounds
@@ -21,77 +18,127 @@ n_matches = 53  # number of matches
 detector_methode = "ORB custom"  # Feature extraction algorithm
 clustering = "Affinity Propagation"  # Clustering algorithm
 estim_pop = "Yes"
-
-# Perform analysis
-# filter the WAV filenames in the input directory
-list_wavs = utils.filter_wavs(input_dir)
-# Import the sounds, transform them in float64 arrays
-# and normalize them by their RMS
-list_arr, sf = utils.import_wavs(list_wavs, input_dir, f_filt[1])
-# Bandpass filtering
-list_arr_filt = [filtering.butterfilter(a, sf, f_filt) for a in list_arr]
-# Wavelet filtering if wlt_fit == "Yes"
-if wlt_filt == "Yes":
-    list_arr_filt = [filtering.wlt_denoise(a) for a in list_arr_filt]
-arr_filt = utils.pad_signals(list_arr_filt)
-# Drawing the spectrograms
-spectros = [
-    spectro.draw_specs(
-        a,
-        int(wlen),
-        int(ovlp),
-        int(wlen_env),
-        int(ovlp_env),
-        sf,
-        f_filt,
-    )
-    for a in arr_filt
-]
-# clustering the spectrograms
-clusters, kp_desc = image_matching.cluster_spectro(
-    spectros, n_matches, detector_methode, clustering
+recursive = "No"  # "Yes" to also analyze the sounds of the subdirectories of input_dir
+resample_quality = "HQ"  # Resampling quality, "MQ" or "LQ" for quick preview runs
+precision = "float64"  # "float32" to halve the memory of the signals, spectrograms and distances
+dedup = "No"  # "Yes" to match only one spectrogram per group of duplicates
+dedup_distance = (
+    4  # maximum Hamming distance (in bits) between the hashes of duplicates
 )
-# Save the spectrograms with the keypoints in it
-image_matching.save_spectros_keypoints(spectros, kp_desc, list_wavs, output_dir)
-# Save the clustering results
-# It is really important to create the DataFrame with a dict here,
-# otherwise, it can impede the cluster order and thus the results.
-df_res = pd.DataFrame({"File": list_wavs, "Cluster": clusters})
-df_res.to_csv(output_dir + "/clustering_results.csv", index=False)
+similarity = "matching"  # "bovw" to compare bag-of-visual-words embeddings instead of matching all the pairs
+n_words = 256  # size of the visual vocabulary (bovw only)
+encoding = "histogram"  # "histogram" or "vlad" (bovw only)
+n_candidates = None  # number of likely neighbours matched per spectrogram, None to match all the pairs
+matcher = "opencv"  # "blas" to match the descriptors of SIFT and KAZE by blocks with matrix multiplications
+compression = "No"  # "pca" or "int8" to compress the descriptors of SIFT and KAZE (blas matcher only)
+n_components = 32  # number of principal components kept by the "pca" compression
+fill_value = (
+    None  # distance of the pairs not matched, None for the largest matching distance
+)
+screen = "No"  # "Yes" to exclude the files without calls (wind, rain...) before the heavy stages
+min_band_ratio = 0.01  # minimum ratio of energy in f_filt (screening)
+min_modulation = 0.6  # minimum modulation of the envelope at the pulse rate (screening)
+pulse_rate = [10, 50]  # range of pulse rates of the calls, in Hz (screening)
+min_keypoints = 0  # files with less keypoints are not matched
+date_pattern = "default"  # "default" for xxx_20230619_xxx.wav, "audiomoth" for 20230619_053000.WAV, or a regular expression capturing the date
+date_format = None  # format of the captured date (e.g. "%Y-%m-%d"), None for the one of a named date_pattern
+window_days = None  # length in days of the windows over which the population is also estimated, None for the whole dataset only
+step_days = 1  # days between two windows
+expanding_window = "No"  # "Yes" for windows all starting on the first day
+n_bootstrap = 0  # bootstrap replicates of the confidence intervals of the number of individuals, 0 to skip
+n_replicates = 0  # number of subsamples clustered again to estimate the stability of the clusters, 0 to skip
+checkpoint = True  # store the results of each stage in output_dir/checkpoints
+resume = False  # True to resume an interrupted run, the stages done with the same files and parameters are reused
+executor = "thread"  # "serial", "thread" or "process" for the per-file stages
+n_workers = None  # workers of the per-file stages, None to use all processors
+threads_per_worker = None  # threads of OpenCV and BLAS per worker, None to share the processors between the workers
 
-# Population estimation
-if estim_pop == "Yes":
-    try:
-        df_res_with_date = pop_estimation.add_date_to_df(df_res)
-    except ValueError:
+# Perform the analysis only in the main process: the workers of the "process" executor import this script again
+if __name__ == "__main__":
+    # Prepare the analysis: nothing is computed until a result is asked for
+    pipe = pipeline.Pipeline(
+        input_dir,
+        output_dir,
+        executor=executor,
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        checkpoint=checkpoint,
+        resume=resume,
+        recursive=recursive,
+        wlt_filt=wlt_filt,
+        f_filt=f_filt,
+        wlen=wlen,
+        ovlp=ovlp,
+        wlen_env=wlen_env,
+        ovlp_env=ovlp_env,
+        n_matches=n_matches,
+        detector_methode=detector_methode,
+        clustering=clustering,
+        resample_quality=resample_quality,
+        precision=precision,
+        dedup=dedup,
+        dedup_distance=dedup_distance,
+        similarity=similarity,
+        n_words=n_words,
+        encoding=encoding,
+        n_candidates=n_candidates,
+        matcher=matcher,
+        compression=compression,
+        n_components=n_components,
+        fill_value=fill_value,
+        screen=screen,
+        min_band_ratio=min_band_ratio,
+        min_modulation=min_modulation,
+        pulse_rate=pulse_rate,
+        min_keypoints=min_keypoints,
+        date_pattern=date_pattern,
+        date_format=date_format,
+        window_days=window_days,
+        step_days=step_days,
+        expanding_window=expanding_window,
+        n_bootstrap=n_bootstrap,
+    )
+    # Print the duration of each stage
+    pipe.add_hook(pipeline.timing_hook)
+    if resume:
         print(
-            "Wrong filename format! The filenames must be split in different part, separated by undescores, with the date in the second position and with the following format: yearmonthday. For example: 'xxxxx_20230619_xxxxxx.wav' means that the following file was recorded in June 13, 2023."
+            "Stages reused from the previous run:", ", ".join(pipe.resumable_stages())
         )
-    else:
-        n_clusts_per_day = pop_estimation.daily_vocalize_clusters(df_res_with_date)
-        n_clusts_per_day.to_csv(
-            output_dir + "/Number_of_clusters_per_day.csv", index=False
-        )
-        pres = pop_estimation.presence_clusters(df_res_with_date)
-        pres.to_csv(output_dir + "/number_of_sounds_per_cluster_per_date.csv")
-        pi_arr = pop_estimation.presence_index_arr(df_res_with_date)
-        pi_df = pd.DataFrame(
-            pi_arr,
-            columns=[
-                "Cluster",
-                "Days_of_presence",
-                "Number_of_sounds",
-                "Presence_index",
-            ],
+
+    # Estimated memory and runtime of the run, from the headers of the files only
+    params = {p: v for p, v in pipe.params.items() if p != "input_dir"}
+    plan = planner.plan_run(input_dir, n_workers, checkpoint=checkpoint, **params)
+    print(planner.plan_summary(plan))
+
+    # Perform analysis: import the sounds, resample them and normalize them by their RMS,
+    # filter them, draw the spectrograms, cluster them and save the results
+    # (clustering_results.csv and the spectrograms with the keypoints in it)
+    df_res = pipe.result("save")
+    if screen == "Yes" or min_keypoints > 0:
+        # The excluded files are listed in excluded_files.csv
+        print(pipeline.screening_summary(pipe))
+    if dedup == "Yes":
+        print(
+            "Pairs of spectrograms not matched thanks to the deduplication:",
+            pipe.result("dedup")["pairs_saved"],
         )
-        sorted_pi_df = pi_df.sort_values(by="Presence_index", ascending=False)
-        sorted_pi_df.to_csv(output_dir + "/presence_index.csv", index=False)
-        # Estimation of resident individuals according to Presence Index
-        n_indiv_pi = np.count_nonzero(pi_df.Presence_index >= 0.01)
-        # Estimation of the whole population using Population Information Criterion
-        pi_pop = pop_estimation.population_presence_index(pi_arr, pres)
-        n_indiv_pic, df_pic = pop_estimation.estimate_number_of_individuals(pi_pop)
-        df_pic.to_csv(output_dir + "/PPI_PIC.csv", index=False)
-        res_print = f"Estimated number of individuals using PI: {n_indiv_pi}\nEstimated number of individuals using PIC: {n_indiv_pic}"
-        print(res_print)
-        print(res_print, open(output_dir + "/results.txt", "w"))
+    if n_replicates > 0:
+        # Stability of each cluster and file, saved in cluster_stability.csv and file_stability.csv
+        dict_stab = pipe.stability(n_replicates)
+        print(dict_stab["clusters"])
+    # The intermediate results are cached and can be accessed, e.g.:
+    # spectros = pipe.result("spectrogram")
+    # dist_images = pipe.result("match")
+
+    # Population estimation
+    if estim_pop == "Yes":
+        try:
+            dict_pop = pipe.result("population")
+        except ValueError:
+            print(
+                "Wrong filename format! The filenames must be split in different part, separated by undescores, with the date in the second position and with the following format: yearmonthday. For example: 'xxxxx_20230619_xxxxxx.wav' means that the following file was recorded in June 13, 2023."
+            )
+        else:
+            # Estimation of resident individuals according to Presence Index (threshold of 0.01)
+            # and of the whole population using Population Information Criterion, see pop_estimation.estimate_population
+            print(pipeline.population_summary(dict_pop))
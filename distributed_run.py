@@ -0,0 +1,128 @@
+### Run the analysis on several machines sharing a directory
+# On the machine coordinating the run:
+#   python distributed_run.py coordinator input_dir output_dir --work-dir /shared/work
+# Then on each machine of the cluster (input_dir, output_dir and the work directory must be accessible with the same paths):
+#   python distributed_run.py worker --work-dir /shared/work
+# On a single machine, --local-workers starts workers as local processes.
+import argparse
+
+try:
+    from tools import distributed
+except:
+    from LagoPObs.tools import distributed
+
+
+def main():
+    """
+    Parse the arguments and run the coordinator or a worker.
+    """
+    parser = argparse.ArgumentParser(
+        description="Distribute the per-file stages and the distance matrix on workers sharing a work directory."
+    )
+    subparsers = parser.add_subparsers(dest="role", required=True)
+    coord = subparsers.add_parser(
+        "coordinator", help="split the run in tasks and assemble the results"
+    )
+    coord.add_argument("input_dir", help="folder with the WAV files")
+    coord.add_argument("output_dir", help="folder where the results are saved")
+    coord.add_argument(
+        "--work-dir",
+        required=True,
+        help="shared folder of the tasks, new or empty, or the one of a previous run (only its tasks are removed)",
+    )
+    coord.add_argument(
+        "--local-workers",
+        type=int,
+        default=0,
+        help="number of workers started on this machine",
+    )
+    coord.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="number of threads of each local worker, by default the processors are shared between them",
+    )
+    coord.add_argument(
+        "--chunk-size", type=int, default=16, help="number of files per task"
+    )
+    coord.add_argument(
+        "--tile-rows",
+        type=int,
+        default=64,
+        help="number of rows of the distance matrix per task",
+    )
+    coord.add_argument(
+        "--worker-timeout",
+        type=float,
+        default=120,
+        help="time without heartbeat (s) after which the tasks of a worker are given to the others",
+    )
+    coord.add_argument("--estim-pop", default="Yes", choices=["Yes", "No"])
+    # Parameters of the analysis, same defaults as the GUI
+    coord.add_argument("--wlt-filt", default="Yes", choices=["Yes", "No"])
+    coord.add_argument("--fmin", type=int, default=950)
+    coord.add_argument("--fmax", type=int, default=2800)
+    coord.add_argument("--wlen", type=int, default=281)
+    coord.add_argument("--ovlp", type=int, default=75)
+    coord.add_argument("--wlen-env", type=int, default=706)
+    coord.add_argument("--ovlp-env", type=int, default=90)
+    coord.add_argument("--n-matches", type=int, default=53)
+    coord.add_argument("--detector", default="ORB custom")
+    coord.add_argument("--clustering", default="Affinity Propagation")
+    coord.add_argument(
+        "--date-pattern",
+        default="default",
+        help="dates in the filenames: default (xxx_20230619_xxx.wav), audiomoth (20230619_053000.WAV) or a regular expression capturing the date",
+    )
+    coord.add_argument(
+        "--date-format",
+        default=None,
+        help="format of the date captured by a custom --date-pattern, e.g. %%Y-%%m-%%d",
+    )
+    worker = subparsers.add_parser(
+        "worker", help="do the tasks until the coordinator stops the run"
+    )
+    worker.add_argument("--work-dir", required=True, help="shared folder of the tasks")
+    worker.add_argument(
+        "--id",
+        default=None,
+        help="unique name of the worker, by default the machine name and process id",
+    )
+    worker.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="number of threads used by OpenCV and the BLAS libraries, by default all the processors",
+    )
+    args = parser.parse_args()
+
+    if args.role == "coordinator":
+        distributed.run_coordinator(
+            args.input_dir,
+            args.output_dir,
+            args.work_dir,
+            n_local_workers=args.local_workers,
+            threads_per_worker=args.threads_per_worker,
+            chunk_size=args.chunk_size,
+            tile_rows=args.tile_rows,
+            worker_timeout=args.worker_timeout,
+            estim_pop=args.estim_pop,
+            wlt_filt=args.wlt_filt,
+            f_filt=[args.fmin, args.fmax],
+            wlen=args.wlen,
+            ovlp=args.ovlp,
+            wlen_env=args.wlen_env,
+            ovlp_env=args.ovlp_env,
+            n_matches=args.n_matches,
+            detector_methode=args.detector,
+            clustering=args.clustering,
+            date_pattern=args.date_pattern,
+            date_format=args.date_format,
+        )
+    else:
+        distributed.run_worker(args.work_dir, args.id, threads_per_worker=args.threads)
+
+
+# Only in the main process: the local workers (started with spawn on Windows and macOS) import this script again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+### Draw the matches between the spectrograms of a previous run, from its checkpoints
+import argparse
+
+try:
+    from tools import match_explorer, resources
+except:
+    from LagoPObs.tools import match_explorer, resources
+
+
+def main():
+    """
+    Parse the arguments and draw the matches.
+    """
+    parser = argparse.ArgumentParser(
+        description="Draw the matches between the spectrograms of a run made with checkpoints (the Store the checkpoints option of the GUI), without computing the analysis again. The images are saved in the matches folder of the output folder."
+    )
+    parser.add_argument("output_dir", help="output folder of the run")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        "--pair", nargs=2, metavar="FILE", help="names of the two files to compare"
+    )
+    group.add_argument(
+        "--cluster", type=int, help="draw all the pairs of files of this cluster"
+    )
+    parser.add_argument(
+        "--n-matches",
+        type=int,
+        default=None,
+        help="number of matches drawn, by default the one of the run",
+    )
+    parser.add_argument(
+        "--max-pairs",
+        type=int,
+        default=None,
+        help="maximum number of pairs drawn for a cluster",
+    )
+    parser.add_argument(
+        "--save-dir",
+        default=None,
+        help="folder of the images, by default output_dir/matches",
+    )
+    parser.add_argument(
+        "--resources",
+        default="auto",
+        help="workers x threads per worker, e.g. 4x2, or auto for one single-threaded worker per processor",
+    )
+    args = parser.parse_args()
+    n_workers, threads_per_worker = resources.parse_resources(args.resources)
+
+    run = match_explorer.open_run(args.output_dir)
+    if args.pair is not None:
+        pairs = [tuple(match_explorer.file_index(run, f) for f in args.pair)]
+    else:
+        pairs = match_explorer.cluster_pairs(run, args.cluster, args.max_pairs)
+    df_pairs = match_explorer.render_pairs(
+        args.output_dir,
+        pairs,
+        save_dir=args.save_dir,
+        n_matches=args.n_matches,
+        executor="serial" if len(pairs) == 1 else "process",
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+    )
+    for row in df_pairs.itertuples():
+        print(f"{row.File_1} - {row.File_2}: distance {row.Distance:.2f}, {row.Image}")
+
+
+# Only in the main process: the workers of the process executor (started with spawn on Windows and macOS) import this script again
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+### Reference library of known individuals: build it from a run, then label new recordings against it
+import argparse
+import os
+import pandas as pd
+
+try:
+    from tools import checkpoint, pipeline, reference, resources
+except:
+    from LagoPObs.tools import checkpoint, pipeline, reference, resources
+
+parser = argparse.ArgumentParser(
+    description="Store the exemplars of the individuals identified in a run in a reference library, and label new recordings with the closest individual of the library (or 'new'), by matching them against the exemplars only."
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+build = subparsers.add_parser(
+    "build",
+    help="add the clusters of a run made with checkpoints (the default of the GUI) to a library",
+)
+build.add_argument("output_dir", help="output folder of the run")
+build.add_argument("library_dir", help="folder of the library, created if needed")
+build.add_argument(
+    "--individuals",
+    default=None,
+    help="CSV file with the confirmed clusters in a Cluster column and the names of the individuals in an Individual column, by default all the clusters",
+)
+build.add_argument(
+    "--n-exemplars", type=int, default=5, help="number of exemplars per individual"
+)
+build.add_argument(
+    "--method",
+    default="medoid",
+    choices=["medoid", "affinity"],
+    help="medoids of the matching distances, or Affinity Propagation exemplars",
+)
+build.add_argument(
+    "--threshold",
+    type=float,
+    default=None,
+    help="maximum matching distance to label a file as an individual, estimated from the clusters by default",
+)
+identify = subparsers.add_parser(
+    "identify", help="label the recordings of a folder with the library"
+)
+identify.add_argument("library_dir", help="folder of the library")
+identify.add_argument("input_dir", help="folder of the recordings to label")
+identify.add_argument(
+    "--output",
+    default="identification.csv",
+    help="CSV file where the labels are saved",
+)
+identify.add_argument(
+    "--threshold",
+    type=float,
+    default=None,
+    help="maximum matching distance to label a file as an individual, the one of the library by default",
+)
+identify.add_argument(
+    "--recursive", action="store_true", help="also label the files of the subfolders"
+)
+identify.add_argument(
+    "--resources",
+    default="auto",
+    help="workers x threads per worker, e.g. 4x2, or auto for one single-threaded worker per processor",
+)
+args = parser.parse_args()
+
+if args.command == "build":
+    manifest = checkpoint.load_manifest(
+        os.path.join(args.output_dir, checkpoint.checkpoint_dir_name)
+    )
+    if "params" not in manifest:
+        raise ValueError(
+            "No checkpoints in %s, run the analysis with checkpoint=True."
+            % args.output_dir
+        )
+    params = dict(manifest["params"])
+    params.pop("output_dir")
+    # The stages of the run are loaded from its checkpoints
+    pipe = pipeline.Pipeline(
+        params.pop("input_dir"),
+        args.output_dir,
+        executor="thread",
+        resume=True,
+        **params,
+    )
+    individuals = None
+    if args.individuals is not None:
+        df_ind = pd.read_csv(args.individuals)
+        individuals = dict(zip(df_ind.Cluster, df_ind.Individual))
+    library = reference.build_library(
+        pipe,
+        args.library_dir,
+        individuals,
+        args.n_exemplars,
+        args.method,
+        args.threshold,
+    )
+    print(
+        f"{library['exemplars'].Individual.nunique()} individuals and {len(library['exemplars'])} exemplars in {args.library_dir}, threshold {library['threshold']:.2f}"
+    )
+else:
+    n_workers, threads_per_worker = resources.parse_resources(args.resources)
+    df_ident = reference.identify(
+        args.library_dir,
+        args.input_dir,
+        threshold=args.threshold,
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        recursive="Yes" if args.recursive else "No",
+    )
+    df_ident.to_csv(args.output, index=False)
+    n_new = (df_ident.Individual == "new").sum()
+    print(
+        f"{len(df_ident)} files labelled, {n_new} new, {df_ident.Individual.nunique() - (n_new > 0)} known individuals, saved in {args.output}"
+    )
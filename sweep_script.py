@@ -0,0 +1,32 @@
+### Parameter sweep script
+# Import
+try:
+    from tools import utils, sweep
+except:
+    from LagoPObs.tools import utils, sweep
+
+# Variables
+input_dir = ""  # directory with sounds
+output_dir = ""  # directory where the results will be saved
+# Values to test for each parameter, the parameters absent from the grid take the default values of the GUI
+grid = {
+    "wlen": [256, 281, 512],  # Window length
+    "ovlp": [75],  # overlap spectro
+    "wlen_env": [706],
+    "ovlp_env": [90],  # overlap spectro enveloppe
+    "n_matches": [20, 53, 100],  # number of matches
+    "detector_methode": ["ORB custom", "AKAZE"],  # Feature extraction algorithm
+    "clustering": ["Affinity Propagation", "HDBSCAN"],  # Clustering algorithm
+}
+executor = "process"  # "process", "thread" or "serial"
+n_workers = None  # None to use all processors
+threads_per_worker = None  # threads of OpenCV and BLAS per worker, None to share the processors between the workers
+
+# Perform the sweep, only in the main process: the workers of the "process" executor import this script again
+if __name__ == "__main__":
+    list_wavs = utils.filter_wavs(input_dir)
+    df_sweep = sweep.run_sweep(
+        list_wavs, input_dir, grid, executor, n_workers, threads_per_worker
+    )
+    df_sweep.to_csv(output_dir + "/parameter_sweep.csv", index=False)
+    print(df_sweep)
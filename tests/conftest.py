@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+
+def pulses(sf, duration, freq, pulse_rate, rng):
+    """
+    A series of tone pulses with a little noise, like a ptarmigan call.
+    """
+    t = np.arange(int(sf * duration)) / sf
+    gate = (np.sin(2 * np.pi * pulse_rate * t) > 0).astype(float)
+    signal = gate * np.sin(2 * np.pi * freq * t) + 0.05 * rng.standard_normal(len(t))
+    return (signal / np.max(np.abs(signal)) * 20000).astype(np.int16)
+
+
+@pytest.fixture
+def wav_dir(tmp_path):
+    """
+    A directory with calls of two individuals (different frequencies), recorded on two days, and a low-frequency hum without calls.
+    """
+    rng = np.random.default_rng(0)
+    input_dir = tmp_path / "sounds"
+    input_dir.mkdir()
+    for k in range(6):
+        freq = 1400 if k % 2 == 0 else 2200
+        day = 19 + k // 3
+        wavfile.write(
+            input_dir / ("site_202306%02d_%d.wav" % (day, k)),
+            16000,
+            pulses(16000, 1.0, freq + 10 * k, 20, rng),
+        )
+    t = np.arange(16000) / 16000
+    hum = (np.sin(2 * np.pi * 200 * t) * 20000).astype(np.int16)
+    wavfile.write(input_dir / "site_20230620_hum.wav", 16000, hum)
+    return str(input_dir)
@@ -0,0 +1,97 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from tools import catalog, utils
+
+
+def test_audio_info_reads_the_header_only(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    sounds = {
+        "mono.wav": (16000, rng.integers(-1000, 1000, 1001).astype(np.int16)),
+        "stereo.wav": (44100, rng.standard_normal((999, 2)).astype(np.float32)),
+        "bytes.wav": (8000, rng.integers(0, 255, 777).astype(np.uint8)),
+    }
+    for name, (sf, sound) in sounds.items():
+        wavfile.write(tmp_path / name, sf, sound)
+    # A chunk of odd size before the data, as written by some recorders
+    with open(tmp_path / "mono.wav", "rb") as f:
+        content = f.read()
+    data = content.index(b"data")
+    chunk = b"LIST" + struct.pack("<I", 3) + b"abc\x00"
+    content = content[:data] + chunk + content[data:]
+    content = content[:4] + struct.pack("<I", len(content) - 8) + content[8:]
+    with open(tmp_path / "list.wav", "wb") as f:
+        f.write(content)
+    sounds["list.wav"] = sounds["mono.wav"]
+
+    def no_read(*args, **kwargs):
+        raise AssertionError("The signal was read.")
+
+    monkeypatch.setattr(wavfile, "read", no_read)
+    for name, (sf, sound) in sounds.items():
+        n_channels = 1 if sound.ndim == 1 else sound.shape[1]
+        assert utils.audio_info(str(tmp_path / name)) == (sf, n_channels, len(sound))
+
+
+def test_audio_info_of_a_file_being_copied(tmp_path):
+    wavfile.write(tmp_path / "full.wav", 16000, np.zeros(1000, dtype=np.int16))
+    with open(tmp_path / "full.wav", "rb") as f:
+        content = f.read()
+    with open(tmp_path / "partial.wav", "wb") as f:
+        f.write(content[:-500])
+    assert utils.audio_info(str(tmp_path / "partial.wav")) == (16000, 1, 750)
+    with open(tmp_path / "text.wav", "w") as f:
+        f.write("not a sound")
+    with pytest.raises(ValueError):
+        utils.audio_info(str(tmp_path / "text.wav"))
+
+
+def test_incremental_catalog(wav_dir, tmp_path, monkeypatch):
+    path = str(tmp_path / catalog.catalog_name)
+    df_first = catalog.update_catalog(wav_dir, path)
+    assert len(df_first) == 7
+    assert (df_first.Sampling_frequency == 16000).all()
+    assert np.allclose(df_first.Duration, 1)
+
+    read = []
+    audio_info = utils.audio_info
+
+    def counting_info(p):
+        read.append(os.path.basename(p))
+        return audio_info(p)
+
+    monkeypatch.setattr(utils, "audio_info", counting_info)
+    assert catalog.update_catalog(wav_dir, path).equals(df_first)
+    assert read == []
+
+    # A new file, a file modified and a file removed
+    wavfile.write(
+        os.path.join(wav_dir, "site_20230621_6.wav"), 8000, np.zeros(4000, np.int16)
+    )
+    wavfile.write(
+        os.path.join(wav_dir, "site_20230619_0.wav"), 8000, np.zeros(800, np.int16)
+    )
+    os.remove(os.path.join(wav_dir, "site_20230620_hum.wav"))
+    df_catalog = catalog.update_catalog(wav_dir, path)
+    assert sorted(read) == ["site_20230619_0.wav", "site_20230621_6.wav"]
+    assert list(df_catalog.File) == sorted(os.listdir(wav_dir))
+    info = df_catalog.set_index("File")
+    assert info.Duration["site_20230619_0.wav"] == pytest.approx(0.1)
+    assert info.Duration["site_20230621_6.wav"] == pytest.approx(0.5)
+    assert catalog.load_catalog(path).equals(df_catalog)
+
+
+def test_scan_does_not_follow_directory_links(wav_dir):
+    os.mkdir(os.path.join(wav_dir, "recorder"))
+    os.rename(
+        os.path.join(wav_dir, "site_20230619_0.wav"),
+        os.path.join(wav_dir, "recorder", "site_20230619_0.wav"),
+    )
+    os.symlink(wav_dir, os.path.join(wav_dir, "recorder", "loop"))
+    df_files = catalog.scan_audio(wav_dir, recursive=True)
+    assert len(df_files) == 7
+    assert "recorder/site_20230619_0.wav" in list(df_files.File)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from tools import checkpoint, image_matching, pipeline, utils
+
+
+def fail(*args, **kwargs):
+    raise RuntimeError("Interrupted")
+
+
+def test_resume_an_interrupted_run(wav_dir, tmp_path, monkeypatch):
+    expected = pipeline.Pipeline(wav_dir, executor="serial").result("cluster")
+    output_dir = tmp_path / "results"
+    output_dir.mkdir()
+    with monkeypatch.context() as m:
+        m.setattr(image_matching, "clustering_matches", fail)
+        pipe = pipeline.Pipeline(
+            wav_dir, str(output_dir), executor="serial", checkpoint=True
+        )
+        with pytest.raises(RuntimeError):
+            pipe.result("cluster")
+
+    # The stages stored before the interruption are not computed again
+    monkeypatch.setattr(utils, "import_wavs", fail)
+    monkeypatch.setattr(image_matching, "detect_keypoints", fail)
+    monkeypatch.setattr(image_matching, "distance_matrix", fail)
+    resumed = pipeline.Pipeline(
+        wav_dir, str(output_dir), executor="serial", resume=True
+    )
+    assert resumed.resumable_stages() == checkpoint.checkpoint_stages[:-1]
+    np.testing.assert_array_equal(resumed.result("cluster"), expected)
+    assert "cluster" in resumed.resumable_stages()
+
+
+def test_resume_after_a_change_of_parameters(wav_dir, tmp_path):
+    output_dir = tmp_path / "results"
+    output_dir.mkdir()
+    pipe = pipeline.Pipeline(
+        wav_dir, str(output_dir), executor="serial", checkpoint=True
+    )
+    pipe.result("cluster")
+    resumed = pipeline.Pipeline(
+        wav_dir, str(output_dir), executor="serial", resume=True, n_matches=20
+    )
+    assert resumed.resumable_stages() == checkpoint.checkpoint_stages[:6]
+    expected = pipeline.Pipeline(wav_dir, executor="serial", n_matches=20)
+    np.testing.assert_allclose(resumed.result("match"), expected.result("match"))
@@ -0,0 +1,105 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from tools import image_matching, pipeline
+
+
+def test_expand_distances_sparse_keeps_duplicates_together():
+    # Files 0 and 1 are duplicates of representative 0, file 2 is representative 1
+    dist_reps = sparse.csr_matrix(np.array([[0, 5.0], [5.0, 0]]))
+    dist_images = pipeline._expand_distances(dist_reps, np.array([0, 0, 1]))
+    dense = image_matching.dense_distance_matrix(dist_images, fill_value=1e10)
+    assert dist_images[0, 1] > 0 and dist_images[1, 0] > 0
+    np.testing.assert_allclose(
+        dense, [[0, 0, 5], [0, 0, 5], [5, 5, 0]], atol=np.finfo(float).tiny * 2
+    )
+
+
+def test_expand_distances_sparse_excluded_files_missing():
+    dist_reps = sparse.csr_matrix(np.array([[0, 5.0], [5.0, 0]]))
+    dist_images = pipeline._expand_distances(dist_reps, np.array([0, -1, 1, 0]))
+    assert dist_images[1].nnz == 0 and dist_images[:, 1].nnz == 0
+    assert dist_images[0, 3] > 0
+    assert dist_images[0, 2] == 5
+
+
+def test_expand_distances_dense():
+    dist_reps = np.array([[0, 5.0], [5.0, 0]])
+    dist_images = pipeline._expand_distances(dist_reps, np.array([0, 0, 1, -1]))
+    np.testing.assert_array_equal(
+        dist_images[:3, :3], [[0, 0, 5], [0, 0, 5], [5, 5, 0]]
+    )
+    assert np.all(dist_images[3] == 1e10) and np.all(dist_images[:, 3] == 1e10)
+
+
+def test_dedup_with_candidate_pairs_clusters_duplicates_together():
+    rng = np.random.default_rng(0)
+    # Two well separated groups of images, image 0 being duplicated by the file 4
+    centers = [rng.integers(0, 256, (40, 32), dtype=np.uint8) for _ in range(2)]
+    list_descriptors = [centers[k // 2].copy() for k in range(4)]
+    for k, des in enumerate(list_descriptors):
+        des[k : k + 3] = rng.integers(0, 256, (3, 32), dtype=np.uint8)
+    _, matcher = image_matching.feature_detector_matcher("ORB")
+    pairs = image_matching.candidate_pairs(list_descriptors, "ORB", n_candidates=1)
+    dist_reps = image_matching.sparse_distance_matrix(
+        list_descriptors, matcher, pairs, 10
+    )
+    groups = np.array([0, 1, 2, 3, 0])
+    dist_images = pipeline._expand_distances(dist_reps, groups)
+    assert dist_images[0, 4] > 0 and dist_images[4, 0] > 0
+    dense = image_matching.dense_distance_matrix(dist_images, fill_value=1e10)
+    assert dense[0, 4] < dense[0, 2]
+
+
+def test_group_duplicates_identical_hashes():
+    hashes = np.array([[1, 2], [3, 4], [1, 2], [5, 6], [3, 4]], dtype=np.uint8)
+    groups, representatives = image_matching.group_duplicates(hashes)
+    np.testing.assert_array_equal(groups, [0, 1, 0, 2, 1])
+    np.testing.assert_array_equal(representatives, [0, 1, 3])
+
+
+@pytest.mark.parametrize("max_distance", [1, 3, 6])
+def test_group_duplicates_as_all_pairs(max_distance):
+    rng = np.random.default_rng(max_distance)
+    bits = rng.integers(0, 2, (30, 64), dtype=np.uint8)
+    # Near-duplicates of the first hashes, some of them chained
+    for k in range(30, 60):
+        near = bits[rng.integers(0, len(bits))].copy()
+        flipped = rng.choice(64, rng.integers(0, max_distance + 2), replace=False)
+        near[flipped] ^= 1
+        bits = np.vstack((bits, near))
+    hashes = np.packbits(bits, axis=1)
+    groups, representatives = image_matching.group_duplicates(hashes, max_distance)
+    # Connected components of the pairs of hashes within max_distance bits
+    close = (bits[:, None] != bits[None]).sum(axis=2) <= max_distance
+    _, expected = sparse.csgraph.connected_components(sparse.csr_matrix(close))
+    same_group = groups[:, None] == groups[None]
+    np.testing.assert_array_equal(same_group, expected[:, None] == expected[None])
+    # The representative of each group is its first spectrogram
+    np.testing.assert_array_equal(
+        representatives,
+        [np.flatnonzero(groups == g)[0] for g in range(groups.max() + 1)],
+    )
+
+
+def test_duplicated_files_share_a_group(wav_dir):
+    shutil.copy(
+        os.path.join(wav_dir, "site_20230619_0.wav"),
+        os.path.join(wav_dir, "site_20230621_0.wav"),
+    )
+    params = dict(executor="serial", dedup="Yes", dedup_distance=0)
+    pipe = pipeline.Pipeline(wav_dir, **params)
+    groups = pipe.result("dedup")["groups"]
+    files = list(pipe.list_wavs)
+    first, copy = files.index("site_20230619_0.wav"), files.index("site_20230621_0.wav")
+    assert groups[first] == groups[copy]
+    assert len(np.unique(groups)) == len(files) - 1
+    labels = pipe.result("cluster")
+    assert labels[first] == labels[copy]
+    # Same distances as matching all the files
+    expected = pipeline.Pipeline(wav_dir, executor="serial").result("match")
+    np.testing.assert_allclose(pipe.result("match"), expected)
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+
+from tools import distributed, pipeline
+
+
+def test_local_workers_as_the_pipeline(wav_dir, tmp_path):
+    output_dir = tmp_path / "results"
+    output_dir.mkdir()
+    df_res, dist_images = distributed.run_coordinator(
+        wav_dir,
+        str(output_dir),
+        str(tmp_path / "work"),
+        n_local_workers=2,
+        threads_per_worker=1,
+        chunk_size=3,
+        tile_rows=2,
+        worker_timeout=30,
+        poll=0.05,
+        estim_pop="No",
+    )
+    pipe = pipeline.Pipeline(wav_dir, executor="serial")
+    assert list(df_res.File) == list(pipe.list_wavs)
+    np.testing.assert_allclose(dist_images, pipe.result("match"))
+    np.testing.assert_array_equal(df_res.Cluster, pipe.result("cluster"))
+
+
+def test_work_dir_of_another_use_is_kept(tmp_path):
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    (work_dir / "notes.txt").write_text("keep")
+    with pytest.raises(ValueError):
+        distributed._clear_work_dir(str(work_dir))
+    assert (work_dir / "notes.txt").read_text() == "keep"
+
+    # Only the tasks of a previous run are removed
+    (work_dir / "job.json").write_text("{}")
+    for d in distributed._work_subdirs:
+        (work_dir / d).mkdir()
+        (work_dir / d / "task.json").write_text("{}")
+    distributed._clear_work_dir(str(work_dir))
+    assert sorted(os.listdir(work_dir)) == ["notes.txt"]
@@ -0,0 +1,9 @@
+import numpy as np
+import pytest
+
+from tools import embedding
+
+
+def test_vocabulary_without_descriptors():
+    with pytest.raises(ValueError, match="No spectrogram has descriptors"):
+        embedding.build_vocabulary([None, np.empty((0, 128), dtype=np.float32)])
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from tools import image_matching, pipeline
+
+
+def random_descriptors(seed):
+    """
+    Float descriptors of SIFT size, with an image without descriptors.
+    """
+    rng = np.random.default_rng(seed)
+    list_descriptors = [
+        rng.random((n, 128), dtype=np.float32) * 100 for n in [40, 1, 25, 60, 7]
+    ]
+    list_descriptors.insert(2, None)
+    return list_descriptors
+
+
+def test_l2_matcher_matches_as_opencv():
+    list_descriptors = random_descriptors(0)
+    _, bf_matcher = image_matching.feature_detector_matcher("SIFT")
+    _, l2_matcher = image_matching.feature_detector_matcher("SIFT", matcher="blas")
+    valid = [d for d in list_descriptors if d is not None]
+    for des1 in valid:
+        for des2 in valid:
+            expected = {
+                (m.queryIdx, m.trainIdx): m.distance
+                for m in bf_matcher.match(des1, des2)
+            }
+            matches = {
+                (m.queryIdx, m.trainIdx): m.distance
+                for m in l2_matcher.match(des1, des2)
+            }
+            assert matches.keys() == expected.keys()
+            for pair, dist in matches.items():
+                assert dist == pytest.approx(expected[pair], rel=1e-4)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_l2_distance_matrices_as_opencv(seed):
+    list_descriptors = random_descriptors(seed)
+    _, bf_matcher = image_matching.feature_detector_matcher("SIFT")
+    _, l2_matcher = image_matching.feature_detector_matcher("SIFT", matcher="blas")
+    expected = image_matching.distance_matrix(list_descriptors, bf_matcher, 10)
+    dist_images = image_matching.distance_matrix(list_descriptors, l2_matcher, 10)
+    np.testing.assert_allclose(dist_images, expected, rtol=1e-4)
+    # Rows, as computed by the tiles of the pipeline
+    np.testing.assert_allclose(
+        image_matching.distance_matrix(
+            list_descriptors, l2_matcher, 10, rows=range(2, 5)
+        ),
+        expected[2:5],
+        rtol=1e-4,
+    )
+    i, j = np.triu_indices(len(list_descriptors), k=1)
+    pairs = np.column_stack((i, j))[::2]
+    dist_graph = image_matching.sparse_distance_matrix(
+        list_descriptors, l2_matcher, pairs, 10
+    )
+    np.testing.assert_allclose(
+        dist_graph[pairs[:, 0], pairs[:, 1]].A1,
+        expected[pairs[:, 0], pairs[:, 1]],
+        rtol=1e-4,
+    )
+
+
+def test_blas_pipeline_as_opencv(wav_dir):
+    params = dict(executor="serial", detector_methode="SIFT")
+    expected = pipeline.Pipeline(wav_dir, **params).result("match")
+    dist_images = pipeline.Pipeline(wav_dir, matcher="blas", **params).result("match")
+    np.testing.assert_allclose(dist_images, expected, rtol=1e-4)
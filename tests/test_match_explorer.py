@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from tools import match_explorer, pipeline
+
+
+@pytest.mark.parametrize("compression", ["No", "pca"])
+def test_pair_distances_of_the_run(wav_dir, tmp_path, compression):
+    output_dir = tmp_path / "results"
+    output_dir.mkdir()
+    pipe = pipeline.Pipeline(
+        wav_dir,
+        str(output_dir),
+        executor="serial",
+        checkpoint=True,
+        detector_methode="SIFT",
+        matcher="blas",
+        compression=compression,
+        n_components=8,
+    )
+    pipe.run(estim_pop="No")
+    dist_images = pipe.result("match")
+    run = match_explorer.open_run(str(output_dir))
+    assert list(run["files"]) == list(pipe.list_wavs)
+    for i, j in [(0, 1), (0, 2), (1, 3), (4, 5)]:
+        _, _, _, dist = match_explorer.pair_matches(run, i, j)
+        assert dist == pytest.approx(dist_images[i, j], rel=1e-5)
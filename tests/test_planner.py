@@ -0,0 +1,13 @@
+import pytest
+
+from tools import pipeline, planner
+
+
+@pytest.mark.parametrize("params", [{}, {"wlen": 256, "ovlp": 50, "pad_len": 20000}])
+def test_sizes_of_the_plan_as_the_run(wav_dir, params):
+    plan = planner.plan_run(wav_dir, **params)
+    pipe = pipeline.Pipeline(wav_dir, executor="serial", **params)
+    sizes = plan["sizes"]
+    assert sizes["n_files"] == len(pipe.list_wavs)
+    assert sizes["pad_len"] == pipe.result("pad").shape[1]
+    assert tuple(sizes["spectrogram_shape"]) == pipe.result("spectrogram").shape[1:]
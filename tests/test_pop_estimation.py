@@ -0,0 +1,114 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools import pop_estimation
+
+
+def clustering_results(seed, n_files=300):
+    """
+    Random clustering results, with gaps in the cluster ids and in the days.
+    """
+    rng = np.random.default_rng(seed)
+    days = [date(2023, 6, 1) + timedelta(days=int(d)) for d in range(0, 30, 2)]
+    return pd.DataFrame(
+        {
+            "Cluster": rng.choice([0, 1, 2, 5, 7, 8, 12, 20], n_files),
+            "Date": [days[k] for k in rng.integers(0, len(days), n_files)],
+        }
+    )
+
+
+def baseline_presence(df):
+    """
+    Presence of each cluster per day, counted pair by pair as in the first version of presence_clusters.
+    """
+    clusters = np.unique(df.Cluster)
+    days = np.unique(df.Date)
+    presence = np.zeros((len(clusters), len(days)))
+    for c in clusters:
+        for d in days:
+            n = len(df.Cluster[np.logical_and(df.Cluster == c, df.Date == d)])
+            presence[clusters == c, days == d] = n
+    return pd.DataFrame(presence, columns=days)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_count_matrix_as_the_baseline(seed):
+    df = clustering_results(seed)
+    expected = baseline_presence(df)
+    pd.testing.assert_frame_equal(pop_estimation.presence_clusters(df), expected)
+    # Same counts with categorical dates, some of them without sounds
+    df_cat = df.copy()
+    categories = sorted(set(df.Date) | {date(2023, 5, 1)})
+    df_cat["Date"] = pd.Categorical(df.Date, categories=categories)
+    clusters, days, counts = pop_estimation.count_matrix(df_cat)
+    np.testing.assert_array_equal(clusters, np.unique(df.Cluster))
+    assert list(days) == list(expected.columns)
+    np.testing.assert_array_equal(counts, expected.to_numpy())
+
+    pi_arr = pop_estimation.presence_index_arr(df)
+    presence = expected.to_numpy()
+    nb_days = np.count_nonzero(presence, axis=1)
+    nb_sounds = presence.sum(axis=1)
+    np.testing.assert_allclose(pi_arr[:, 1], nb_days)
+    np.testing.assert_allclose(pi_arr[:, 2], nb_sounds)
+    np.testing.assert_allclose(
+        pi_arr[:, 3], nb_days * nb_sounds / (len(df) * presence.shape[1])
+    )
+    per_day = pop_estimation.daily_vocalize_clusters(df)
+    np.testing.assert_array_equal(
+        per_day.Number_Clusters, np.count_nonzero(presence, 0)
+    )
+    np.testing.assert_array_equal(per_day.Number_Sounds, presence.sum(axis=0))
+
+
+def baseline_ppi_pic(df):
+    """
+    PPI and PIC computed population by population, as in the first version of population_presence_index and estimate_number_of_individuals.
+    """
+    presence_arr = baseline_presence(df).to_numpy()
+    nb_days = np.count_nonzero(presence_arr, axis=1)
+    nb_sounds = presence_arr.sum(axis=1)
+    pi = nb_days * nb_sounds / (np.sum(nb_sounds) * presence_arr.shape[1])
+    clusters_ordered = np.argsort(pi)[::-1]
+    pops = [clusters_ordered[:k] for k in range(1, len(clusters_ordered) + 1)]
+    n_sounds_pop = np.array([np.sum(nb_sounds[p]) for p in pops])
+    sounds_pop_per_day = [np.sum(presence_arr[p, :], axis=0) for p in pops]
+    n_days_pop = np.array([len(np.nonzero(s)[0]) for s in sounds_pop_per_day])
+    pi_pop = (n_sounds_pop / np.sum(presence_arr)) * (
+        n_days_pop / presence_arr.shape[1]
+    )
+    pic = np.array(
+        [
+            2 * (k + 1) / len(pi_pop) - 2 * np.log(1 + pi_pop[k])
+            for k in range(len(pi_pop))
+        ]
+    )
+    return pi_pop, pic
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_ppi_pic_as_the_baseline(seed):
+    df = clustering_results(seed)
+    pi_pop, pic = baseline_ppi_pic(df)
+    dict_pop = pop_estimation.estimate_population(df)
+    df_pic = dict_pop["ppi_pic"]
+    np.testing.assert_allclose(df_pic.Population_Presence_Index, pi_pop)
+    np.testing.assert_allclose(df_pic.Population_Information_Criterion, pic)
+    assert dict_pop["n_indiv_pic"] == 1 + np.argmin(pic)
+
+
+def test_rolling_population_as_the_baseline_of_each_window():
+    df = clustering_results(3, n_files=120)
+    df_rolling = pop_estimation.rolling_population(df, window_days=7, step_days=3)
+    assert len(df_rolling)
+    dates = pd.to_datetime(df.Date)
+    for (start, end), df_window in df_rolling.groupby(["Start", "End"]):
+        in_window = df[(dates >= start) & (dates <= end)]
+        pi_pop, pic = baseline_ppi_pic(in_window)
+        np.testing.assert_allclose(df_window.Population_Presence_Index, pi_pop)
+        np.testing.assert_allclose(df_window.Population_Information_Criterion, pic)
+        assert (df_window.Individuals_PIC == 1 + np.argmin(pic)).all()
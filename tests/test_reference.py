@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from tools import pipeline, reference
+
+
+def test_library_threshold_on_the_scale_of_the_exemplars(wav_dir, tmp_path):
+    params = dict(executor="serial", detector_methode="SIFT", matcher="blas")
+    pipe = pipeline.Pipeline(wav_dir, compression="pca", n_components=8, **params)
+    library = reference.build_library(pipe, str(tmp_path / "library"))
+    # The exemplars are stored, and matched by nearest_individuals, uncompressed
+    dist_images = pipeline.Pipeline(wav_dir, **params).result("match")
+    labels = pipe.result("cluster")
+    intra_dist = []
+    for c in np.unique(labels[labels >= 0]):
+        idx = np.nonzero(labels == c)[0]
+        if len(idx) > 1:
+            sub = dist_images[np.ix_(idx, idx)] + np.diag(np.full(len(idx), np.inf))
+            intra_dist.append(np.min(sub, axis=1))
+    expected = np.percentile(np.concatenate(intra_dist), 90)
+    assert library["threshold"] == pytest.approx(expected, rel=1e-6)
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+from soxr import resample
+
+from tools import utils
+
+
+def signals(seed):
+    """
+    Signals with several sampling frequencies, some of them with the same rate and length.
+    """
+    rng = np.random.default_rng(seed)
+    list_sf = [8000, 44100, 44100, 22050, 44100, 16000, 3000, 22050]
+    lengths = [8000, 44100, 44100, 30000, 50000, 16000, 2000, 30000]
+    list_sounds = [(rng.standard_normal(n) * 5000).astype(np.int16) for n in lengths]
+    return list_sounds, list_sf
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_resampling_as_file_by_file(seed):
+    list_sounds, list_sf = signals(seed)
+    list_arr = utils.resample_signals(list_sounds, list_sf, 16000, max_channels=2)
+    for sound, sf, arr in zip(list_sounds, list_sf, list_arr):
+        expected = resample(sound.astype(np.float64), sf, 16000, "HQ")
+        assert arr.dtype == np.float64 and arr.shape == expected.shape
+        np.testing.assert_allclose(arr, expected, atol=1e-6 * np.max(np.abs(expected)))
+
+
+def test_stream_resampling_as_file_by_file():
+    list_sounds, list_sf = signals(2)
+    list_arr = utils.resample_signals(
+        list_sounds, list_sf, 16000, stream_len=10000, chunk_len=4096
+    )
+    for sound, sf, arr in zip(list_sounds, list_sf, list_arr):
+        expected = resample(sound.astype(np.float64), sf, 16000, "HQ")
+        assert arr.shape == expected.shape
+        np.testing.assert_allclose(arr, expected, atol=1e-6 * np.max(np.abs(expected)))
+
+
+def test_import_as_file_by_file(tmp_path):
+    list_sounds, list_sf = signals(3)
+    list_wavs = []
+    for k, (sound, sf) in enumerate(zip(list_sounds, list_sf)):
+        list_wavs.append("site_20230619_%d.wav" % k)
+        wavfile.write(tmp_path / list_wavs[-1], sf, sound)
+    list_arr, samp_freq = utils.import_wavs(list_wavs, str(tmp_path), 7900)
+    assert samp_freq == 16000
+    for sound, sf, arr in zip(list_sounds, list_sf, list_arr):
+        # Resampled and normalized by their RMS
+        expected = resample(sound.astype(np.float64), sf, samp_freq, "HQ")
+        expected /= np.sqrt(np.mean(expected**2))
+        np.testing.assert_allclose(arr, expected, atol=1e-6)
+
+
+def test_import_long_files_by_chunks(tmp_path):
+    list_sounds, list_sf = signals(4)
+    list_wavs = []
+    for k, (sound, sf) in enumerate(zip(list_sounds, list_sf)):
+        list_wavs.append("site_20230619_%d.wav" % k)
+        wavfile.write(tmp_path / list_wavs[-1], sf, sound)
+    expected, _ = utils.import_wavs(list_wavs, str(tmp_path), 7900)
+    list_arr, _ = utils.import_wavs(list_wavs, str(tmp_path), 7900, stream_len=20000)
+    for arr, exp in zip(list_arr, expected):
+        np.testing.assert_allclose(arr, exp, atol=1e-6)
+
+
+def test_import_many_files_with_few_descriptors(tmp_path):
+    resource = pytest.importorskip("resource")
+    rng = np.random.default_rng(5)
+    list_wavs = []
+    for k in range(300):
+        list_wavs.append("site_20230619_%d.wav" % k)
+        sf = [16000, 22050, 44100][k % 3]
+        sound = (rng.standard_normal(sf // 10 * (1 + k % 2)) * 5000).astype(np.int16)
+        wavfile.write(tmp_path / list_wavs[-1], sf, sound)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    n_open = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else 50
+    resource.setrlimit(resource.RLIMIT_NOFILE, (n_open + 100, hard))
+    try:
+        list_arr, _ = utils.import_wavs(list_wavs, str(tmp_path), 7900)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert len(list_arr) == 300 and all(arr is not None for arr in list_arr)
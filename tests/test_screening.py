@@ -0,0 +1,39 @@
+import numpy as np
+
+from tools import pipeline, utils
+
+
+def test_screening_imports_each_file_once(wav_dir, monkeypatch):
+    imported = []
+    import_wavs = utils.import_wavs
+
+    def counting_import(list_wavs, *args, **kwargs):
+        imported.extend(list_wavs)
+        return import_wavs(list_wavs, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "import_wavs", counting_import)
+    pipe = pipeline.Pipeline(wav_dir, executor="serial", screen="Yes")
+    signals = pipe.result("wavelet")
+    assert "site_20230620_hum.wav" not in pipe.list_wavs
+    assert len(pipe.list_wavs) == 6
+    assert sorted(imported) == sorted(pipe.catalog)
+
+    # Same signals as the ones imported, filtered and denoised by the signal stages
+    reference = pipeline.Pipeline(
+        wav_dir, executor="serial", list_wavs=list(pipe.list_wavs)
+    ).result("wavelet")
+    assert len(signals) == len(reference)
+    for a, b in zip(signals, reference):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_screening_signals_invalidated_with_parameters(wav_dir):
+    pipe = pipeline.Pipeline(wav_dir, executor="serial", screen="Yes")
+    pipe.result("screen")
+    pipe.set_params(wlt_filt="No")
+    signals = pipe.result("wavelet")
+    reference = pipeline.Pipeline(
+        wav_dir, executor="serial", list_wavs=list(pipe.list_wavs), wlt_filt="No"
+    ).result("bandpass")
+    for a, b in zip(signals, reference):
+        np.testing.assert_array_equal(a, b)
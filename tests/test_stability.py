@@ -0,0 +1,28 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from tools import image_matching, stability
+
+
+def stability_of(points):
+    dist_images = cdist(points, points)
+    labels = image_matching.clustering_matches(dist_images, "Affinity Propagation")
+    dict_stab = stability.cluster_stability(
+        dist_images, labels, "Affinity Propagation", n_replicates=20, executor="serial"
+    )
+    return dict_stab["clusters"]
+
+
+def test_separated_clusters_are_stable():
+    rng = np.random.default_rng(0)
+    centers = np.repeat([[0, 0], [100, 0], [0, 100]], 10, axis=0)
+    clusters = stability_of(centers + rng.normal(size=centers.shape))
+    assert len(clusters) == 3
+    np.testing.assert_allclose(clusters.Stability, 1)
+    np.testing.assert_allclose(clusters.Cohesion, 1)
+
+
+def test_noise_is_less_stable():
+    rng = np.random.default_rng(0)
+    clusters = stability_of(rng.uniform(size=(30, 2)))
+    assert clusters.Stability.mean() < 0.9
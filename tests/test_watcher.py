@@ -0,0 +1,96 @@
+import os
+import shutil
+import time
+
+import numpy as np
+
+from tools import pipeline, watcher
+
+
+def test_watcher_processes_only_new_files(wav_dir, tmp_path, monkeypatch):
+    output_dir = tmp_path / "results"
+    output_dir.mkdir()
+    waiting = tmp_path / "waiting"
+    waiting.mkdir()
+    files = sorted(os.listdir(wav_dir))
+    for f in files[-2:]:
+        shutil.move(os.path.join(wav_dir, f), waiting / f)
+    old = time.time() - 7200
+    for f in files[:-2]:
+        os.utime(os.path.join(wav_dir, f), (old, old))
+    state = watcher.watch(
+        wav_dir, str(output_dir), min_age=3600, run_once=True, executor="serial"
+    )
+    assert sorted(state["df"].File) == files[:-2]
+
+    processed = []
+    update = watcher.update
+
+    def recording_update(input_dir, output_dir, new_wavs, *args, **kwargs):
+        processed.append(sorted(new_wavs))
+        return update(input_dir, output_dir, new_wavs, *args, **kwargs)
+
+    monkeypatch.setattr(watcher, "update", recording_update)
+    # A file modified recently is still being copied and waits for the next poll
+    for f in files[-2:]:
+        shutil.move(waiting / f, os.path.join(wav_dir, f))
+    os.utime(os.path.join(wav_dir, files[-2]), (old, old))
+    state = watcher.watch(
+        wav_dir, str(output_dir), min_age=3600, run_once=True, executor="serial"
+    )
+    assert processed == [[files[-2]]]
+    assert sorted(state["df"].File) == files[:-1]
+
+
+def test_watcher_state_saved_at_once(wav_dir, tmp_path):
+    output_dir = tmp_path / "results"
+    output_dir.mkdir()
+    state = watcher.watch(
+        wav_dir, str(output_dir), min_age=0, run_once=True, executor="serial"
+    )
+    state_dir = output_dir / watcher.state_dir_name
+    assert sorted(os.listdir(state_dir)) == [
+        "exemplars.csv",
+        "exemplars.npz",
+        "files.csv",
+        "state.json",
+    ]
+    loaded = watcher.load_state(str(output_dir))
+    assert loaded["threshold"] == state["threshold"]
+    assert loaded["df"].equals(state["df"])
+    assert len(loaded["exemplars"]) == len(state["exemplars"])
+
+
+def test_threshold_on_the_scale_of_the_exemplars(wav_dir):
+    params = dict(executor="serial", detector_methode="SIFT", matcher="blas")
+    pipe = pipeline.Pipeline(wav_dir, compression="pca", n_components=8, **params)
+    dist_images = pipe.result("match")
+    idx = np.arange(len(pipe.list_wavs))
+    # The exemplars are matched with their original descriptors
+    reference = pipeline.Pipeline(wav_dir, **params).result("match")
+    np.testing.assert_allclose(
+        watcher.uncompressed_distances(pipe, dist_images, idx), reference, rtol=1e-6
+    )
+
+
+def test_noise_files_are_not_grouped(wav_dir, tmp_path, monkeypatch):
+    output_dir = tmp_path / "results"
+    output_dir.mkdir()
+    files = sorted(os.listdir(wav_dir))
+    labels = {3: np.array([0, -1, -1]), 4: np.array([-1, 0, 1, 0])}
+
+    def noisy_clustering(dist_images, *args, **kwargs):
+        return labels[len(dist_images)]
+
+    monkeypatch.setattr(watcher.image_matching, "clustering_matches", noisy_clustering)
+    monkeypatch.setattr(pipeline.image_matching, "clustering_matches", noisy_clustering)
+    state = watcher.initialize(wav_dir, str(output_dir), files[:3], executor="serial")
+    # No exemplar of the noise of the first pass
+    assert -1 not in [e[0] for e in state["exemplars"]]
+    state = watcher.update(
+        wav_dir, str(output_dir), files[3:], state, threshold=-1, executor="serial"
+    )
+    new_clusters = state["df"].Cluster.to_numpy()[3:]
+    assert new_clusters[1] == new_clusters[3]
+    assert len(np.unique(new_clusters)) == 3
+    assert np.all(new_clusters > state["df"].Cluster[:3].max())
@@ -0,0 +1,154 @@
+# Catalog of the sound files of a directory tree, with the metadata read from their headers, kept up to date between runs
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from . import utils, checkpoint
+
+# Name of the file of the catalog, see update_catalog
+catalog_name = "catalog.csv"
+# Columns of the catalog
+catalog_columns = [
+    "File",
+    "Size",
+    "Mtime",
+    "Sampling_frequency",
+    "Channels",
+    "Frames",
+    "Duration",
+    "Hash",
+]
+
+
+def scan_audio(input_dir, recursive=True, skip=None):
+    """
+    List the audio files of a directory (see utils.is_audio_file) with os.scandir, which gives their size and modification time without another system call per file. The symbolic links to directories are not followed, so that a link to a parent directory cannot make the scan loop.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory.
+    recursive: bool, True to also list the files of its subdirectories (e.g. site/recorder/date trees).
+    skip: set of str, paths relative to input_dir that are neither listed nor stat-ed, e.g. the files already processed by the watcher. None to list all the files.
+
+    Returns
+    -------
+    df_files: a pandas DataFrame with the path of each "File" relative to input_dir (with "/" between the directories), its "Size" in bytes and its modification time "Mtime" in nanoseconds, sorted by path.
+    """
+    if skip is None:
+        skip = set()
+    rows = []
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(input_dir, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = rel_dir + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(rel_path + "/")
+                elif (
+                    utils.is_audio_file(entry.name)
+                    and rel_path not in skip
+                    and entry.is_file()
+                ):
+                    stat = entry.stat()
+                    rows.append((rel_path, stat.st_size, stat.st_mtime_ns))
+    df_files = pd.DataFrame(rows, columns=["File", "Size", "Mtime"])
+    df_files = df_files.sort_values("File", ignore_index=True)
+    return df_files
+
+
+def load_catalog(path):
+    """
+    Load a catalog saved by update_catalog, an empty catalog if there is none.
+    """
+    if path is None or not os.path.isfile(path):
+        df_catalog = pd.DataFrame(
+            {
+                c: pd.Series(dtype=str if c in ["File", "Hash"] else float)
+                for c in catalog_columns
+            }
+        )
+        return df_catalog.astype({"Size": np.int64, "Mtime": np.int64})
+    return pd.read_csv(path, dtype={"File": str, "Hash": str}, keep_default_na=False)
+
+
+def update_catalog(
+    input_dir,
+    path=None,
+    recursive=True,
+    files=None,
+    hash_files=False,
+    n_readers=16,
+):
+    """
+    Catalog the sound files of a directory: their size, modification time, sampling frequency, number of channels and of frames, duration and, optionally, the hash of their content (see checkpoint.file_hash). The metadata are read from the headers only (see utils.audio_info), in parallel, as the time is mostly spent waiting for the disk.
+    The catalog is saved in path and updated by the next runs: only the new files and the ones whose size or modification time changed are read again, the files removed are dropped (unless files is given, the other files of the saved catalog are then kept), and the missing hashes are computed when hash_files is True.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory.
+    path: str, path of the CSV file of the catalog, None to not save it.
+    recursive: bool, True to also catalog the files of the subdirectories, see scan_audio.
+    files: list of str, the paths of the files relative to input_dir, None to catalog all the audio files found in input_dir.
+    hash_files: bool, True to compute the hash of the content of the files.
+    n_readers: int, number of threads reading the files.
+
+    Returns
+    -------
+    df_catalog: a pandas DataFrame with the "File", "Size", "Mtime", "Sampling_frequency", "Channels", "Frames", "Duration" (in seconds) and "Hash" (empty if not computed) of each file, sorted by path (in the order of files if given).
+    """
+    if files is None:
+        df_files = scan_audio(input_dir, recursive)
+    else:
+        stats = [os.stat(os.path.join(input_dir, f)) for f in files]
+        df_files = pd.DataFrame(
+            {
+                "File": list(files),
+                "Size": [s.st_size for s in stats],
+                "Mtime": [s.st_mtime_ns for s in stats],
+            }
+        )
+    # Metadata of the previous catalog, for the files that did not change
+    df_old = load_catalog(path).drop_duplicates("File")
+    df_catalog = df_files.merge(
+        df_old, on=["File", "Size", "Mtime"], how="left", validate="one_to_one"
+    )
+    df_catalog["Hash"] = df_catalog.Hash.fillna("").astype(str)
+    new = df_catalog.Sampling_frequency.isna().to_numpy()
+    paths = [os.path.join(input_dir, f) for f in df_catalog.File]
+    with ThreadPoolExecutor(max_workers=n_readers) as pool:
+        if new.any():
+            headers = list(
+                pool.map(utils.audio_info, [p for p, n in zip(paths, new) if n])
+            )
+            df_catalog.loc[new, ["Sampling_frequency", "Channels", "Frames"]] = headers
+        to_hash = (df_catalog.Hash == "").to_numpy() & hash_files
+        if to_hash.any():
+            df_catalog.loc[to_hash, "Hash"] = list(
+                pool.map(checkpoint.file_hash, [p for p, h in zip(paths, to_hash) if h])
+            )
+    for c in ["Sampling_frequency", "Channels", "Frames"]:
+        df_catalog[c] = df_catalog[c].astype(np.int64)
+    df_catalog["Duration"] = df_catalog.Frames / df_catalog.Sampling_frequency
+    df_catalog = df_catalog[catalog_columns]
+    if path is not None:
+        df_saved = df_catalog
+        if files is not None:
+            # The other files of the previous catalog are kept
+            others = df_old[~df_old.File.isin(df_catalog.File)]
+            df_saved = pd.concat(
+                [df_catalog, others[catalog_columns]], ignore_index=True
+            )
+        if new.any() or to_hash.any() or len(df_saved) != len(df_old):
+            save_catalog(df_saved, path)
+    return df_catalog
+
+
+def save_catalog(df_catalog, path):
+    """
+    Save a catalog, see update_catalog. The file is replaced at once, so an interruption never leaves a partial catalog.
+    """
+    df_catalog.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
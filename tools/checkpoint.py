@@ -0,0 +1,231 @@
+# Checkpoints of the stages of the pipeline, to resume an interrupted run
+import os
+import json
+import hashlib
+import struct
+import zipfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from . import image_matching
+
+# Name of the directory, inside the output directory, where the checkpoints are stored
+checkpoint_dir_name = "checkpoints"
+# Stages whose results are stored, the other ones are quick to recompute from them
+checkpoint_stages = [
+    "screen",
+    "wavelet",
+    "pad",
+    "spectrogram",
+    "detect",
+    "dedup",
+    "match",
+    "cluster",
+]
+
+
+def file_hash(path, block_size=2**20):
+    """
+    SHA-1 hash of the content of a file, read block by block.
+
+    Parameters
+    ----------
+    path: str, path of the file.
+    block_size: int, number of bytes read at once.
+
+    Returns
+    -------
+    digest: str, the hexadecimal hash.
+    """
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def stage_key(params, file_hashes):
+    """
+    Key identifying the result of a stage: a hash of the parameters of the stage and of the previous stages, and of the hashes of the input files. A checkpoint can only be reused if its key did not change.
+
+    Parameters
+    ----------
+    params: dict, the parameters the stage depends on.
+    file_hashes: dict, with the file names as keys and their hash as values, see file_hash.
+
+    Returns
+    -------
+    key: str, the hexadecimal hash.
+    """
+    content = json.dumps(
+        {"params": params, "files": sorted(file_hashes.items())},
+        sort_keys=True,
+        default=_to_json,
+    )
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def load_manifest(checkpoint_dir):
+    """
+    Load the manifest of the checkpoints.
+
+    Parameters
+    ----------
+    checkpoint_dir: str, path of the directory of the checkpoints.
+
+    Returns
+    -------
+    manifest: dict, with the hash of each input file in "files", the parameters of the run in "params" and the key of each stage stored in "stages" (see stage_key). Empty if there is no manifest.
+    """
+    path = os.path.join(checkpoint_dir, "manifest.json")
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, checkpoint_dir):
+    """
+    Save the manifest of the checkpoints, see load_manifest. The file is replaced at once, so an interruption never leaves a partial manifest.
+    """
+    path = os.path.join(checkpoint_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, default=_to_json)
+    os.replace(path + ".tmp", path)
+
+
+def save_stage(res, stage, checkpoint_dir):
+    """
+    Store the result of a stage in the directory of the checkpoints.
+
+    Parameters
+    ----------
+    res: the result of the stage, see pipeline.Pipeline.result.
+    stage: str, name of the stage, see checkpoint_stages.
+    checkpoint_dir: str, path of the directory of the checkpoints.
+    """
+    path = os.path.join(checkpoint_dir, stage)
+    if stage == "screen":
+        arrays = {"kept": res["kept"]}
+        if res["metrics"] is not None:
+            res["metrics"].to_csv(path + ".csv", index=False)
+    elif stage == "wavelet":
+        arrays = {"arr_%d" % k: arr for k, arr in enumerate(res)}
+    elif stage == "detect":
+        arrays = {}
+        for k, (kp, des) in enumerate(res):
+            arrays["kp_%d" % k] = image_matching.keypoints_to_array(kp)
+            if des is not None:
+                arrays["des_%d" % k] = des
+    elif stage == "dedup":
+        arrays = res
+    elif stage == "match" and sparse.issparse(res):
+        sparse.save_npz(path + ".tmp.npz", res)
+        os.replace(path + ".tmp.npz", path + ".npz")
+        return
+    else:
+        arrays = {"res": res}
+    np.savez(path + ".tmp.npz", **arrays)
+    os.replace(path + ".tmp.npz", path + ".npz")
+
+
+def load_stage(stage, checkpoint_dir):
+    """
+    Load the result of a stage stored in the directory of the checkpoints, see save_stage.
+
+    Parameters
+    ----------
+    stage: str, name of the stage, see checkpoint_stages.
+    checkpoint_dir: str, path of the directory of the checkpoints.
+
+    Returns
+    -------
+    res: the result of the stage, see pipeline.Pipeline.result.
+    """
+    path = os.path.join(checkpoint_dir, stage)
+    with np.load(path + ".npz") as arrays:
+        if "format" in arrays:
+            return sparse.load_npz(path + ".npz")
+        if stage == "screen":
+            metrics = None
+            if os.path.isfile(path + ".csv"):
+                metrics = pd.read_csv(path + ".csv")
+            return {"kept": arrays["kept"], "metrics": metrics}
+        if stage == "wavelet":
+            return [arrays["arr_%d" % k] for k in range(len(arrays.files))]
+        if stage == "detect":
+            n_specs = len([k for k in arrays.files if k.startswith("kp_")])
+            return [
+                (
+                    image_matching.array_to_keypoints(arrays["kp_%d" % k]),
+                    arrays["des_%d" % k] if "des_%d" % k in arrays else None,
+                )
+                for k in range(n_specs)
+            ]
+        if stage == "dedup":
+            res = {k: arrays[k] for k in arrays.files}
+            res["pairs_saved"] = int(res["pairs_saved"])
+            return res
+        return arrays["res"]
+
+
+def map_stage(stage, checkpoint_dir):
+    """
+    Memory-map the array stored as the result of a stage (e.g. "spectrogram"), without reading it: the checkpoints are stored uncompressed, so the array can be read in place in the .npz file. The array is loaded in memory if it cannot be mapped.
+
+    Parameters
+    ----------
+    stage: str, name of the stage, whose result is a single array, see save_stage.
+    checkpoint_dir: str, path of the directory of the checkpoints.
+
+    Returns
+    -------
+    arr: read-only numpy memmap (or array) of the result of the stage.
+    """
+    path = os.path.join(checkpoint_dir, stage + ".npz")
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo("res.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(path) as arrays:
+            return arrays["res"]
+    with open(path, "rb") as f:
+        # Local header of the member: 30 bytes, then its name and extra field
+        f.seek(info.header_offset)
+        header = f.read(30)
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+def tile_path(checkpoint_dir, key, start, stop):
+    """
+    Path of the checkpoint of the rows start to stop of the distance matrix, computed with the parameters and files identified by key (see stage_key).
+    """
+    return os.path.join(
+        checkpoint_dir, "match_tiles", "%s_%d_%d.npy" % (key, start, stop)
+    )
+
+
+def _to_json(value):
+    """
+    Convert the numpy values to types that can be written in JSON.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
@@ -0,0 +1,445 @@
+# Distributed execution of the analysis on several machines sharing a directory
+import os
+import json
+import time
+import shutil
+import warnings
+import socket
+import threading
+import traceback
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+from . import utils, catalog, image_matching, pipeline, resources
+from .checkpoint import _to_json
+
+# Subdirectories and files of the directory of the tasks, see run_coordinator
+_work_subdirs = ["todo", "claimed", "done", "workers"]
+_work_files = ["job.json", "stop", "descriptors.npz"]
+# Parameters of the pipeline that must keep their default value, the corresponding stages are not distributed
+_unsupported_params = [
+    "screen",
+    "min_keypoints",
+    "dedup",
+    "similarity",
+    "n_candidates",
+]
+
+
+def run_coordinator(
+    input_dir,
+    output_dir,
+    work_dir,
+    n_local_workers=0,
+    threads_per_worker=None,
+    chunk_size=16,
+    tile_rows=64,
+    worker_timeout=120,
+    poll=0.5,
+    estim_pop="Yes",
+    **params,
+):
+    """
+    Run the analysis with workers (see run_worker) started on any machine having access to work_dir, e.g. a directory shared by the nodes of a cluster.
+    The work is split in tasks written as files in work_dir: the per-file stages (import to keypoint detection) by chunks of files, then the distance matrix by tiles of rows. A worker claims a task by moving its file, so each task is done by a single worker. A task claimed by a worker that stopped sending heartbeats for worker_timeout seconds is given back to the other workers.
+    The results are the same as the ones of pipeline.Pipeline with pad_len set to the padded length of the signals, see padded_length.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory containing the WAV files, accessible by the workers.
+    output_dir: str, path of the directory where the results will be saved, accessible by the workers (they save the spectrograms with their keypoints in it).
+    work_dir: str, path of the directory of the tasks, accessible by the workers: a new or empty directory, or the one of a previous run, whose tasks are removed at the beginning of the run (see _clear_work_dir).
+    n_local_workers: int, number of workers started as local processes, 0 to only use workers started elsewhere.
+    threads_per_worker: int, number of threads used by OpenCV and the BLAS libraries in each local worker, None to share the processors between them, see resources.resource_config. The clustering uses the threads of all the local workers (all the processors without local workers).
+    chunk_size: int, number of files of each task of the per-file stages.
+    tile_rows: int, number of rows of the distance matrix of each task.
+    worker_timeout: float, time (in seconds) without heartbeat after which a worker is considered lost. The run is stopped with a RuntimeError when no worker sent a heartbeat for this time, e.g. when no worker was started.
+    poll: float, time (in seconds) between two checks of the tasks done.
+    estim_pop: str, "Yes" to estimate the population, see pop_estimation.
+    **params: the parameters of the analysis, see pipeline.default_params. The screening, deduplication, bag-of-visual-words similarity and candidate pruning are not supported.
+
+    Returns
+    -------
+    df_res: pandas DataFrame, the clustering results saved in clustering_results.csv.
+    dist_images: 2D array, the distance matrix.
+    """
+    p = dict(pipeline.default_params)
+    p.update(params)
+    p["input_dir"] = input_dir
+    changed = [k for k in _unsupported_params if p[k] != pipeline.default_params[k]]
+    if changed:
+        raise ValueError(
+            "The parameters %s are not supported by the distributed execution."
+            % ", ".join(changed)
+        )
+    # Same files, in the same order, as pipeline.Pipeline.catalog
+    catalog_path = None
+    if output_dir and os.path.isdir(output_dir):
+        catalog_path = os.path.join(output_dir, catalog.catalog_name)
+    list_wavs = catalog.update_catalog(
+        input_dir,
+        catalog_path,
+        recursive=p["recursive"] == "Yes",
+        files=p["list_wavs"],
+    ).File.to_numpy(dtype=str)
+    samp_freq = int(2 * (p["f_filt"][1] + 100))
+    if p["pad_len"] is None:
+        p["pad_len"] = padded_length(list_wavs, input_dir, samp_freq)
+    if p["nfeatures"] == "auto":
+        p["nfeatures"] = image_matching.feature_budget(
+            p["detector_methode"], int(p["n_matches"]), len(list_wavs)
+        )
+    # Directory of the tasks
+    _clear_work_dir(work_dir)
+    for d in _work_subdirs:
+        os.makedirs(os.path.join(work_dir, d))
+    job = {"output_dir": output_dir, "params": p}
+    with open(os.path.join(work_dir, "job.json"), "w") as f:
+        json.dump(job, f, indent=1, default=_to_json)
+    res_config = resources.resource_config(
+        n_local_workers if n_local_workers > 0 else None, threads_per_worker
+    )
+    threads = res_config["threads_per_worker"] if n_local_workers > 0 else None
+    workers = [
+        multiprocessing.Process(
+            target=run_worker, args=(work_dir,), kwargs={"threads_per_worker": threads}
+        )
+        for _ in range(n_local_workers)
+    ]
+    for w in workers:
+        w.start()
+    try:
+        # Per-file stages
+        chunks = [
+            list_wavs[k : k + chunk_size] for k in range(0, len(list_wavs), chunk_size)
+        ]
+        names = [
+            _add_task(work_dir, "features_%06d" % k, {"files": c})
+            for k, c in enumerate(chunks)
+        ]
+        kp_desc = []
+        for name in names:
+            with np.load(_wait_task(work_dir, name, worker_timeout, poll)) as arrays:
+                for k in range(len([f for f in arrays.files if f.startswith("kp_")])):
+                    kp_desc.append(
+                        (
+                            image_matching.array_to_keypoints(arrays["kp_%d" % k]),
+                            arrays["des_%d" % k] if "des_%d" % k in arrays else None,
+                        )
+                    )
+        # Distance matrix
+        n_specs = len(list_wavs)
+        descriptors, scale = [kd[1] for kd in kp_desc], 1.0
+        if p["compression"] != "No":
+            descriptors, scale = image_matching.compress_descriptors(
+                descriptors, p["compression"], int(p["n_components"])
+            )
+        np.savez(
+            os.path.join(work_dir, "descriptors.npz"),
+            **{"des_%d" % k: d for k, d in enumerate(descriptors) if d is not None},
+            n_specs=n_specs,
+            scale=scale,
+        )
+        tiles = [
+            (start, min(start + tile_rows, n_specs))
+            for start in range(0, n_specs, tile_rows)
+        ]
+        names = [
+            _add_task(work_dir, "tile_%06d" % k, {"start": t[0], "stop": t[1]})
+            for k, t in enumerate(tiles)
+        ]
+        dist_images = np.empty((n_specs, n_specs), dtype=np.dtype(p["precision"]))
+        for (start, stop), name in zip(tiles, names):
+            with np.load(_wait_task(work_dir, name, worker_timeout, poll)) as arrays:
+                dist_images[start:stop] = arrays["res"]
+    finally:
+        # Stop the workers
+        open(os.path.join(work_dir, "stop"), "w").close()
+        for w in workers:
+            w.join()
+    # Clustering and results
+    with resources.limit_threads(res_config["n_jobs"]):
+        clusters = image_matching.clustering_matches(
+            dist_images,
+            clustering_name=p["clustering"],
+            fill_value=p["fill_value"],
+            n_jobs=res_config["n_jobs"],
+        )
+    df_res = pd.DataFrame({"File": list_wavs, "Cluster": clusters})
+    df_res.to_csv(output_dir + "/clustering_results.csv", index=False)
+    pd.DataFrame(
+        {
+            "File": list_wavs,
+            "Number_of_keypoints": [len(kd[0]) for kd in kp_desc],
+        }
+    ).to_csv(output_dir + "/keypoints_per_file.csv", index=False)
+    if estim_pop == "Yes":
+        try:
+            pipeline.save_population(
+                df_res, output_dir, p["date_pattern"], p["date_format"]
+            )
+        except ValueError:
+            warnings.warn(
+                "Population estimation not performed as the filenames format is wrong."
+            )
+    return df_res, dist_images
+
+
+def run_worker(work_dir, worker_id=None, poll=0.5, threads_per_worker=None):
+    """
+    Do the tasks of a distributed run (see run_coordinator) until the coordinator stops the run. Several workers can run on the same machine or on different machines having access to work_dir, the input directory and the output directory.
+
+    Parameters
+    ----------
+    work_dir: str, path of the directory of the tasks.
+    worker_id: str, name of the worker, unique among the workers, None to use the name of the machine and the process id.
+    poll: float, time (in seconds) between two checks of the tasks available, also used as the period of the heartbeats.
+    threads_per_worker: int, number of threads used by OpenCV and the BLAS libraries by the worker, None to leave their settings unchanged.
+    """
+    resources.init_worker(threads_per_worker)
+    if worker_id is None:
+        worker_id = "%s_%d" % (socket.gethostname(), os.getpid())
+    heartbeat = os.path.join(work_dir, "workers", worker_id)
+    stop = threading.Event()
+
+    def beat():
+        # The heartbeat is sent even during long tasks
+        while not stop.is_set():
+            if os.path.isdir(os.path.dirname(heartbeat)):
+                with open(heartbeat, "w") as f:
+                    f.write(str(time.time()))
+            stop.wait(poll)
+
+    beat_thread = threading.Thread(target=beat, daemon=True)
+    beat_thread.start()
+    cache = {}
+    try:
+        while not os.path.isfile(os.path.join(work_dir, "stop")):
+            task = _claim_task(work_dir, worker_id)
+            if task is None:
+                time.sleep(poll)
+                continue
+            name, claimed = task
+            try:
+                with open(os.path.join(work_dir, "job.json")) as f:
+                    job = json.load(f)
+                with open(claimed) as f:
+                    content = json.load(f)
+                if name.startswith("features"):
+                    res = _features_task(job, content["files"])
+                else:
+                    res = _tile_task(
+                        job, work_dir, content["start"], content["stop"], cache
+                    )
+                out = os.path.join(work_dir, "done", name + ".npz")
+                np.savez(out[:-4] + ".tmp.npz", **res)
+                os.replace(out[:-4] + ".tmp.npz", out)
+            except Exception:
+                with open(os.path.join(work_dir, "done", name + ".err"), "w") as f:
+                    f.write(traceback.format_exc())
+            if os.path.isfile(claimed):
+                os.remove(claimed)
+    finally:
+        stop.set()
+        beat_thread.join()
+
+
+def padded_length(list_wavs, input_dir, samp_freq):
+    """
+    Length of the signals after padding: the largest length of the signals after resampling, computed from the WAV headers only.
+
+    Parameters
+    ----------
+    list_wavs: list of str, list of WAV file names.
+    input_dir: str, path of the directory containing the files.
+    samp_freq: int, the sampling frequency after resampling.
+
+    Returns
+    -------
+    pad_len: int, the number of samples.
+    """
+    pad_len = 0
+    for w in list_wavs:
+        sf, n_samples = utils.wav_info(os.path.join(input_dir, w))
+        pad_len = max(pad_len, int(np.ceil(n_samples * samp_freq / sf)))
+    return pad_len
+
+
+def _clear_work_dir(work_dir):
+    """
+    Remove the files of a previous run from the directory of the tasks, only the ones written by run_coordinator and run_worker. Raise a ValueError if the directory is not empty and is not the directory of a previous run, so that a wrong path never deletes other files.
+    """
+    if not os.path.isdir(work_dir):
+        return
+    if os.listdir(work_dir) and not os.path.isfile(os.path.join(work_dir, "job.json")):
+        raise ValueError(
+            "%s is not empty and is not the work directory of a previous run, give a new or empty directory."
+            % work_dir
+        )
+    for d in _work_subdirs:
+        if os.path.isdir(os.path.join(work_dir, d)):
+            shutil.rmtree(os.path.join(work_dir, d))
+    for f in _work_files:
+        if os.path.isfile(os.path.join(work_dir, f)):
+            os.remove(os.path.join(work_dir, f))
+
+
+def _add_task(work_dir, name, content):
+    """
+    Write a task in the directory of the tasks to do, and return its name.
+    """
+    path = os.path.join(work_dir, "todo", name + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(content, f, default=_to_json)
+    os.replace(path + ".tmp", path)
+    return name
+
+
+def _claim_task(work_dir, worker_id):
+    """
+    Claim the first task to do by moving it to the directory of the claimed tasks. Return its name and its new path, None if there is no task to do.
+    """
+    todo = os.path.join(work_dir, "todo")
+    if not os.path.isdir(todo):
+        return None
+    for f in sorted(os.listdir(todo)):
+        if not f.endswith(".json"):
+            continue
+        claimed = os.path.join(work_dir, "claimed", "%s.%s" % (f, worker_id))
+        try:
+            # Only one worker can move the file
+            os.rename(os.path.join(todo, f), claimed)
+        except FileNotFoundError:
+            continue
+        return f[:-5], claimed
+    return None
+
+
+def _wait_task(work_dir, name, worker_timeout, poll):
+    """
+    Wait for a task to be done and return the path of its result. The tasks claimed by lost workers are given back to the other workers. Raise a RuntimeError if the task failed, or if no worker sent a heartbeat for worker_timeout seconds.
+    """
+    result = os.path.join(work_dir, "done", name + ".npz")
+    last_alive = time.time()
+    while not os.path.isfile(result):
+        error = os.path.join(work_dir, "done", name + ".err")
+        if os.path.isfile(error):
+            with open(error) as f:
+                raise RuntimeError("The task %s failed:\n%s" % (name, f.read()))
+        _requeue_lost_tasks(work_dir, worker_timeout)
+        now = time.time()
+        if _live_workers(work_dir, worker_timeout):
+            last_alive = now
+        elif now - last_alive > worker_timeout:
+            raise RuntimeError(
+                "No worker sent a heartbeat for %d s, start workers with: python distributed_run.py worker --work-dir %s"
+                % (worker_timeout, work_dir)
+            )
+        time.sleep(poll)
+    return result
+
+
+def _live_workers(work_dir, worker_timeout):
+    """
+    Names of the workers that sent a heartbeat in the last worker_timeout seconds.
+    """
+    now = time.time()
+    live = []
+    for worker_id in os.listdir(os.path.join(work_dir, "workers")):
+        try:
+            last_beat = os.path.getmtime(os.path.join(work_dir, "workers", worker_id))
+        except FileNotFoundError:
+            continue
+        if now - last_beat <= worker_timeout:
+            live.append(worker_id)
+    return live
+
+
+def _requeue_lost_tasks(work_dir, worker_timeout):
+    """
+    Move back the tasks claimed by workers without heartbeat for worker_timeout seconds to the directory of the tasks to do.
+    """
+    now = time.time()
+    for f in os.listdir(os.path.join(work_dir, "claimed")):
+        task, worker_id = f.split(".json.", 1)
+        heartbeat = os.path.join(work_dir, "workers", worker_id)
+        try:
+            last_beat = os.path.getmtime(heartbeat)
+        except FileNotFoundError:
+            last_beat = 0
+        if now - last_beat > worker_timeout and not os.path.isfile(
+            os.path.join(work_dir, "done", task + ".npz")
+        ):
+            try:
+                os.rename(
+                    os.path.join(work_dir, "claimed", f),
+                    os.path.join(work_dir, "todo", task + ".json"),
+                )
+            except FileNotFoundError:
+                pass
+
+
+def _features_task(job, files):
+    """
+    Import, filter, pad the signals of a chunk of files, draw their spectrograms and detect their keypoints. The spectrograms with their keypoints are saved in the output directory.
+    """
+    p = job["params"]
+    list_arr = pipeline._signals_chunk(
+        files,
+        p["input_dir"],
+        p["f_filt"][1],
+        p["resample_quality"],
+        list(p["f_filt"]),
+        p["wlt_filt"],
+        "wavelet",
+        dtype=np.dtype(p.get("precision", "float64")),
+    )
+    if max(len(a) for a in list_arr) > p["pad_len"]:
+        raise ValueError("A signal is longer than the padded length %d." % p["pad_len"])
+    spectros = pipeline._features_chunk(
+        utils.pad_signals(list_arr, p["pad_len"]),
+        int(2 * (p["f_filt"][1] + 100)),
+        list(p["f_filt"]),
+        int(p["wlen"]),
+        int(p["ovlp"]),
+        int(p["wlen_env"]),
+        int(p["ovlp_env"]),
+    )
+    kp_desc, _ = image_matching.detect_keypoints(
+        spectros, p["detector_methode"], p["nfeatures"], executor="serial"
+    )
+    image_matching.save_spectros_keypoints(spectros, kp_desc, files, job["output_dir"])
+    res = {}
+    for k, (kp, des) in enumerate(kp_desc):
+        res["kp_%d" % k] = image_matching.keypoints_to_array(kp)
+        if des is not None:
+            res["des_%d" % k] = des
+    return res
+
+
+def _tile_task(job, work_dir, start, stop, cache):
+    """
+    Compute the rows start to stop of the distance matrix. The descriptors of all the files are loaded once per worker.
+    """
+    if "descriptors" not in cache:
+        with np.load(os.path.join(work_dir, "descriptors.npz")) as arrays:
+            cache["descriptors"] = [
+                arrays["des_%d" % k] if "des_%d" % k in arrays else None
+                for k in range(int(arrays["n_specs"]))
+            ]
+            cache["scale"] = float(arrays["scale"]) if "scale" in arrays else 1.0
+    _, matcher = image_matching.feature_detector_matcher(
+        job["params"]["detector_methode"],
+        matcher=job["params"].get("matcher", "opencv"),
+    )
+    if isinstance(matcher, image_matching.L2Matcher):
+        matcher.scale = cache["scale"]
+    dist = image_matching.distance_matrix(
+        cache["descriptors"],
+        matcher,
+        int(job["params"]["n_matches"]),
+        rows=range(start, stop),
+        dtype=np.dtype(job["params"].get("precision", "float64")),
+    )
+    return {"res": dist}
@@ -0,0 +1,96 @@
+# Bag-of-visual-words embedding of the spectrograms, to cluster them without matching all the pairs
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+
+def build_vocabulary(list_descriptors, n_words=256, sample_size=100000, random_state=0):
+    """
+    Build a visual vocabulary: the descriptors of the spectrograms are clustered with a mini-batch k-means, each cluster center being a visual word.
+    Binary descriptors (ORB, AKAZE) are unpacked in bits (0 or 1) before clustering.
+
+    Parameters
+    ----------
+    list_descriptors: list of arrays, the descriptors of each spectrogram, see image_matching.detect_keypoints.
+    n_words: int, number of words of the vocabulary.
+    sample_size: int, maximum number of descriptors, randomly sampled from all the spectrograms, used to build the vocabulary.
+    random_state: int, seed of the sampling and of the k-means.
+
+    Returns
+    -------
+    vocabulary: a fitted sklearn.cluster.MiniBatchKMeans instance, its cluster_centers_ being the visual words.
+    """
+    list_des = [
+        descriptors_as_float(d) for d in list_descriptors if d is not None and len(d)
+    ]
+    if not list_des:
+        raise ValueError("No spectrogram has descriptors to build the vocabulary.")
+    all_des = np.vstack(list_des)
+    rng = np.random.default_rng(random_state)
+    if len(all_des) > sample_size:
+        all_des = all_des[rng.choice(len(all_des), sample_size, replace=False)]
+    n_words = min(n_words, len(all_des))
+    vocabulary = MiniBatchKMeans(
+        n_clusters=n_words, batch_size=4096, n_init=3, random_state=random_state
+    )
+    vocabulary.fit(all_des)
+    return vocabulary
+
+
+def encode_spectros(list_descriptors, vocabulary, encoding="histogram"):
+    """
+    Encode each spectrogram as a fixed-length vector from its descriptors and a visual vocabulary.
+    - "histogram": the number of descriptors assigned to each word, square-rooted and L2-normalized.
+    - "vlad": VLAD (Vector of Locally Aggregated Descriptors), the sum of the differences between the descriptors and their word, for each word, power-normalized and L2-normalized.
+    Spectrograms without descriptors are encoded as a vector of 0s.
+
+    Parameters
+    ----------
+    list_descriptors: list of arrays, the descriptors of each spectrogram, see image_matching.detect_keypoints.
+    vocabulary: the visual vocabulary, see build_vocabulary.
+    encoding: str, "histogram" or "vlad".
+
+    Returns
+    -------
+    embeddings: 2D array, of shape (number of spectrograms, number of words) for "histogram" and (number of spectrograms, number of words x descriptor size) for "vlad".
+    """
+    centers = vocabulary.cluster_centers_
+    n_words, dim = centers.shape
+    if encoding == "histogram":
+        embeddings = np.zeros((len(list_descriptors), n_words))
+    elif encoding == "vlad":
+        embeddings = np.zeros((len(list_descriptors), n_words * dim))
+    else:
+        raise ValueError("The encoding must be 'histogram' or 'vlad'.")
+    for k, des in enumerate(list_descriptors):
+        if des is None or len(des) == 0:
+            continue
+        des = descriptors_as_float(des)
+        words = vocabulary.predict(des)
+        if encoding == "histogram":
+            vec = np.sqrt(np.bincount(words, minlength=n_words))
+        else:
+            vec = np.zeros((n_words, dim))
+            np.add.at(vec, words, des - centers[words])
+            vec = vec.reshape(-1)
+            vec = np.sign(vec) * np.sqrt(np.abs(vec))
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            embeddings[k] = vec / norm
+    return embeddings
+
+
+def descriptors_as_float(des):
+    """
+    Convert descriptors to float 32 bits, binary descriptors (8-bit unsigned integers, from ORB or AKAZE) being unpacked in bits.
+
+    Parameters
+    ----------
+    des: 2D array, the descriptors of a spectrogram.
+
+    Returns
+    -------
+    des_float: 2D array of float 32 bits.
+    """
+    if des.dtype == np.uint8:
+        return np.unpackbits(des, axis=1).astype(np.float32)
+    return des.astype(np.float32)
@@ -11,7 +11,7 @@ def butterfilter(
     freq_band,
 ):
     """
-    Denoise a 1D signal using a very strict bandpass filter (Order 10 butterworth).
+    Denoise a 1D signal using a very strict bandpass filter (Order 10 butterworth). A float 32 bits signal is filtered in single precision.
 
     Parameters
     ----------
@@ -25,6 +25,8 @@ def butterfilter(
     """
     # Make the filter
     sos = butter(10, freq_band, btype="bandpass", fs=sf, output="sos")
+    if signal.dtype == np.float32:
+        sos = sos.astype(np.float32)
     # Apply it
     signal_filt = sosfiltfilt(sos, signal)
     return signal_filt
@@ -32,7 +34,7 @@ def butterfilter(
 
 def wlt_denoise(signal, wlt="bior3.1"):
     """
-    Denoise a 1D signal using the SWT (Stationary wavelet transform) also known as "algorithme à trous", see Percival and Walden, 2000.
+    Denoise a 1D signal using the SWT (Stationary wavelet transform) also known as "algorithme à trous", see Percival and Walden, 2000. The coefficients have the dtype of the signal (float 32 or 64 bits).
 
     DB Percival and AT Walden. Wavelet Methods for Time Series Analysis. Cambridge University Press, 2000.
 
@@ -58,12 +60,12 @@ def wlt_denoise(signal, wlt="bior3.1"):
     # if kurtosis < 0 => replace by zeros
     # else : soft thresholding by standard deviation
     signal_swt_filt = [
-        np.zeros(len(signal_swt[0]))
+        np.zeros_like(signal_swt[0])
     ]  # The approximated coefficents are zeroed out
     for i in range(1, max_lvl):
         kurt = kurtosis(signal_swt[i])
         if kurt < 0:
-            coef_filt = np.zeros(len(signal_swt[i]))
+            coef_filt = np.zeros_like(signal_swt[i])
         else:
             coef_filt = pywt.threshold(
                 signal_swt[i], np.std(signal_swt[i]), mode="soft", substitute=0
@@ -72,7 +74,59 @@ def wlt_denoise(signal, wlt="bior3.1"):
     # Reconstrustion
     signal_wlt_filt = pywt.iswt(signal_swt_filt, wlt)
     signal_wlt_filt = signal_wlt_filt[: len(signal)]
-    # Start at the first non null value
-    signal_wlt_filt = signal_wlt_filt[np.where(signal_wlt_filt != 0)[0][0] :]
+    # Start at the first non null value, if any (the whole signal can be zeroed out)
+    non_null = np.flatnonzero(signal_wlt_filt)
+    if len(non_null):
+        signal_wlt_filt = signal_wlt_filt[non_null[0] :]
     # Return result
     return signal_wlt_filt
+
+
+def band_energy_ratio(signal, signal_filt):
+    """
+    Ratio between the energy of a signal in the frequency band of interest and its total energy, to detect recordings of wind or other noise outside of the band.
+
+    Parameters
+    ----------
+    signal: 1D array, the signal.
+    signal_filt: 1D array, the signal filtered in the frequency band of interest, see butterfilter.
+
+    Returns
+    -------
+    ratio: float, between 0 and 1, 0 for signals without energy.
+    """
+    energy = np.sum(signal**2)
+    if not np.isfinite(energy) or energy == 0:
+        return 0.0
+    return float(np.sum(signal_filt**2) / energy)
+
+
+def envelope_modulation(signal_filt, sf, pulse_rate=(10, 50), env_sf=200):
+    """
+    Measure how much the amplitude of a filtered signal is modulated at the pulse rate of the calls. The envelope of the signal (mean of its absolute value on blocks of 1/env_sf s) is computed, then the spectral flatness of the envelope in the pulse rate band: the modulation is 1 minus this flatness. Stationary noise (rain, wind, hiss) gives a flat envelope spectrum, and a low modulation, while a series of pulses gives peaks and a modulation close to 1.
+
+    Parameters
+    ----------
+    signal_filt: 1D array, the signal filtered in the frequency band of interest, see butterfilter.
+    sf: int, sampling frequency.
+    pulse_rate: a length-2 list, the range of pulse rates of the calls [low,high], in Hz.
+    env_sf: int, sampling frequency of the envelope, at least twice the highest pulse rate.
+
+    Returns
+    -------
+    modulation: float, between 0 and 1, 0 for signals without energy and NaN for signals too short to measure the pulse rate.
+    """
+    block = max(sf // env_sf, 1)
+    n_blocks = len(signal_filt) // block
+    env = np.abs(signal_filt[: n_blocks * block]).reshape(n_blocks, block).mean(axis=1)
+    if not np.all(np.isfinite(env)) or not np.any(env):
+        return 0.0
+    power = np.abs(np.fft.rfft(env - env.mean())) ** 2
+    freqs = np.fft.rfftfreq(n_blocks, block / sf)
+    power = power[(freqs >= pulse_rate[0]) & (freqs <= pulse_rate[1])]
+    if len(power) < 2:
+        return np.nan
+    if not np.all(power > 0):
+        return 1.0
+    flatness = np.exp(np.mean(np.log(power))) / np.mean(power)
+    return float(1 - flatness)
@@ -1,7 +1,11 @@
 # Image matching using features extractions
 import numpy as np
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import cv2  # opencv-python
+from scipy import sparse
+from scipy.sparse import csgraph
 from sklearn.mixture import GaussianMixture
 from sklearn.cluster import (
     HDBSCAN,
@@ -13,12 +17,28 @@ from sklearn.cluster import (
 )
 from sklearn.metrics import silhouette_score
 
+from . import resources
+
+# Maximum number of keypoints per spectrogram for each feature extraction algorithm, see feature_budget
+default_nfeatures = {
+    "SIFT": 1000,
+    "ORB": 500,
+    "ORB custom": 500,
+    "AKAZE": 1000,
+    "KAZE": 1000,
+}
+# Feature extraction algorithms with float descriptors, matched with the L2 norm, see feature_detector_matcher
+l2_detectors = ["SIFT", "KAZE"]
+# Maximum number of squared distances between descriptors computed at once by L2Matcher (64 MB in float32)
+l2_block_size = 2**24
+
 
 def cluster_spectro(
     list_spectros,
     n_matches=10,
     detector_methode="ORB custom",
     clustering="Affinity Propagation",
+    n_candidates=None,
 ):
     """
     Cluster the combined spectrograms.
@@ -27,28 +47,198 @@ def cluster_spectro(
     ----------
     list_spectros: list of arrays, each array being the combinaison of both STFTs on each filtered sound.
     n_matches: int, number of the closest matches to keep when calculating the distance between two arrays.
+    n_candidates: int, number of candidate neighbours matched per spectrogram, see candidate_pairs. None to match all the pairs.
 
     Returns
     -------
     cluster_labels: 1D array, of same length as list_spectros, with the cluter label of each array.
     keypoints_descriptors: length-n list, each element being a tupple, with the keypoints and descriptors of each array of list_spectros.
     """
-    liste_8bits = [transfo_8bits(s) for s in list_spectros]
-    detector, matcher = feature_detector_matcher(name=detector_methode)
-    keypoints_descriptors = [detector.detectAndCompute(l, None) for l in liste_8bits]
-    n_specs = len(liste_8bits)
-    dist_images = [
-        distance_matches(
-            matcher, keypoints_descriptors[i][1], keypoints_descriptors[j][1], n_matches
+    liste_8bits = _list_8bits(list_spectros)
+    _, matcher = feature_detector_matcher(name=detector_methode)
+    keypoints_descriptors, _ = detect_keypoints(liste_8bits, detector_methode)
+    list_descriptors = [kd[1] for kd in keypoints_descriptors]
+    if n_candidates is None:
+        dist_images = distance_matrix(list_descriptors, matcher, n_matches)
+    else:
+        pairs = candidate_pairs(list_descriptors, detector_methode, n_candidates)
+        dist_images = sparse_distance_matrix(
+            list_descriptors, matcher, pairs, n_matches
         )
-        for i in range(n_specs)
-        for j in range(n_specs)
-    ]
-    dist_images = np.array(dist_images).reshape((n_specs, n_specs))
     cluster_labels = clustering_matches(dist_images, clustering_name=clustering)
     return cluster_labels, keypoints_descriptors
 
 
+def distance_matrix(
+    list_descriptors, matcher, n_matches=10, rows=None, dtype=np.float64
+):
+    """
+    Calculate the matching distance between each pair of images.
+
+    Parameters
+    ----------
+    list_descriptors: list of arrays, the descriptors of each image resulting from the application of a feature extractor.
+    matcher: the matcher that will be used to match the descriptors, see feature_detector_matcher.
+    n_matches: int, number of the closest matches to keep when calculating the distance between two arrays.
+    rows: the indices of the images of the rows to compute (e.g. range(0, 64) for a tile of 64 rows), None for all the images.
+    dtype: numpy dtype of the distances, np.float64 or np.float32 to halve the memory of the matrix.
+
+    Returns
+    -------
+    dist_images: 2D array of dtype, a n by n array, with n the number of images. dist_images[i,j] contains the matching distance of image i and image j. Only the given rows if rows is not None.
+    """
+    n_specs = len(list_descriptors)
+    if isinstance(matcher, L2Matcher) and rows is None:
+        # The matching being symmetric, only the upper triangle is computed
+        dist_images = np.zeros((n_specs, n_specs), dtype=dtype)
+        for i in range(n_specs):
+            dist_images[i, i:] = matcher.distances(
+                list_descriptors[i], list_descriptors[i:], n_matches
+            )
+        lower = np.tril_indices(n_specs, -1)
+        dist_images[lower] = dist_images.T[lower]
+        return dist_images
+    if rows is None:
+        rows = range(n_specs)
+    if isinstance(matcher, L2Matcher):
+        dist_images = [
+            matcher.distances(list_descriptors[i], list_descriptors, n_matches)
+            for i in rows
+        ]
+    else:
+        dist_images = [
+            distance_matches(
+                matcher, list_descriptors[i], list_descriptors[j], n_matches
+            )
+            for i in rows
+            for j in range(n_specs)
+        ]
+    dist_images = np.array(dist_images, dtype=dtype).reshape((len(rows), n_specs))
+    return dist_images
+
+
+def candidate_pairs(
+    list_descriptors, detector_methode="ORB custom", n_candidates=10, n_neighbors=5
+):
+    """
+    Find the pairs of images worth matching, without matching all of them. The descriptors of all the images are put in a single approximate nearest-neighbour index (FLANN, with locality-sensitive hashing for the binary descriptors of ORB and AKAZE and randomized KD-trees for the ones of SIFT and KAZE). Each descriptor of an image votes for the images of its n_neighbors nearest descriptors, and the n_candidates images with the most votes are the candidates of the image.
+
+    Parameters
+    ----------
+    list_descriptors: list of arrays, the descriptors of each image, see detect_keypoints.
+    detector_methode: str, name of the feature detector used to get the descriptors, see feature_detector_matcher.
+    n_candidates: int, number of candidates per image. Images without enough votes are completed with other images, so each image has exactly n_candidates candidates.
+    n_neighbors: int, number of nearest descriptors searched for each descriptor.
+
+    Returns
+    -------
+    pairs: 2D array of integers, of shape (number of pairs, 2), each row being the indices (i, j) of a pair of images to match. If (i, j) is a pair, (j, i) is too.
+    """
+    n_specs = len(list_descriptors)
+    if n_candidates >= n_specs - 1:
+        i, j = np.nonzero(~np.eye(n_specs, dtype=bool))
+        return np.column_stack([i, j])
+    if detector_methode in l2_detectors:
+        index_params = dict(algorithm=1, trees=4)  # FLANN_INDEX_KDTREE
+    else:
+        index_params = dict(
+            algorithm=6, table_number=6, key_size=12, multi_probe_level=1
+        )  # FLANN_INDEX_LSH
+    indexed = [
+        k for k, d in enumerate(list_descriptors) if d is not None and len(d) > 0
+    ]
+    matcher = cv2.FlannBasedMatcher(index_params, dict(checks=50))
+    matcher.add([list_descriptors[k] for k in indexed])
+    if indexed:
+        matcher.train()
+    indexed = np.array(indexed, dtype=int)
+    candidates = np.empty((n_specs, n_candidates), dtype=int)
+    for i in range(n_specs):
+        votes = np.zeros(n_specs)
+        des = list_descriptors[i]
+        if des is not None and len(des) > 0:
+            knn = matcher.knnMatch(des, k=n_neighbors + 1)
+            img_idx = [m.imgIdx for neighbors in knn for m in neighbors]
+            votes = np.bincount(indexed[img_idx], minlength=n_specs).astype(float)
+        votes[i] = -1
+        candidates[i] = np.argsort(-votes, kind="stable")[:n_candidates]
+    pairs = np.column_stack(
+        [np.repeat(np.arange(n_specs), n_candidates), candidates.ravel()]
+    )
+    pairs = np.unique(np.vstack([pairs, pairs[:, ::-1]]), axis=0)
+    return pairs
+
+
+def sparse_distance_matrix(
+    list_descriptors, matcher, pairs, n_matches=10, dtype=np.float64
+):
+    """
+    Calculate the matching distance of the given pairs of images only, see candidate_pairs.
+
+    Parameters
+    ----------
+    list_descriptors: list of arrays, the descriptors of each image resulting from the application of a feature extractor.
+    matcher: the matcher that will be used to match the descriptors, see feature_detector_matcher.
+    pairs: 2D array of integers, of shape (number of pairs, 2), the indices of the pairs of images to match.
+    n_matches: int, number of the closest matches to keep when calculating the distance between two arrays.
+    dtype: numpy dtype of the distances, np.float64 or np.float32.
+
+    Returns
+    -------
+    dist_graph: scipy sparse matrix (CSR) of dtype, a n by n matrix, with n the number of images. dist_graph[i,j] contains the matching distance of image i and image j if (i, j) is in pairs, the other pairs are not stored. A distance of 0 is stored as the smallest positive float, so it is not taken for a missing pair.
+    """
+    n_specs = len(list_descriptors)
+    if isinstance(matcher, L2Matcher):
+        # The pairs of an image are matched together, the pairs being sorted by image
+        order = np.argsort(pairs[:, 0], kind="stable")
+        starts = np.flatnonzero(np.diff(pairs[order, 0], prepend=-1))
+        dist = np.empty(len(pairs), dtype=dtype)
+        for idx in np.split(order, starts[1:]):
+            if len(idx):
+                dist[idx] = matcher.distances(
+                    list_descriptors[pairs[idx[0], 0]],
+                    [list_descriptors[j] for j in pairs[idx, 1]],
+                    n_matches,
+                )
+    else:
+        dist = np.array(
+            [
+                distance_matches(
+                    matcher, list_descriptors[i], list_descriptors[j], n_matches
+                )
+                for i, j in pairs
+            ],
+            dtype=dtype,
+        )
+    dist = np.maximum(dist, np.finfo(dtype).tiny)
+    dist_graph = sparse.csr_matrix(
+        (dist, (pairs[:, 0], pairs[:, 1])), shape=(n_specs, n_specs)
+    )
+    return dist_graph
+
+
+def dense_distance_matrix(dist_graph, fill_value=None):
+    """
+    Convert a sparse matrix of matching distances (see sparse_distance_matrix) to a full distance matrix.
+
+    Parameters
+    ----------
+    dist_graph: scipy sparse matrix, the matching distances of the matched pairs of images.
+    fill_value: float, distance given to the pairs of images that were not matched, None to use the largest matching distance.
+
+    Returns
+    -------
+    dist_images: 2D array, a n by n array, with n the number of images, with distances of 0 on the diagonal, with the dtype of dist_graph.
+    """
+    dist_graph = sparse.coo_matrix(dist_graph)
+    if fill_value is None:
+        fill_value = dist_graph.data.max() if dist_graph.nnz else 0
+    dist_images = np.full(dist_graph.shape, fill_value, dtype=dist_graph.dtype)
+    dist_images[dist_graph.row, dist_graph.col] = dist_graph.data
+    np.fill_diagonal(dist_images, 0)
+    return dist_images
+
+
 def save_spectros_keypoints(list_spectros, keypoints_descriptors, names, dir):
     """
     Get images (here, the combined spectrograms), draw all keypoints identified in it and then save them in a directory.
@@ -57,7 +247,7 @@ def save_spectros_keypoints(list_spectros, keypoints_descriptors, names, dir):
     ----------
     list_spectros: list of 2D arrays, list of the spectrograms.
     keypoints_descriptors: list of length-2 tuples, containing the keypoints and descriptors of each array in list_spectros.
-    names: list containing the name of the WAV files from which  the spectrograms were drawn.
+    names: list containing the name of the audio files from which  the spectrograms were drawn (or their paths relative to the input directory, see catalog.scan_audio).
     dir: str, directrory where the files will be saved.
 
     Return
@@ -68,33 +258,169 @@ def save_spectros_keypoints(list_spectros, keypoints_descriptors, names, dir):
     if not os.path.isdir(dir):
         os.mkdir(dir)
     n_specs = len(list_spectros)
-    list_spectros = [transfo_8bits(s) for s in list_spectros]
+    list_spectros = _list_8bits(list_spectros)
     for k in range(n_specs):
         img = cv2.drawKeypoints(
             list_spectros[k],
             keypoints_descriptors[k][0],
             None,
         )
-        cv2.imwrite(dir + "/" + names[k].split(".wav")[0] + ".jpg", img)
+        path = dir + "/" + os.path.splitext(names[k])[0] + ".jpg"
+        # The files of subdirectories are saved in the same subdirectories
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, img)
 
 
 def transfo_8bits(arr):
     """
     Convert a 2D array in 8-bit unsigned integers, for compatibility with OpenCV. The array will be normalize by its maximum.
+    A 3D array is considered as a stack of 2D arrays, each one normalized by its own maximum. Arrays already in 8-bit unsigned integers (e.g. from spectro.draw_specs_stack) are returned as is.
 
     Parameters
     ----------
-    arr: 2D array, array to convert.
+    arr: 2D or 3D array, array to convert.
 
     Returns
     -------
-    arr_8bits: 2D array, 8-bit unsigned array.
+    arr_8bits: 2D or 3D array, 8-bit unsigned array.
     """
-    arr_8bits = 255 * abs(arr / np.max(arr))
+    if arr.dtype == np.uint8:
+        return arr
+    arr_8bits = 255 * abs(arr / np.max(arr, axis=(-2, -1), keepdims=True))
     return arr_8bits.astype(np.uint8)
 
 
-def feature_detector_matcher(name="ORB custom"):
+def _list_8bits(list_spectros):
+    """
+    Convert a list or a 3D stack of spectrograms in 8 bits, the stacks being converted at once, see transfo_8bits.
+    """
+    if isinstance(list_spectros, np.ndarray) and list_spectros.ndim == 3:
+        return transfo_8bits(list_spectros)
+    return [transfo_8bits(s) for s in list_spectros]
+
+
+def spectro_hashes(list_8bits, hash_size=8):
+    """
+    Compute a perceptual hash (difference hash) of each 8-bit spectrogram. Each image is downsampled to (hash_size, hash_size + 1) pixels and each bit of the hash tells if a pixel is brighter than its right neighbour. Near-identical spectrograms (repeated calls, echoes, empty or noise-only recordings) have hashes with a small Hamming distance.
+
+    Parameters
+    ----------
+    list_8bits: list of 2D arrays, the 8-bit spectrograms, see transfo_8bits.
+    hash_size: int, size of the hash, the hash has hash_size**2 bits.
+
+    Returns
+    -------
+    hashes: 2D array of shape (number of spectrograms, hash_size**2 / 8), the packed bits of the hash of each spectrogram.
+    """
+    hashes = []
+    for img in list_8bits:
+        small = cv2.resize(
+            img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA
+        )
+        bits = small[:, 1:] > small[:, :-1]
+        hashes.append(np.packbits(bits))
+    hashes = np.array(hashes, dtype=np.uint8).reshape((len(list_8bits), -1))
+    return hashes
+
+
+def group_duplicates(hashes, max_distance=0):
+    """
+    Group the spectrograms with identical or near-identical perceptual hashes, see spectro_hashes.
+    Candidates are found with a hash index: the hashes are split in max_distance + 1 bands, and two hashes with a Hamming distance lower or equal to max_distance share at least one identical band. Only the pairs sharing a band are compared.
+
+    Parameters
+    ----------
+    hashes: 2D array, the packed hashes, see spectro_hashes.
+    max_distance: int, maximum Hamming distance (in bits) between two hashes to consider the spectrograms as duplicates, 0 to only group identical hashes.
+
+    Returns
+    -------
+    groups: 1D array, the index of the group of each spectrogram.
+    representatives: 1D array, the index of the spectrogram representing each group (the first one of the group).
+    """
+    # Identical hashes are grouped directly
+    uniq, inverse = np.unique(hashes, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    bits = np.unpackbits(uniq, axis=1)
+    # Union-find of the near-identical hashes
+    parent = np.arange(len(uniq))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if max_distance > 0:
+        n_bands = min(max_distance + 1, bits.shape[1])
+        for band in np.array_split(np.arange(bits.shape[1]), n_bands):
+            index = {}
+            for i, key in enumerate(np.packbits(bits[:, band], axis=1)):
+                index.setdefault(key.tobytes(), []).append(i)
+            for candidates in index.values():
+                for k, i in enumerate(candidates[:-1]):
+                    others = np.array(candidates[k + 1 :])
+                    dist = np.count_nonzero(bits[others] != bits[i], axis=1)
+                    for j in others[dist <= max_distance]:
+                        ri, rj = find(i), find(j)
+                        parent[max(ri, rj)] = min(ri, rj)
+    roots = np.array([find(i) for i in range(len(uniq))], dtype=int)[inverse]
+    _, representatives, groups = np.unique(
+        roots, return_index=True, return_inverse=True
+    )
+    return groups, representatives
+
+
+def keypoints_to_array(keypoints):
+    """
+    Convert a list of OpenCV keypoints in an array, so that they can be saved or sent to other processes (cv2.KeyPoint cannot be pickled).
+
+    Parameters
+    ----------
+    keypoints: list of cv2.KeyPoint, the keypoints of an image.
+
+    Returns
+    -------
+    kp_arr: 2D array of shape (number of keypoints, 7), each row containing the x and y coordinates, size, angle, response, octave and class id of a keypoint.
+    """
+    kp_arr = np.array(
+        [
+            (k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave, k.class_id)
+            for k in keypoints
+        ],
+        dtype=np.float32,
+    ).reshape((-1, 7))
+    return kp_arr
+
+
+def array_to_keypoints(kp_arr):
+    """
+    Convert an array created with keypoints_to_array back to a list of OpenCV keypoints.
+
+    Parameters
+    ----------
+    kp_arr: 2D array of shape (number of keypoints, 7), see keypoints_to_array.
+
+    Returns
+    -------
+    keypoints: list of cv2.KeyPoint, the keypoints.
+    """
+    keypoints = [
+        cv2.KeyPoint(
+            float(k[0]),
+            float(k[1]),
+            float(k[2]),
+            float(k[3]),
+            float(k[4]),
+            int(k[5]),
+            int(k[6]),
+        )
+        for k in kp_arr
+    ]
+    return keypoints
+
+
+def feature_detector_matcher(name="ORB custom", nfeatures=None, matcher="opencv"):
     """
     Return a keypoint detector and descriptor extractor based on its name and the matcher, used to match descriptors between images.
 
@@ -102,30 +428,161 @@ def feature_detector_matcher(name="ORB custom"):
     ---------
     name: str, name of the feature detector, choose from: "ORB", "ORB custom", "AKAZE", "KAZE", "SIFT".
     "ORB custom" is an ORB instance created with parameters tunned to separate ptarmigans.
+    nfeatures: int, maximum number of keypoints retained by "SIFT", "ORB" and "ORB custom", None for their default. "AKAZE" and "KAZE" have no such parameter, see detect_keypoints.
+    matcher: str, "opencv" for the brute-force matcher of OpenCV, or "blas" for the L2Matcher, matching the float descriptors of "SIFT" and "KAZE" by blocks of images with matrix multiplications.
 
     Returns
     -------
     detector: class instance of the feature detector.
     matcher: class instance of the corresponding matcher of featres between images.
     """
+    kwargs = {} if nfeatures is None else {"nfeatures": int(nfeatures)}
     if name == "SIFT":
-        detector = cv2.SIFT_create()
-        matcher = cv2.BFMatcher(crossCheck=True)
+        detector = cv2.SIFT_create(**kwargs)
+        bf_matcher = cv2.BFMatcher(crossCheck=True)
     elif name == "ORB":
-        detector = cv2.ORB_create()
-        matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        detector = cv2.ORB_create(**kwargs)
+        bf_matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
     elif name == "ORB custom":
-        detector = cv2.ORB_create(edgeThreshold=1, nlevels=7)
-        matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        detector = cv2.ORB_create(edgeThreshold=1, nlevels=7, **kwargs)
+        bf_matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
     elif name == "AKAZE":
         detector = cv2.AKAZE_create()
-        matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+        bf_matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
     elif name == "KAZE":
         detector = cv2.KAZE_create()
-        matcher = cv2.BFMatcher(crossCheck=True)
+        bf_matcher = cv2.BFMatcher(crossCheck=True)
+    if matcher == "blas":
+        if name not in l2_detectors:
+            raise ValueError(
+                "The 'blas' matcher only works with the float descriptors of %s."
+                % " and ".join(l2_detectors)
+            )
+        matcher = L2Matcher()
+    elif matcher == "opencv":
+        matcher = bf_matcher
+    else:
+        raise ValueError("The matcher must be 'opencv' or 'blas'.")
     return detector, matcher
 
 
+def feature_budget(name, n_matches, n_specs, max_comparisons=1e12):
+    """
+    Adaptive maximum number of keypoints per spectrogram, to bound the cost of matching all the pairs of spectrograms. The brute-force matching of all pairs compares about (number of spectrograms x number of keypoints)**2 pairs of descriptors: the budget keeps this number below max_comparisons, without going under 2 x n_matches keypoints or above the default of the detector (see default_nfeatures).
+
+    Parameters
+    ----------
+    name: str, name of the feature detector, see feature_detector_matcher.
+    n_matches: int, number of the closest matches kept when calculating the distance between two spectrograms.
+    n_specs: int, number of spectrograms.
+    max_comparisons: float, maximum number of comparisons of descriptors for the whole matching.
+
+    Returns
+    -------
+    nfeatures: int, the maximum number of keypoints per spectrogram.
+    """
+    nfeatures = np.sqrt(max_comparisons) / max(n_specs, 1)
+    nfeatures = min(default_nfeatures[name], max(2 * n_matches, nfeatures))
+    return int(nfeatures)
+
+
+def detect_keypoints(
+    list_8bits,
+    detector_methode="ORB custom",
+    nfeatures=None,
+    executor="thread",
+    n_workers=None,
+    cv2_threads=1,
+    chunk_size=16,
+):
+    """
+    Detect the keypoints and compute the descriptors of each spectrogram, in parallel.
+    When several workers are used, the number of threads used internally by OpenCV and by the BLAS libraries is set to cv2_threads (and restored afterwards), so that the workers and their threads do not oversubscribe the processors, see resources.resource_config.
+
+    Parameters
+    ----------
+    list_8bits: list or 3D array of 8-bit spectrograms, see transfo_8bits.
+    detector_methode: str, name of the feature detector, see feature_detector_matcher.
+    nfeatures: int, maximum number of keypoints per spectrogram, the keypoints with the strongest responses being kept. None to keep all the keypoints found by the detector. See feature_budget to get an adaptive budget.
+    executor: str, "serial", "thread" (OpenCV releases the GIL) or "process".
+    n_workers: int, number of workers, None to use the number of processors.
+    cv2_threads: int, number of threads used by OpenCV and the BLAS libraries in each worker, None to leave their settings unchanged.
+    chunk_size: int, number of spectrograms sent to a worker at once.
+
+    Returns
+    -------
+    keypoints_descriptors: list of tuples, with the keypoints and descriptors of each spectrogram.
+    n_keypoints: 1D array, the number of keypoints of each spectrogram, 0 for empty or degenerated spectrograms.
+    """
+    chunks = [
+        list_8bits[k : k + chunk_size] for k in range(0, len(list_8bits), chunk_size)
+    ]
+    if executor == "serial":
+        res_chunks = [
+            _detect_chunk(c, detector_methode, nfeatures, to_array=False)
+            for c in chunks
+        ]
+    elif executor == "thread":
+        with resources.limit_threads(cv2_threads):
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                res_chunks = list(
+                    pool.map(
+                        lambda c: _detect_chunk(
+                            c, detector_methode, nfeatures, to_array=False
+                        ),
+                        chunks,
+                    )
+                )
+    elif executor == "process":
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=resources.init_worker,
+            initargs=(cv2_threads,),
+        ) as pool:
+            futures = [
+                pool.submit(_detect_chunk, c, detector_methode, nfeatures, True)
+                for c in chunks
+            ]
+            res_chunks = [
+                [(array_to_keypoints(kp), des) for kp, des in f.result()]
+                for f in futures
+            ]
+    else:
+        raise ValueError("The executor must be 'serial', 'thread' or 'process'.")
+    keypoints_descriptors = [kd for c in res_chunks for kd in c]
+    n_keypoints = np.array([len(kd[0]) for kd in keypoints_descriptors], dtype=int)
+    return keypoints_descriptors, n_keypoints
+
+
+# Detectors of each thread, OpenCV detectors cannot be shared between threads
+_thread_detectors = threading.local()
+
+
+def _detect_chunk(list_8bits, detector_methode, nfeatures, to_array):
+    """
+    Detect the keypoints and compute the descriptors of a chunk of spectrograms, see detect_keypoints. With to_array, the keypoints are returned as arrays so that they can be sent between processes.
+    """
+    key = (detector_methode, nfeatures)
+    detectors = getattr(_thread_detectors, "detectors", {})
+    if key not in detectors:
+        detectors[key] = feature_detector_matcher(detector_methode, nfeatures)[0]
+        _thread_detectors.detectors = detectors
+    detector = detectors[key]
+    res = []
+    for img in list_8bits:
+        if nfeatures is None or detector_methode not in ["AKAZE", "KAZE"]:
+            kp, des = detector.detectAndCompute(img, None)
+        else:
+            # Keep the keypoints with the strongest responses before computing the descriptors
+            kp = detector.detect(img, None)
+            kp = sorted(kp, key=lambda k: k.response, reverse=True)[: int(nfeatures)]
+            kp, des = detector.compute(img, kp)
+        if to_array:
+            kp = keypoints_to_array(kp)
+        res.append((kp, des))
+    return res
+
+
 def distance_matches(matcher, des1, des2, n_closest):
     """
     Get a matching distance between two images based on their descriptors. The shorter the distance, the more similar the images are.
@@ -142,6 +599,11 @@ def distance_matches(matcher, des1, des2, n_closest):
     dist: float, the distance between the two images.
 
     """
+    # Images without keypoints are infinitely far from the others
+    if des1 is None or des2 is None or len(des1) == 0 or len(des2) == 0:
+        return 1e10
+    if isinstance(matcher, L2Matcher):
+        return float(matcher.distances(des1, [des2], n_closest)[0])
     # Match the descriptors
     matches = matcher.match(des1, des2)
     # Sort matches by distances
@@ -156,14 +618,200 @@ def distance_matches(matcher, des1, des2, n_closest):
     return dist
 
 
-def clustering_matches(dist_images, clustering_name="Affinity Propagation"):
+class L2Matcher:
+    """
+    Brute-force matcher of float descriptors (SIFT, KAZE) with the L2 norm and cross-checking, giving the same matches as cv2.BFMatcher(cv2.NORM_L2, crossCheck=True), up to the rounding of float32. Instead of matching one pair of images at a time, the descriptors of an image are matched against the ones of a whole block of images: the squared distances are computed as ||a||² + ||b||² - 2 a.b, the products a.b of all the pairs of descriptors being a single matrix multiplication done by BLAS, then the mutual nearest neighbours are found for all the images of the block at once.
+    It is used by distance_matches, distance_matrix and sparse_distance_matrix in place of the OpenCV matcher, see feature_detector_matcher.
+
+    Parameters
+    ----------
+    scale: float, factor applied to the distances, to get the distances of the original descriptors from quantized ones, see compress_descriptors.
+    """
+
+    def __init__(self, scale=1.0):
+        self.scale = scale
+
+    def match(self, des1, des2):
+        """
+        Match the descriptors of two images, like cv2.BFMatcher.match.
+
+        Returns
+        -------
+        matches: list of cv2.DMatch, the mutual nearest neighbours, with queryIdx the index of the descriptor in des1, trainIdx the one in des2 and their distance.
+        """
+        if des1 is None or des2 is None or len(des1) == 0 or len(des2) == 0:
+            return []
+        block, sq_norms = _pad_descriptors([des2])
+        best, match_sq = _mutual_neighbours(des1, block, sq_norms)
+        query = np.flatnonzero(np.isfinite(match_sq[0]))
+        dist = self.scale * np.sqrt(np.maximum(match_sq[0, query], 0))
+        return [
+            cv2.DMatch(int(q), int(best[0, q]), float(d)) for q, d in zip(query, dist)
+        ]
+
+    def distances(self, des, list_descriptors, n_closest):
+        """
+        Get the matching distances between an image and each image of a list, see distance_matches. The images of the list are matched by blocks of at most l2_block_size squared distances.
+
+        Parameters
+        ----------
+        des: 2D array, the descriptors of the image.
+        list_descriptors: list of 2D arrays, the descriptors of each image of the list.
+        n_closest: int, number of matches with the shortest distance to consider.
+
+        Returns
+        -------
+        dist: 1D array, the distance between the image and each image of the list, 1e10 if one of them has no descriptors.
+        """
+        dist = np.full(len(list_descriptors), 1e10)
+        if des is None or len(des) == 0:
+            return dist
+        n_kp = [0 if d is None else len(d) for d in list_descriptors]
+        n_block = max(1, l2_block_size // (len(des) * max(max(n_kp, default=1), 1)))
+        for start in range(0, len(list_descriptors), n_block):
+            stop = min(start + n_block, len(list_descriptors))
+            block, sq_norms = _pad_descriptors(list_descriptors[start:stop])
+            _, match_sq = _mutual_neighbours(des, block, sq_norms)
+            # Partial selection of the n_closest shortest squared distances of each image
+            if n_closest < match_sq.shape[1]:
+                match_sq = np.partition(match_sq, n_closest - 1, axis=1)[:, :n_closest]
+            found = np.isfinite(match_sq)
+            n_found = found.sum(axis=1)
+            total = np.sqrt(np.maximum(np.where(found, match_sq, 0), 0)).sum(axis=1)
+            dist[start:stop] = np.where(
+                n_found > 0, self.scale * total / np.maximum(n_found, 1), 1e10
+            )
+        return dist
+
+
+def _pad_descriptors(list_descriptors):
+    """
+    Stack the descriptors of a block of images in a 3D float32 array of shape (number of images, largest number of descriptors, size of a descriptor), padded with 0s, with their squared norms (inf for the padding, so that it is never matched).
+    """
+    n_kp = [0 if d is None else len(d) for d in list_descriptors]
+    dim = max(
+        (d.shape[1] for d in list_descriptors if d is not None and len(d)), default=1
+    )
+    block = np.zeros((len(list_descriptors), max(max(n_kp), 1), dim), np.float32)
+    sq_norms = np.full(block.shape[:2], np.inf, np.float32)
+    for k, des in enumerate(list_descriptors):
+        if n_kp[k]:
+            block[k, : n_kp[k]] = des
+            sq_norms[k, : n_kp[k]] = np.einsum(
+                "ij,ij->i", block[k, : n_kp[k]], block[k, : n_kp[k]]
+            )
+    return block, sq_norms
+
+
+def _mutual_neighbours(des, block, sq_norms):
+    """
+    Cross-checked matching of the descriptors of an image against the ones of a block of images, see _pad_descriptors.
+
+    Returns
+    -------
+    best: 2D array of integers, of shape (number of images, number of descriptors of the image), the index of the nearest descriptor of each image of the block for each descriptor of the image.
+    match_sq: 2D array, of the same shape, the squared distance to it if both descriptors are the nearest neighbour of each other, inf otherwise.
+    """
+    des = np.asarray(des, dtype=np.float32)
+    n_img, max_kp, dim = block.shape
+    products = (block.reshape((-1, dim)) @ des.T).reshape((n_img, max_kp, len(des)))
+    sq_dist = sq_norms[:, :, None] - 2 * products
+    sq_dist += np.einsum("ij,ij->i", des, des)
+    # Nearest descriptor of each image of the block for the descriptors of the image, and the reverse
+    best = np.argmin(sq_dist, axis=1)
+    best_reverse = np.argmin(sq_dist, axis=2)
+    mutual = (
+        np.take_along_axis(best_reverse, best, axis=1) == np.arange(len(des))[None, :]
+    )
+    # The distances of the matches are computed again from the differences of the descriptors, as
+    # ||a||² + ||b||² - 2 a.b loses the precision of the short distances of small descriptors (KAZE)
+    diff = block[np.arange(n_img)[:, None], best] - des[None, :, :]
+    match_sq = np.einsum("ijk,ijk->ij", diff, diff)
+    match_sq[~mutual | np.isinf(np.min(sq_norms, axis=1))[:, None]] = np.inf
+    return best, match_sq
+
+
+def compress_descriptors(
+    list_descriptors,
+    compression="pca",
+    n_components=32,
+    sample_size=100000,
+    random_state=0,
+    fit_descriptors=None,
+):
+    """
+    Compress the float descriptors of SIFT and KAZE, to reduce the memory they take and the cost of matching them with the L2Matcher.
+    - "pca": the descriptors are projected on their n_components first principal components, fitted on a random sample of the descriptors of all the images, which divides the cost of the matrix multiplications by the size of the descriptors over n_components (4 for SIFT with 32 components). The distances between the projected descriptors are shorter than the original ones, and the nearest neighbours may change.
+    - "int8": the descriptors are quantized on 8 bits, which divides their memory by 4, but not the cost of matching them, as they are converted back to float32 by block. The SIFT descriptors of OpenCV are integers from 0 to 255 and are stored as uint8 without loss; the others are rounded to a multiple of scale.
+
+    Parameters
+    ----------
+    list_descriptors: list of arrays, the descriptors of each image, see detect_keypoints.
+    compression: str, "pca" or "int8".
+    n_components: int, number of principal components kept by "pca".
+    sample_size: int, maximum number of descriptors, randomly sampled from all the images, used to fit the principal components.
+    random_state: int, seed of the sampling.
+    fit_descriptors: list of arrays, the descriptors on which the principal components or the quantization scale are fitted, None for list_descriptors (e.g. the descriptors matched by a run, to compress the ones of other images the same way).
+
+    Returns
+    -------
+    compressed: list of arrays, the compressed descriptors of each image, None for the images without descriptors.
+    scale: float, the factor to apply to the distances between the compressed descriptors, see L2Matcher.
+    """
+    if fit_descriptors is None:
+        fit_descriptors = list_descriptors
+    valid = [d for d in fit_descriptors if d is not None and len(d)]
+    if not valid:
+        return [None] * len(list_descriptors), 1.0
+    if compression == "pca":
+        all_des = np.vstack(valid).astype(np.float32)
+        rng = np.random.default_rng(random_state)
+        if len(all_des) > sample_size:
+            all_des = all_des[rng.choice(len(all_des), sample_size, replace=False)]
+        mean = all_des.mean(axis=0)
+        # Principal axes of the centered descriptors
+        _, _, axes = np.linalg.svd(all_des - mean, full_matrices=False)
+        axes = axes[: int(n_components)].T
+        compressed = [
+            None if d is None or len(d) == 0 else ((d - mean) @ axes).astype(np.float32)
+            for d in list_descriptors
+        ]
+        return compressed, 1.0
+    if compression != "int8":
+        raise ValueError("The compression must be 'pca' or 'int8'.")
+    max_value = max(float(np.max(np.abs(d))) for d in valid)
+    if (
+        all(np.min(d) >= 0 and np.all(d == np.round(d)) for d in valid)
+        and max_value < 256
+    ):
+        dtype, scale = np.uint8, 1.0
+    else:
+        dtype, scale = np.int8, max(max_value, np.finfo(np.float32).tiny) / 127
+    # Descriptors other than the fitted ones can be out of the range of dtype
+    low, high = np.iinfo(dtype).min, np.iinfo(dtype).max
+    compressed = [
+        (
+            None
+            if d is None or len(d) == 0
+            else np.clip(np.round(d / scale), low, high).astype(dtype)
+        )
+        for d in list_descriptors
+    ]
+    return compressed, scale
+
+
+def clustering_matches(
+    dist_images, clustering_name="Affinity Propagation", fill_value=None, n_jobs=-1
+):
     """
     Cluster images based on their matching distances. The resulting distance matrix will be considered as a normal data array and the euclidean distance will be performed by the clustering algorithm. For clustering algorithms where the number of clusters needs to be selected, the silhouette score is used.
 
     Parameters
     ----------
-    dist_images: 2D array, a n by n array, with n the number of images. d_match[i,j] contains the matching distance of image i and image j.
+    dist_images: 2D array, a n by n array, with n the number of images. d_match[i,j] contains the matching distance of image i and image j. It can also be a n by d array of embeddings, one row per image, see embedding.encode_spectros.
     clustering_name: str, name of the clustering. Choose from: "Affinity Propagation", "Agglomerative", "Bisecting K-Means", "Gaussian Mixture Model", "HDBSCAN", "K-Means", "Mean Shift".
+    fill_value: float, distance of the pairs of images missing from a sparse dist_images (see sparse_distance_matrix), None to use the largest matching distance. "HDBSCAN" uses the sparse matrix directly as a precomputed distance graph, the other algorithms use the full matrix, see dense_distance_matrix.
+    n_jobs: int, number of processes used by "HDBSCAN" and "Mean Shift", -1 to use all the processors. The threads of the other algorithms are set with resources.limit_threads.
 
     Returns
     -------
@@ -175,10 +823,34 @@ def clustering_matches(dist_images, clustering_name="Affinity Propagation"):
         "Agglomerative": AgglomerativeClustering(),
         "Bisecting K-Means": BisectingKMeans(),
         "Gaussian Mixture Model": GaussianMixture(),
-        "HDBSCAN": HDBSCAN(min_cluster_size=2),
+        "HDBSCAN": HDBSCAN(min_cluster_size=2, n_jobs=n_jobs),
         "K-Means": KMeans(),
-        "Mean Shift": MeanShift(n_jobs=-1),
+        "Mean Shift": MeanShift(n_jobs=n_jobs),
     }
+    if sparse.issparse(dist_images):
+        if clustering_name == "HDBSCAN":
+            if fill_value is None:
+                fill_value = dist_images.data.max() if dist_images.nnz else 1
+            # HDBSCAN needs a connected graph: the groups of images without matched pairs between them are linked at the fill value
+            n_comp, comp = csgraph.connected_components(dist_images)
+            if n_comp > 1:
+                first = np.unique(comp, return_index=True)[1]
+                links = sparse.csr_matrix(
+                    (
+                        np.full(n_comp - 1, float(fill_value)),
+                        (first[1:], np.full(n_comp - 1, first[0])),
+                    ),
+                    shape=dist_images.shape,
+                )
+                dist_images = dist_images + links + links.T
+            hdbscan = HDBSCAN(
+                min_cluster_size=2,
+                metric="precomputed",
+                metric_params={"max_distance": float(fill_value)},
+                n_jobs=n_jobs,
+            )
+            return hdbscan.fit_predict(dist_images)
+        dist_images = dense_distance_matrix(dist_images, fill_value)
     clust_tech = dict_clust[clustering_name]
     if clustering_name in [
         "Agglomerative",
@@ -0,0 +1,283 @@
+# Inspection of the matches between spectrograms, drawn from the checkpoints of a run without computing anything again
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import cv2  # opencv-python
+
+from . import checkpoint, image_matching, resources
+
+# Run opened by each worker process, see _init_render
+_shared = {}
+
+
+def open_run(output_dir):
+    """
+    Open the results of a run of the pipeline made with checkpoint=True (see pipeline.Pipeline) to inspect its matches. Nothing is read but the list of the files and the clusters: the 8-bit spectrograms are memory-mapped (see checkpoint.map_stage) and the keypoints and descriptors of a file are only read when it is drawn, so a run opens at once whatever its size.
+    Raise a ValueError if the spectrograms or the keypoints of the run were not stored.
+
+    Parameters
+    ----------
+    output_dir: str, the output directory of the run.
+
+    Returns
+    -------
+    run: dict, with the output directory in "output_dir", the analyzed file names in "files", the cluster of each file in "clusters" (NaN for the files excluded before the matching), the memory-mapped spectrograms in "spectrograms", the stored keypoints and descriptors in "detect" (an opened numpy NpzFile, see checkpoint.save_stage), the "checkpoint_dir" and the "params" of the run.
+    """
+    checkpoint_dir = os.path.join(output_dir, checkpoint.checkpoint_dir_name)
+    manifest = checkpoint.load_manifest(checkpoint_dir)
+    stored = manifest.get("stages", {})
+    if "spectrogram" not in stored or "detect" not in stored:
+        raise ValueError(
+            "No spectrograms and keypoints stored in %s, run the analysis with checkpoint=True."
+            % output_dir
+        )
+    # Same order as the spectrograms, see pipeline.Pipeline._save
+    files = pd.read_csv(os.path.join(output_dir, "keypoints_per_file.csv")).File
+    df_res = pd.read_csv(os.path.join(output_dir, "clustering_results.csv"))
+    clusters = df_res.set_index("File").Cluster.reindex(files).to_numpy()
+    spectrograms = checkpoint.map_stage("spectrogram", checkpoint_dir)
+    if len(spectrograms) != len(files):
+        raise ValueError("The stored spectrograms do not match the files of the run.")
+    run = {
+        "output_dir": output_dir,
+        "files": files.to_numpy(),
+        "clusters": clusters,
+        "spectrograms": spectrograms,
+        "detect": np.load(os.path.join(checkpoint_dir, "detect.npz")),
+        "checkpoint_dir": checkpoint_dir,
+        "params": manifest["params"],
+    }
+    return run
+
+
+def file_index(run, name):
+    """
+    Index of a file in the run, see open_run. Raise a ValueError if the file was not analyzed.
+    """
+    index = np.flatnonzero(run["files"] == name)
+    if len(index) == 0:
+        raise ValueError("%s is not a file of the run." % name)
+    return int(index[0])
+
+
+def pair_matches(run, i, j, n_matches=None):
+    """
+    Match the stored descriptors of two files, as done for the distance matrix (see image_matching.distance_matches): with the matcher of the run and, if the run compressed the descriptors, their compressed descriptors (see compressed_descriptors).
+
+    Parameters
+    ----------
+    run: dict, see open_run.
+    i, j: int, the indices of the files in run["files"].
+    n_matches: int, number of matches with the shortest distance kept, None for the n_matches of the run.
+
+    Returns
+    -------
+    kp1, kp2: 2D arrays, the keypoints of the two files, see image_matching.keypoints_to_array.
+    matches: 2D array of shape (number of matches, 3), the index of the keypoint in each file and the distance of each match kept, by increasing distance.
+    dist: float, the distance between the two files (1e10 without matches).
+    """
+    params = run["params"]
+    if n_matches is None:
+        n_matches = int(params["n_matches"])
+    detect = run["detect"]
+    kp1 = detect["kp_%d" % i]
+    kp2 = detect["kp_%d" % j]
+    _, matcher = image_matching.feature_detector_matcher(
+        params["detector_methode"], matcher=params.get("matcher", "opencv")
+    )
+    if params.get("compression", "No") == "No":
+        des1 = detect["des_%d" % i] if "des_%d" % i in detect else None
+        des2 = detect["des_%d" % j] if "des_%d" % j in detect else None
+    else:
+        list_descriptors, matcher.scale = compressed_descriptors(run)
+        des1, des2 = list_descriptors[i], list_descriptors[j]
+    if des1 is None or des2 is None or len(des1) == 0 or len(des2) == 0:
+        return kp1, kp2, np.zeros((0, 3)), 1e10
+    list_matches = sorted(matcher.match(des1, des2), key=lambda m: m.distance)
+    matches = np.array(
+        [(m.queryIdx, m.trainIdx, m.distance) for m in list_matches[:n_matches]]
+    ).reshape((-1, 3))
+    dist = float(np.mean(matches[:, 2])) if len(matches) else 1e10
+    return kp1, kp2, matches, dist
+
+
+def compressed_descriptors(run):
+    """
+    Compress the stored descriptors of all the files as the run did, see image_matching.compress_descriptors: the compression is fitted on the descriptors of the representatives of the groups of duplicates (see checkpoint.load_stage), the ones matched by the run. They are computed at the first call only and kept in run["compressed"].
+
+    Parameters
+    ----------
+    run: dict, see open_run.
+
+    Returns
+    -------
+    compressed: list of arrays, the compressed descriptors of each file, None for the files without descriptors.
+    scale: float, the factor applied to the distances of the compressed descriptors, see image_matching.L2Matcher.
+    """
+    if "compressed" not in run:
+        params = run["params"]
+        detect = run["detect"]
+        list_descriptors = [
+            detect["des_%d" % k] if "des_%d" % k in detect else None
+            for k in range(len(run["files"]))
+        ]
+        representatives = np.arange(len(list_descriptors))
+        if os.path.isfile(os.path.join(run["checkpoint_dir"], "dedup.npz")):
+            dedup = checkpoint.load_stage("dedup", run["checkpoint_dir"])
+            representatives = dedup["representatives"]
+        run["compressed"] = image_matching.compress_descriptors(
+            list_descriptors,
+            params["compression"],
+            int(params["n_components"]),
+            fit_descriptors=[list_descriptors[k] for k in representatives],
+        )
+    return run["compressed"]
+
+
+def draw_pair(run, i, j, n_matches=None):
+    """
+    Draw the matches between two files: the spectrogram of the first file above the one of the second, with a line between the keypoints of each match, colored from the closest match (red) to the furthest.
+
+    Parameters
+    ----------
+    run: dict, see open_run.
+    i, j: int, the indices of the files in run["files"].
+    n_matches: int, number of matches drawn, None for the n_matches of the run.
+
+    Returns
+    -------
+    img: 3D array of 8-bit unsigned integers, the BGR image.
+    dist: float, the distance between the two files, see pair_matches.
+    """
+    kp1, kp2, matches, dist = pair_matches(run, i, j, n_matches)
+    spec1 = np.asarray(run["spectrograms"][i])
+    spec2 = np.asarray(run["spectrograms"][j])
+    height = spec1.shape[0]
+    img = np.zeros(
+        (height + spec2.shape[0], max(spec1.shape[1], spec2.shape[1])), dtype=np.uint8
+    )
+    img[:height, : spec1.shape[1]] = spec1
+    img[height:, : spec2.shape[1]] = spec2
+    img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    colors = cv2.applyColorMap(
+        np.linspace(0, 160, max(len(matches), 1)).astype(np.uint8)[:, None],
+        cv2.COLORMAP_HSV,
+    )[:, 0]
+    for (q, t, _), color in zip(matches, colors):
+        color = tuple(int(c) for c in color)
+        p1 = (int(round(kp1[int(q), 0])), int(round(kp1[int(q), 1])))
+        p2 = (int(round(kp2[int(t), 0])), int(round(kp2[int(t), 1])) + height)
+        cv2.circle(img, p1, 3, color, 1, cv2.LINE_AA)
+        cv2.circle(img, p2, 3, color, 1, cv2.LINE_AA)
+        cv2.line(img, p1, p2, color, 1, cv2.LINE_AA)
+    return img, dist
+
+
+def cluster_pairs(run, cluster, max_pairs=None):
+    """
+    All the pairs of files of a cluster.
+
+    Parameters
+    ----------
+    run: dict, see open_run.
+    cluster: int, the cluster label.
+    max_pairs: int, maximum number of pairs, None for all of them.
+
+    Returns
+    -------
+    pairs: list of tuples, the indices (i, j) in run["files"] of the files of each pair, i < j.
+    """
+    members = np.flatnonzero(run["clusters"] == cluster)
+    if len(members) == 0:
+        raise ValueError("The cluster %s has no file." % cluster)
+    i, j = np.triu_indices(len(members), k=1)
+    pairs = list(zip(members[i].tolist(), members[j].tolist()))
+    if max_pairs is not None:
+        pairs = pairs[:max_pairs]
+    return pairs
+
+
+def render_pairs(
+    output_dir,
+    pairs,
+    save_dir=None,
+    n_matches=None,
+    executor="process",
+    n_workers=None,
+    threads_per_worker=None,
+):
+    """
+    Draw the matches of a batch of pairs of files in parallel and save each drawing as a PNG image named after the two files, see draw_pair.
+
+    Parameters
+    ----------
+    output_dir: str, the output directory of the run, see open_run.
+    pairs: list of tuples, the indices of the files of each pair, see cluster_pairs and file_index.
+    save_dir: str, directory where the images are saved, None for the "matches" directory of output_dir.
+    n_matches: int, number of matches drawn, None for the n_matches of the run.
+    executor: str, "serial", "thread" or "process".
+    n_workers: int, number of workers, see resources.resource_config.
+    threads_per_worker: int, number of threads of each worker, see resources.resource_config.
+
+    Returns
+    -------
+    df_pairs: a pandas DataFrame with the "File_1" and "File_2" of each pair, their "Distance" and the "Image" path.
+    """
+    if save_dir is None:
+        save_dir = os.path.join(output_dir, "matches")
+    os.makedirs(save_dir, exist_ok=True)
+    res_config = resources.resource_config(
+        1 if executor == "serial" else n_workers, threads_per_worker
+    )
+    threads = res_config["threads_per_worker"]
+    args = ([save_dir] * len(pairs), pairs, [n_matches] * len(pairs))
+    if executor == "serial" or executor == "thread":
+        _shared["run"] = open_run(output_dir)
+        if executor == "serial":
+            pool = None
+        else:
+            pool = ThreadPoolExecutor(max_workers=res_config["n_workers"])
+    elif executor == "process":
+        pool = ProcessPoolExecutor(
+            max_workers=res_config["n_workers"],
+            initializer=_init_render,
+            initargs=(output_dir, threads),
+        )
+    else:
+        raise ValueError("The executor must be 'serial', 'thread' or 'process'.")
+    try:
+        if pool is None:
+            with resources.limit_threads(threads):
+                list_res = list(map(_render_pair, *args))
+        else:
+            with pool, resources.limit_threads(threads):
+                list_res = list(pool.map(_render_pair, *args, chunksize=8))
+    finally:
+        _shared.pop("run", None)
+    df_pairs = pd.DataFrame(list_res, columns=["File_1", "File_2", "Distance", "Image"])
+    return df_pairs
+
+
+def _init_render(output_dir, threads):
+    """
+    Initializer of the worker processes: each worker opens the run once.
+    """
+    resources.init_worker(threads)
+    _shared["run"] = open_run(output_dir)
+
+
+def _render_pair(save_dir, pair, n_matches):
+    """
+    Draw and save the matches of a pair of files, see render_pairs.
+    """
+    run = _shared["run"]
+    i, j = pair
+    img, dist = draw_pair(run, i, j, n_matches)
+    # The files of subdirectories are named after their relative path
+    name1, name2 = [
+        os.path.splitext(run["files"][k])[0].replace("/", "_") for k in pair
+    ]
+    path = os.path.join(save_dir, "%s__%s.png" % (name1, name2))
+    cv2.imwrite(path, img)
+    return run["files"][i], run["files"][j], dist, path
@@ -0,0 +1,1092 @@
+# Pipeline chaining the stages of the analysis
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from . import (
+    utils,
+    catalog,
+    filtering,
+    spectro,
+    image_matching,
+    pop_estimation,
+    embedding,
+    checkpoint,
+    resources,
+    stability,
+)
+
+# Stages of the analysis, in order of execution
+stages = [
+    "screen",
+    "import",
+    "bandpass",
+    "wavelet",
+    "pad",
+    "spectrogram",
+    "detect",
+    "dedup",
+    "match",
+    "cluster",
+    "save",
+    "population",
+]
+# Parameters used by each stage, a change of one of them invalidates the stage and the following ones
+stage_params = {
+    "screen": [
+        "input_dir",
+        "list_wavs",
+        "recursive",
+        "f_filt",
+        "resample_quality",
+        "precision",
+        "screen",
+        "min_band_ratio",
+        "min_modulation",
+        "pulse_rate",
+    ],
+    "import": [
+        "input_dir",
+        "list_wavs",
+        "recursive",
+        "f_filt",
+        "resample_quality",
+        "precision",
+    ],
+    "bandpass": ["f_filt"],
+    "wavelet": ["wlt_filt"],
+    "pad": ["pad_len"],
+    "spectrogram": ["wlen", "ovlp", "wlen_env", "ovlp_env"],
+    "detect": ["detector_methode", "nfeatures"],
+    "dedup": ["dedup", "dedup_distance", "min_keypoints"],
+    "match": [
+        "n_matches",
+        "similarity",
+        "n_words",
+        "encoding",
+        "n_candidates",
+        "matcher",
+        "compression",
+        "n_components",
+    ],
+    "cluster": ["clustering", "fill_value"],
+    "save": ["output_dir"],
+    "population": [
+        "date_pattern",
+        "date_format",
+        "window_days",
+        "step_days",
+        "expanding_window",
+        "n_bootstrap",
+    ],
+}
+# Stages computed file by file and streamed from one to the next without intermediate lists
+signal_stages = ["import", "bandpass", "wavelet"]
+feature_stages = ["spectrogram"]
+# Number of rows of the distance matrix computed and stored together when checkpointing
+match_tile_rows = 64
+# Default values for rock ptarmigan, same as the GUI
+default_params = {
+    "input_dir": "",
+    "output_dir": "",
+    "list_wavs": None,
+    "recursive": "No",
+    "wlt_filt": "Yes",
+    "f_filt": [950, 2800],
+    "wlen": 281,
+    "ovlp": 75,
+    "wlen_env": 706,
+    "ovlp_env": 90,
+    "n_matches": 53,
+    "detector_methode": "ORB custom",
+    "clustering": "Affinity Propagation",
+    "resample_quality": "HQ",
+    "precision": "float64",
+    "pad_len": None,
+    "nfeatures": None,
+    "dedup": "No",
+    "dedup_distance": 4,
+    "similarity": "matching",
+    "n_words": 256,
+    "encoding": "histogram",
+    "n_candidates": None,
+    "matcher": "opencv",
+    "compression": "No",
+    "n_components": 32,
+    "fill_value": None,
+    "screen": "No",
+    "min_band_ratio": 0.01,
+    "min_modulation": 0.6,
+    "pulse_rate": [10, 50],
+    "min_keypoints": 0,
+    "date_pattern": "default",
+    "date_format": None,
+    "window_days": None,
+    "step_days": 1,
+    "expanding_window": "No",
+    "n_bootstrap": 0,
+}
+
+
+class Pipeline:
+    """
+    Lazy pipeline of the analysis: import, band-pass filtering, wavelet denoising, padding, spectrograms, keypoint detection, matching, clustering, saving and population estimation.
+
+    A stage is only computed when its result is asked for (see result) and its result is cached, so asking for a later stage reuses the stages already computed. Changing a parameter with set_params only invalidates the stages using it and the following ones.
+    The per-file stages (import to wavelet, spectrogram) are streamed chunk by chunk from one stage to the next and can be distributed on a pool of threads or processes, as well as the keypoint detection.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory containing the WAV files.
+    output_dir: str, path of the directory where the results will be saved.
+    executor: str, "serial", "thread" to distribute the per-file stages on a pool of threads or "process" for a pool of processes.
+    n_workers: int, number of workers of the pool, None to use the number of processors divided by threads_per_worker.
+    threads_per_worker: int, number of threads used by OpenCV and the BLAS libraries in each worker, None to use the number of processors divided by n_workers (1 if both are None). The stages that are not distributed (matching, clustering) use n_workers x threads_per_worker threads, see resources.resource_config.
+    chunk_size: int, number of files processed together by each task of the per-file stages.
+    checkpoint: bool, True to store the results of the stages (see checkpoint.checkpoint_stages) and the distance matrix, tile by tile, in the "checkpoints" directory of the output directory, with a manifest of the parameters and of the hashes of the input files.
+    resume: bool, True to reuse the checkpoints of a previous run whose input files and parameters are the same, see resumable_stages. Implies checkpoint.
+    **params: the parameters of the analysis, see default_params. list_wavs is the list of WAV file names to analyze (paths relative to input_dir), None to use all the WAV files in input_dir, and of its subdirectories with recursive="Yes". The files are listed in a catalog with the metadata read from their headers, saved in the output directory and updated by the next runs, see catalog_index. With screen="Yes", the files whose band energy ratio or envelope modulation (see filtering.band_energy_ratio and filtering.envelope_modulation) is lower than min_band_ratio or min_modulation are excluded before the wavelet denoising. The files with less than min_keypoints keypoints are excluded before the matching. date_pattern and date_format set how the dates are read from the filenames for the population estimation, see pop_estimation.parse_filename_dates. With window_days set, the population is also estimated over windows of days, see pop_estimation.rolling_population. With n_bootstrap > 0, confidence intervals of the estimated number of individuals are computed from n_bootstrap replicates, see pop_estimation.bootstrap_population. With precision="float32", the signals, wavelet coefficients, spectrograms (complex64 STFTs) and distance matrix are computed in single precision, halving their memory. With matcher="blas" (SIFT and KAZE only), the descriptors are matched by blocks of spectrograms with matrix multiplications, see image_matching.L2Matcher, and with compression="pca" or "int8" they are first compressed, see image_matching.compress_descriptors.
+    """
+
+    def __init__(
+        self,
+        input_dir,
+        output_dir="",
+        executor="serial",
+        n_workers=None,
+        threads_per_worker=None,
+        chunk_size=16,
+        checkpoint=False,
+        resume=False,
+        **params,
+    ):
+        if executor not in ["serial", "thread", "process"]:
+            raise ValueError("The executor must be 'serial', 'thread' or 'process'.")
+        self.executor = executor
+        if executor == "serial":
+            n_workers = 1
+        self.resources = resources.resource_config(n_workers, threads_per_worker)
+        self.n_workers = self.resources["n_workers"]
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint or resume
+        self.resume = resume
+        self.params = dict(default_params)
+        self.hooks = []
+        self.timings = {}
+        self._cache = {}
+        self._nested_time = 0.0
+        self.set_params(input_dir=input_dir, output_dir=output_dir, **params)
+
+    def set_params(self, **params):
+        """
+        Change parameters of the analysis and invalidate the cached results of the stages using them and of the following stages.
+
+        Parameters
+        ----------
+        **params: the parameters to change, see default_params.
+        """
+        unknown = [p for p in params if p not in self.params]
+        if unknown:
+            raise ValueError("Unknown parameters: %s" % ", ".join(unknown))
+        changed = [p for p in params if not _same(self.params[p], params[p])]
+        self.params.update(params)
+        if "n_matches" in changed and self.params["nfeatures"] == "auto":
+            # The adaptive number of keypoints depends on the number of matches
+            changed.append("nfeatures")
+        first = [
+            k
+            for k, s in enumerate(stages)
+            if any(p in stage_params[s] for p in changed)
+        ]
+        if first:
+            for s in stages[first[0] :]:
+                self._cache.pop(s, None)
+            if first[0] <= stages.index("wavelet"):
+                self._cache.pop("screened_signals", None)
+        if any(p in changed for p in ["list_wavs", "input_dir", "recursive"]):
+            self._cache.pop("catalog_index", None)
+            self._cache.pop("catalog", None)
+            self._cache.pop("file_hashes", None)
+        if "screen" not in self._cache:
+            self._cache.pop("list_wavs", None)
+
+    def add_hook(self, hook):
+        """
+        Add a function called at each step of the analysis, to follow its progress or measure its timing.
+
+        Parameters
+        ----------
+        hook: function, called as hook(stage, event, info) with stage the name of the stage, event "start" when the stage begins, "progress" each time a chunk of files of a per-file stage is done and "end" when the stage ends. info is a dict, with "done" and "total" (number of files) for "progress" and "elapsed" (in seconds, without the stages it depends on) for "end".
+        """
+        self.hooks.append(hook)
+
+    def _notify(self, stage, event, info):
+        for hook in self.hooks:
+            hook(stage, event, info)
+
+    @property
+    def catalog_index(self):
+        """
+        The catalog of the sound files, with their size, modification time, metadata read from their headers and, with checkpoints, the hash of their content, see catalog.update_catalog. It is saved in the output directory (if it exists) and updated by the next runs, so only the new and modified files are read again.
+        """
+        if "catalog_index" not in self._cache:
+            output_dir = self.params["output_dir"]
+            path = None
+            if output_dir and os.path.isdir(output_dir):
+                path = os.path.join(output_dir, catalog.catalog_name)
+            self._cache["catalog_index"] = catalog.update_catalog(
+                self.params["input_dir"],
+                path,
+                recursive=self.params["recursive"] == "Yes",
+                files=self.params["list_wavs"],
+                hash_files=self.checkpoint,
+            )
+        return self._cache["catalog_index"]
+
+    @property
+    def catalog(self):
+        """All the WAV file names (paths relative to input_dir), before the screening."""
+        if "catalog" not in self._cache:
+            self._cache["catalog"] = self.catalog_index.File.to_numpy(dtype=str)
+        return self._cache["catalog"]
+
+    @property
+    def list_wavs(self):
+        """The WAV file names analyzed, the ones kept by the screening."""
+        if "list_wavs" not in self._cache:
+            self._cache["list_wavs"] = self.catalog[self.result("screen")["kept"]]
+        return self._cache["list_wavs"]
+
+    @property
+    def checkpoint_dir(self):
+        """The directory where the checkpoints are stored."""
+        return os.path.join(self.params["output_dir"], checkpoint.checkpoint_dir_name)
+
+    def resumable_stages(self):
+        """
+        Stages whose checkpoints can be reused: stored by a previous run with the same input files (compared using their hash) and the same parameters for the stage and the previous ones.
+
+        Returns
+        -------
+        list_stages: list of str, the names of the stages.
+        """
+        manifest = checkpoint.load_manifest(self.checkpoint_dir)
+        stored = manifest.get("stages", {})
+        return [
+            s
+            for s in checkpoint.checkpoint_stages
+            if s in stored and stored[s] == self._stage_key(s)
+        ]
+
+    def _stage_key(self, stage):
+        """
+        Key of the result of a stage, see checkpoint.stage_key.
+        """
+        k = stages.index(stage)
+        params = {p: self.params[p] for s in stages[: k + 1] for p in stage_params[s]}
+        if self.params["nfeatures"] == "auto" and k >= stages.index("detect"):
+            params["n_matches"] = self.params["n_matches"]
+        if "file_hashes" not in self._cache:
+            df_catalog = self.catalog_index
+            self._cache["file_hashes"] = dict(zip(df_catalog.File, df_catalog.Hash))
+        return checkpoint.stage_key(params, self._cache["file_hashes"])
+
+    @property
+    def dtype(self):
+        """The dtype of the signals, spectrograms and distances, set by the precision parameter."""
+        if self.params["precision"] not in ["float64", "float32"]:
+            raise ValueError("The precision must be 'float64' or 'float32'.")
+        return np.dtype(self.params["precision"])
+
+    @property
+    def sf(self):
+        """The sampling frequency of the signals after resampling."""
+        return int(2 * (self.params["f_filt"][1] + 100))
+
+    def result(self, stage):
+        """
+        Get the result of a stage, computing it (and the stages it depends on) if it is not cached.
+
+        Parameters
+        ----------
+        stage: str, name of the stage, see stages.
+
+        Returns
+        -------
+        The result of the stage:
+        "screen": dict, with the indices in catalog of the files kept in "kept" and, if screen="Yes", a pandas DataFrame with the "Band_energy_ratio" and "Modulation" of each file of the catalog in "metrics" (None otherwise).
+        "import", "bandpass", "wavelet": list of 1D arrays, the signals.
+        "pad": 2D array, the padded signals.
+        "spectrogram": 3D array of 8-bit unsigned integers, the combined spectrograms, see spectro.draw_specs_stack.
+        "detect": list of tuples, the keypoints and descriptors of each spectrogram, see image_matching.detect_keypoints.
+        "dedup": dict, with the index of the group of duplicates of each spectrogram in "groups" (-1 for the files excluded for having less than min_keypoints keypoints, also listed in "excluded"), the index of the spectrogram representing each group in "representatives" and the number of pairs of spectrograms that do not need to be matched in "pairs_saved", see image_matching.group_duplicates.
+        "match": 2D array, the distance matrix between spectrograms (the files excluded before the matching are at a distance of 1e10 from all the others), or a scipy sparse matrix with only the distances of the candidate pairs if n_candidates is set, see image_matching.candidate_pairs. With deduplication, only the representatives are matched and the duplicates get the distances of their representative. With the "bovw" similarity, the bag-of-visual-words embedding of each spectrogram (one row per spectrogram, see embedding.encode_spectros).
+        "cluster": 1D array, the cluster label of each file, -1 for the files excluded for having less than min_keypoints keypoints.
+        "save": pandas DataFrame, the clustering results saved in clustering_results.csv.
+        "population": dict, see pop_estimation.estimate_population.
+        """
+        if stage not in stages:
+            raise ValueError("Unknown stage: %s" % stage)
+        if stage in self._cache:
+            return self._cache[stage]
+        self._notify(stage, "start", {})
+        outer_nested_time = self._nested_time
+        self._nested_time = 0.0
+        start = time.perf_counter()
+        key = None
+        if self.checkpoint and stage in checkpoint.checkpoint_stages:
+            key = self._stage_key(stage)
+        restored = (
+            self.resume
+            and key is not None
+            and checkpoint.load_manifest(self.checkpoint_dir)
+            .get("stages", {})
+            .get(stage)
+            == key
+        )
+        if restored:
+            res = checkpoint.load_stage(stage, self.checkpoint_dir)
+        elif stage == "screen":
+            res = self._screen()
+        elif stage in signal_stages:
+            # The screening denoises the files it keeps, they are not imported again
+            self.result("screen")
+            if stage == "wavelet" and "screened_signals" in self._cache:
+                res = self._cache.pop("screened_signals")
+            else:
+                res = list(self.stream(stage))
+        elif stage == "pad":
+            res = utils.pad_signals(self.result("wavelet"), self.params["pad_len"])
+        elif stage == "spectrogram":
+            res = None
+            for k, spec in enumerate(self.stream(stage)):
+                if res is None:
+                    res = np.empty((len(self.list_wavs),) + spec.shape, spec.dtype)
+                res[k] = spec
+        elif stage == "detect":
+            nfeatures = self.params["nfeatures"]
+            if nfeatures == "auto":
+                nfeatures = image_matching.feature_budget(
+                    self.params["detector_methode"],
+                    int(self.params["n_matches"]),
+                    len(self.list_wavs),
+                )
+            res, _ = image_matching.detect_keypoints(
+                self.result("spectrogram"),
+                self.params["detector_methode"],
+                nfeatures,
+                self.executor,
+                self.n_workers,
+                cv2_threads=self.resources["cv2_threads"],
+                chunk_size=self.chunk_size,
+            )
+        elif stage == "dedup":
+            res = self._dedup()
+        elif stage == "match":
+            dedup = self.result("dedup")
+            kp_desc = self.result("detect")
+            rep_descriptors = [kp_desc[i][1] for i in dedup["representatives"]]
+            with resources.limit_threads(self.resources["n_jobs"]):
+                res = self._match(rep_descriptors, dedup, key)
+        elif stage == "cluster":
+            # Only the representatives of the groups of duplicates are clustered
+            dedup = self.result("dedup")
+            reps = dedup["representatives"]
+            if self.params["similarity"] == "bovw":
+                data = self.result("match")[reps]
+            else:
+                data = self.result("match")[reps][:, reps]
+            with resources.limit_threads(self.resources["n_jobs"]):
+                labels = image_matching.clustering_matches(
+                    data,
+                    clustering_name=self.params["clustering"],
+                    fill_value=self.params["fill_value"],
+                    n_jobs=self.resources["n_jobs"],
+                )
+            res = np.where(dedup["groups"] >= 0, labels[dedup["groups"]], -1)
+        elif stage == "save":
+            res = self._save()
+        elif stage == "population":
+            res = self._population()
+        if stage == "wavelet":
+            self._cache.pop("screened_signals", None)
+        if key is not None and not restored:
+            self._save_checkpoint(stage, res, key)
+        total_elapsed = time.perf_counter() - start
+        # Time of the stage only, without the stages it depends on
+        elapsed = total_elapsed - self._nested_time
+        self._nested_time = outer_nested_time + total_elapsed
+        self.timings[stage] = elapsed
+        self._cache[stage] = res
+        self._notify(stage, "end", {"elapsed": elapsed})
+        return res
+
+    def stream(self, stage):
+        """
+        Stream the results of a per-file stage, file by file, without keeping them in memory. The previous per-file stages are computed chunk by chunk in the same task.
+
+        Parameters
+        ----------
+        stage: str, name of a per-file stage, see signal_stages and feature_stages, or "screen".
+
+        Yields
+        ------
+        The result of the stage for each file: a 1D array for the signal stages, a 2D array of 8-bit unsigned integers for "spectrogram" and a tuple (band energy ratio, modulation) for "screen".
+        """
+        p = self.params
+        if stage == "screen":
+            items = self.catalog
+            func = partial(
+                _screen_chunk,
+                input_dir=p["input_dir"],
+                high_f=p["f_filt"][1],
+                quality=p["resample_quality"],
+                f_filt=list(p["f_filt"]),
+                pulse_rate=list(p["pulse_rate"]),
+                dtype=self.dtype,
+            )
+        elif stage in signal_stages:
+            items = self.list_wavs
+            func = partial(
+                _signals_chunk,
+                input_dir=p["input_dir"],
+                high_f=p["f_filt"][1],
+                quality=p["resample_quality"],
+                f_filt=list(p["f_filt"]),
+                wlt_filt=p["wlt_filt"],
+                last_stage=stage,
+                dtype=self.dtype,
+            )
+        elif stage in feature_stages:
+            items = self.result("pad")
+            func = partial(
+                _features_chunk,
+                sf=self.sf,
+                f_filt=list(p["f_filt"]),
+                wlen=int(p["wlen"]),
+                ovlp=int(p["ovlp"]),
+                wlen_env=int(p["wlen_env"]),
+                ovlp_env=int(p["ovlp_env"]),
+            )
+        else:
+            raise ValueError("%s is not a per-file stage." % stage)
+        total = len(items)
+        chunks = (
+            items[k : k + self.chunk_size] for k in range(0, total, self.chunk_size)
+        )
+        done = 0
+        for res_chunk in self._imap(func, chunks):
+            done += len(res_chunk)
+            self._notify(stage, "progress", {"done": done, "total": total})
+            for res in res_chunk:
+                yield res
+
+    def _imap(self, func, chunks):
+        """
+        Apply func on each chunk using the executor and yield the results in order. At most twice the number of workers chunks are sent at the same time, to bound the memory. Each worker uses threads_per_worker threads, see resources.resource_config.
+        """
+        threads = self.resources["threads_per_worker"]
+        if self.executor == "serial":
+            with resources.limit_threads(threads):
+                for chunk in chunks:
+                    yield func(chunk)
+            return
+        if self.executor == "process":
+            pool = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                initializer=resources.init_worker,
+                initargs=(threads,),
+            )
+        else:
+            # The threads of the pool share the limits of the process
+            pool = ThreadPoolExecutor(max_workers=self.n_workers)
+        with pool, resources.limit_threads(threads):
+            max_pending = 2 * self.n_workers
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(func, chunk))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def run(self, estim_pop="Yes"):
+        """
+        Run the whole analysis and save the results in the output directory.
+
+        Parameters
+        ----------
+        estim_pop: str, "Yes" to estimate the population, see pop_estimation.
+
+        Returns
+        -------
+        df_res: pandas DataFrame, the clustering results.
+        dict_pop: dict, the results of the population estimation (see pop_estimation.estimate_population), None if not asked.
+        """
+        df_res = self.result("save")
+        dict_pop = None
+        if estim_pop == "Yes":
+            dict_pop = self.result("population")
+        return df_res, dict_pop
+
+    def stability(self, n_replicates=100, sample_fraction=0.8, random_state=0):
+        """
+        Estimate the stability of the clusters by clustering subsamples of the files from the distance matrix already computed, see stability.cluster_stability. The replicates are distributed with the executor of the pipeline. The results are saved in cluster_stability.csv and file_stability.csv in the output directory.
+
+        Parameters
+        ----------
+        n_replicates: int, number of subsamples clustered.
+        sample_fraction: float, fraction of the files of each subsample.
+        random_state: int, seed of the subsampling.
+
+        Returns
+        -------
+        dict_stab: dict, see stability.cluster_stability. With deduplication, only the representatives of the groups of duplicates are subsampled and the files get the stability of their representative. The files excluded before the matching are not in "files".
+        """
+        dedup = self.result("dedup")
+        reps = dedup["representatives"]
+        labels = self.result("cluster")[reps]
+        if self.params["similarity"] == "bovw":
+            data = self.result("match")[reps]
+        else:
+            data = self.result("match")[reps][:, reps]
+        dict_stab = stability.cluster_stability(
+            data,
+            labels,
+            self.params["clustering"],
+            n_replicates,
+            sample_fraction,
+            embeddings=self.params["similarity"] == "bovw",
+            fill_value=self.params["fill_value"],
+            executor=self.executor,
+            n_workers=self.n_workers,
+            threads_per_worker=self.resources["threads_per_worker"],
+            random_state=random_state,
+        )
+        kept = dedup["groups"] >= 0
+        df_files = dict_stab["files"].iloc[dedup["groups"][kept]].reset_index(drop=True)
+        df_files.insert(0, "File", self.list_wavs[kept])
+        dict_stab["files"] = df_files
+        output_dir = self.params["output_dir"]
+        dict_stab["clusters"].to_csv(output_dir + "/cluster_stability.csv", index=False)
+        df_files.to_csv(output_dir + "/file_stability.csv", index=False)
+        return dict_stab
+
+    def _save(self):
+        """
+        Save the clustering results and the spectrograms with their keypoints in the output directory.
+        """
+        output_dir = self.params["output_dir"]
+        clusters = self.result("cluster")
+        # It is really important to create the DataFrame with a dict here,
+        # otherwise, it can impede the cluster order and thus the results.
+        df_res = pd.DataFrame({"File": self.list_wavs, "Cluster": clusters})
+        dedup = self.result("dedup")
+        if self.params["dedup"] == "Yes":
+            df_res["Representative"] = self.list_wavs[
+                dedup["representatives"][dedup["groups"]]
+            ]
+        # The files excluded before the matching are listed in excluded_files.csv
+        df_res = df_res[dedup["groups"] >= 0].reset_index(drop=True)
+        df_res.to_csv(output_dir + "/clustering_results.csv", index=False)
+        if self.params["screen"] == "Yes" or self.params["min_keypoints"] > 0:
+            self.excluded_files().to_csv(
+                output_dir + "/excluded_files.csv", index=False
+            )
+        image_matching.save_spectros_keypoints(
+            self.result("spectrogram"),
+            self.result("detect"),
+            self.list_wavs,
+            output_dir,
+        )
+        # Number of keypoints per file, to spot empty or degenerated spectrograms
+        pd.DataFrame(
+            {
+                "File": self.list_wavs,
+                "Number_of_keypoints": [len(kd[0]) for kd in self.result("detect")],
+            }
+        ).to_csv(output_dir + "/keypoints_per_file.csv", index=False)
+        return df_res
+
+    def excluded_files(self):
+        """
+        List the files excluded by the screening, before the wavelet denoising, or for having less than min_keypoints keypoints, before the matching.
+
+        Returns
+        -------
+        df_excluded: pandas DataFrame, with the "File", its "Band_energy_ratio" and "Modulation" (NaN without screening), its "Number_of_keypoints" (NaN if excluded before the keypoint detection) and the "Reason" of the exclusion.
+        """
+        screen = self.result("screen")
+        if screen["metrics"] is None:
+            df_excluded = pd.DataFrame(
+                columns=["File", "Band_energy_ratio", "Modulation"]
+            )
+        else:
+            metrics = screen["metrics"]
+            df_excluded = metrics[~metrics.File.isin(self.list_wavs)].copy()
+            df_excluded["Reason"] = np.where(
+                df_excluded.Band_energy_ratio < self.params["min_band_ratio"],
+                "Band energy ratio",
+                "Modulation",
+            )
+        df_excluded["Number_of_keypoints"] = np.nan
+        if self.params["min_keypoints"] > 0:
+            excluded = self.result("dedup")["excluded"]
+            kp_desc = self.result("detect")
+            if screen["metrics"] is None:
+                df_kp = pd.DataFrame({"File": self.list_wavs[excluded]})
+            else:
+                df_kp = (
+                    screen["metrics"]
+                    .set_index("File")
+                    .loc[self.list_wavs[excluded]]
+                    .reset_index()
+                )
+            df_kp["Number_of_keypoints"] = [len(kp_desc[i][0]) for i in excluded]
+            df_kp["Reason"] = "Number of keypoints"
+            df_excluded = pd.concat([df_excluded, df_kp], ignore_index=True)
+        return df_excluded[
+            ["File", "Band_energy_ratio", "Modulation", "Number_of_keypoints", "Reason"]
+        ]
+
+    def _screen(self):
+        """
+        Screen the files using cheap measures on the band-pass filtered signals, see filtering.band_energy_ratio and filtering.envelope_modulation. The signals of the files kept are denoised in the same pass and kept for the "wavelet" stage, so that the files are only imported and filtered once.
+        """
+        n_files = len(self.catalog)
+        if self.params["screen"] != "Yes":
+            return {"kept": np.arange(n_files), "metrics": None}
+        p = self.params
+        func = partial(
+            _screen_chunk,
+            input_dir=p["input_dir"],
+            high_f=p["f_filt"][1],
+            quality=p["resample_quality"],
+            f_filt=list(p["f_filt"]),
+            pulse_rate=list(p["pulse_rate"]),
+            dtype=self.dtype,
+            thresholds=(p["min_band_ratio"], p["min_modulation"]),
+            wlt_filt=p["wlt_filt"],
+        )
+        chunks = (
+            self.catalog[k : k + self.chunk_size]
+            for k in range(0, n_files, self.chunk_size)
+        )
+        ratios, modulations, signals = [], [], []
+        for res_chunk in self._imap(func, chunks):
+            for ratio, modulation, signal in res_chunk:
+                ratios.append(ratio)
+                modulations.append(modulation)
+                if signal is not None:
+                    signals.append(signal)
+            self._notify("screen", "progress", {"done": len(ratios), "total": n_files})
+        ratios, modulations = np.array(ratios), np.array(modulations)
+        metrics = pd.DataFrame(
+            {
+                "File": self.catalog,
+                "Band_energy_ratio": ratios,
+                "Modulation": modulations,
+            }
+        )
+        # Files too short to measure the modulation are kept
+        excluded = _screened_out(
+            ratios,
+            modulations,
+            self.params["min_band_ratio"],
+            self.params["min_modulation"],
+        )
+        self._cache["screened_signals"] = signals
+        return {"kept": np.flatnonzero(~excluded), "metrics": metrics}
+
+    def _save_checkpoint(self, stage, res, key):
+        """
+        Store the result of a stage and its key in the manifest, see checkpoint.save_stage.
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        manifest = checkpoint.load_manifest(self.checkpoint_dir)
+        if manifest.get("files") != self._cache["file_hashes"]:
+            # Checkpoints of other input files are not valid anymore
+            manifest = {"files": self._cache["file_hashes"], "stages": {}}
+        # The stage is removed from the manifest while its checkpoint is written, in case of interruption
+        manifest["stages"].pop(stage, None)
+        checkpoint.save_manifest(manifest, self.checkpoint_dir)
+        checkpoint.save_stage(res, stage, self.checkpoint_dir)
+        manifest["params"] = self.params
+        manifest["stages"][stage] = key
+        checkpoint.save_manifest(manifest, self.checkpoint_dir)
+
+    def _match(self, rep_descriptors, dedup, key):
+        """
+        Compute the distances between the representatives of the groups of duplicates, or their bag-of-visual-words embeddings, see result.
+        """
+        if self.params["similarity"] == "bovw":
+            # Linear in the number of files: no pair of spectrograms is matched
+            vocabulary = embedding.build_vocabulary(
+                rep_descriptors, int(self.params["n_words"])
+            )
+            res = embedding.encode_spectros(
+                rep_descriptors, vocabulary, self.params["encoding"]
+            )
+            res = res[np.maximum(dedup["groups"], 0)]
+            res[dedup["excluded"]] = 0
+        else:
+            _, matcher = image_matching.feature_detector_matcher(
+                self.params["detector_methode"], matcher=self.params["matcher"]
+            )
+            matched_descriptors = rep_descriptors
+            if self.params["compression"] != "No":
+                if not isinstance(matcher, image_matching.L2Matcher):
+                    raise ValueError(
+                        "The compression of the descriptors needs the 'blas' matcher."
+                    )
+                matched_descriptors, matcher.scale = (
+                    image_matching.compress_descriptors(
+                        rep_descriptors,
+                        self.params["compression"],
+                        int(self.params["n_components"]),
+                    )
+                )
+            n_candidates = self.params["n_candidates"]
+            if n_candidates is None and key is not None:
+                res = self._match_tiles(matched_descriptors, matcher, key)
+            elif n_candidates is None:
+                res = image_matching.distance_matrix(
+                    matched_descriptors,
+                    matcher,
+                    int(self.params["n_matches"]),
+                    dtype=self.dtype,
+                )
+            else:
+                # Only the likely neighbours of each spectrogram are matched
+                pairs = image_matching.candidate_pairs(
+                    rep_descriptors,
+                    self.params["detector_methode"],
+                    int(n_candidates),
+                )
+                res = image_matching.sparse_distance_matrix(
+                    matched_descriptors,
+                    matcher,
+                    pairs,
+                    int(self.params["n_matches"]),
+                    dtype=self.dtype,
+                )
+            if len(rep_descriptors) < len(self.list_wavs):
+                res = _expand_distances(res, dedup["groups"])
+        return res
+
+    def _match_tiles(self, list_descriptors, matcher, key):
+        """
+        Compute the distance matrix by tiles of match_tile_rows rows, each tile being stored as soon as it is computed. When resuming, the tiles already computed with the same parameters and files are loaded.
+        """
+        n_specs = len(list_descriptors)
+        os.makedirs(os.path.join(self.checkpoint_dir, "match_tiles"), exist_ok=True)
+        dist_images = np.empty((n_specs, n_specs), dtype=self.dtype)
+        for start in range(0, n_specs, match_tile_rows):
+            stop = min(start + match_tile_rows, n_specs)
+            path = checkpoint.tile_path(self.checkpoint_dir, key, start, stop)
+            if self.resume and os.path.isfile(path):
+                dist_images[start:stop] = np.load(path)
+            else:
+                dist_images[start:stop] = image_matching.distance_matrix(
+                    list_descriptors,
+                    matcher,
+                    int(self.params["n_matches"]),
+                    rows=range(start, stop),
+                    dtype=self.dtype,
+                )
+                np.save(path[:-4] + ".tmp.npy", dist_images[start:stop])
+                os.replace(path[:-4] + ".tmp.npy", path)
+            self._notify("match", "progress", {"done": stop, "total": n_specs})
+        # The whole matrix is stored as the checkpoint of the stage
+        for f in os.listdir(os.path.join(self.checkpoint_dir, "match_tiles")):
+            if f.startswith(key):
+                os.remove(os.path.join(self.checkpoint_dir, "match_tiles", f))
+        return dist_images
+
+    def _dedup(self):
+        """
+        Group the duplicated spectrograms using their perceptual hash, see image_matching.spectro_hashes and image_matching.group_duplicates.
+        """
+        n_specs = len(self.list_wavs)
+        if self.params["dedup"] == "Yes":
+            list_8bits = self.result("spectrogram")
+            groups, representatives = image_matching.group_duplicates(
+                image_matching.spectro_hashes(list_8bits),
+                int(self.params["dedup_distance"]),
+            )
+        else:
+            groups = np.arange(n_specs)
+            representatives = np.arange(n_specs)
+        if self.params["min_keypoints"] > 0:
+            # A group is excluded if its representative has not enough keypoints
+            n_keypoints = np.array([len(kd[0]) for kd in self.result("detect")])
+            kept = n_keypoints[representatives] >= self.params["min_keypoints"]
+            new_index = np.full(len(representatives), -1)
+            new_index[kept] = np.arange(np.count_nonzero(kept))
+            groups = new_index[groups]
+            representatives = representatives[kept]
+        dedup = {
+            "groups": groups,
+            "representatives": representatives,
+            "excluded": np.flatnonzero(groups < 0),
+            "pairs_saved": n_specs**2 - len(representatives) ** 2,
+        }
+        return dedup
+
+    def _population(self):
+        """
+        Estimate the population and save the results in the output directory. Raise a ValueError if the filenames do not contain the dates.
+        """
+        dict_pop = save_population(
+            self.result("save"),
+            self.params["output_dir"],
+            self.params["date_pattern"],
+            self.params["date_format"],
+            self.params["window_days"],
+            int(self.params["step_days"]),
+            self.params["expanding_window"] == "Yes",
+            int(self.params["n_bootstrap"]),
+            self.executor,
+            self.resources["n_workers"],
+            self.resources["threads_per_worker"],
+        )
+        return dict_pop
+
+
+def save_population(
+    df_res,
+    output_dir,
+    date_pattern="default",
+    date_format=None,
+    window_days=None,
+    step_days=1,
+    expanding=False,
+    n_bootstrap=0,
+    executor="serial",
+    n_workers=None,
+    threads_per_worker=None,
+):
+    """
+    Estimate the population from the clustering results and save the results in the output directory: number_of_clusters_per_day.csv, number_of_sounds_per_cluster_per_date.csv, presence_index.csv, PPI_PIC.csv and results.txt, rolling_population.csv with window_days and population_intervals.csv with n_bootstrap.
+    Raise a ValueError if the filenames do not contain the dates.
+
+    Parameters
+    ----------
+    df_res: pandas DataFrame, the clustering results with the "File" and "Cluster" columns.
+    output_dir: str, path of the directory where the results will be saved.
+    date_pattern: str, pattern of the dates in the filenames, see pop_estimation.parse_filename_dates.
+    date_format: str, format of the dates captured by date_pattern, see pop_estimation.parse_filename_dates.
+    window_days: int, length of the windows of days over which the population is also estimated, None to only estimate it on the whole dataset, see pop_estimation.rolling_population.
+    step_days: int, number of days between two windows.
+    expanding: bool, True for windows starting on the first day, False for sliding windows.
+    n_bootstrap: int, number of bootstrap replicates of the confidence intervals of the number of individuals, 0 for no intervals, see pop_estimation.bootstrap_population.
+    executor: str, "serial", "thread" or "process", to compute the bootstrap replicates.
+    n_workers: int, number of workers, see resources.resource_config.
+    threads_per_worker: int, number of threads of each worker, see resources.resource_config.
+
+    Returns
+    -------
+    dict_pop: dict, see pop_estimation.estimate_population, with the estimation over windows of days in "rolling" if window_days is set and the result of pop_estimation.bootstrap_population in "bootstrap" if n_bootstrap > 0.
+    """
+    df_res_with_date = pop_estimation.add_date_to_df(
+        df_res.copy(), date_pattern, date_format
+    )
+    dict_pop = pop_estimation.estimate_population(df_res_with_date)
+    dict_pop["clusters_per_day"].to_csv(
+        output_dir + "/number_of_clusters_per_day.csv", index=False
+    )
+    dict_pop["presence"].to_csv(
+        output_dir + "/number_of_sounds_per_cluster_per_date.csv"
+    )
+    dict_pop["presence_index"].to_csv(output_dir + "/presence_index.csv", index=False)
+    dict_pop["ppi_pic"].to_csv(output_dir + "/PPI_PIC.csv", index=False)
+    if window_days is not None:
+        dict_pop["rolling"] = pop_estimation.rolling_population(
+            df_res_with_date, int(window_days), step_days, expanding
+        )
+        dict_pop["rolling"].to_csv(output_dir + "/rolling_population.csv", index=False)
+    if n_bootstrap > 0:
+        dict_pop["bootstrap"] = pop_estimation.bootstrap_population(
+            df_res_with_date,
+            n_bootstrap,
+            executor=executor,
+            n_workers=n_workers,
+            threads_per_worker=threads_per_worker,
+        )
+        dict_pop["bootstrap"]["intervals"].to_csv(
+            output_dir + "/population_intervals.csv", index=False
+        )
+    with open(os.path.join(output_dir, "results.txt"), "w") as f:
+        f.write(population_summary(dict_pop) + "\n")
+    return dict_pop
+
+
+def population_summary(dict_pop):
+    """
+    Text summarizing the estimated number of individuals.
+
+    Parameters
+    ----------
+    dict_pop: dict, see pop_estimation.estimate_population, with the confidence intervals in "bootstrap" if computed, see save_population.
+
+    Returns
+    -------
+    res_print: str, the estimated number of individuals using the PI and the PIC, with their confidence intervals if computed.
+    """
+    res_print = f"Estimated number of individuals using PI: {dict_pop['n_indiv_pi']}\nEstimated number of individuals using PIC: {dict_pop['n_indiv_pic']}"
+    if "bootstrap" in dict_pop:
+        for row in dict_pop["bootstrap"]["intervals"].itertuples():
+            res_print += f"\n{row.Confidence:.0%} interval using {row.Estimator}: [{row.Lower:g}, {row.Upper:g}]"
+    return res_print
+
+
+def screening_summary(pipe):
+    """
+    Text summarizing the files excluded by the screening and the computations avoided.
+
+    Parameters
+    ----------
+    pipe: Pipeline, with the screening and the keypoint detection done.
+
+    Returns
+    -------
+    res_print: str, the number of files excluded at each step and the number of pairs of spectrograms not matched.
+    """
+    n_catalog = len(pipe.catalog)
+    n_files = len(pipe.list_wavs)
+    dedup = pipe.result("dedup")
+    n_matched = len(dedup["representatives"])
+    res_print = (
+        f"Files excluded before the wavelet denoising: {n_catalog - n_files} of {n_catalog}\n"
+        f"Files excluded for having less than {pipe.params['min_keypoints']} keypoints: {len(dedup['excluded'])}\n"
+        f"Pairs of spectrograms not matched: {n_catalog**2 - n_matched**2} of {n_catalog**2}"
+    )
+    return res_print
+
+
+def timing_hook(stage, event, info):
+    """
+    Hook printing the duration of each stage, see Pipeline.add_hook.
+    """
+    if event == "end":
+        print(f"{stage}: {info['elapsed']:.2f} s")
+
+
+def _signals_chunk(
+    chunk_wavs,
+    input_dir,
+    high_f,
+    quality,
+    f_filt,
+    wlt_filt,
+    last_stage,
+    dtype=np.float64,
+):
+    """
+    Import, band-pass filter and denoise a chunk of files, up to last_stage.
+    """
+    list_arr, sf = utils.import_wavs(chunk_wavs, input_dir, high_f, quality, dtype)
+    if last_stage in ["bandpass", "wavelet"]:
+        list_arr = [filtering.butterfilter(a, sf, f_filt) for a in list_arr]
+    if last_stage == "wavelet" and wlt_filt == "Yes":
+        list_arr = [filtering.wlt_denoise(a) for a in list_arr]
+    return list_arr
+
+
+def _screen_chunk(
+    chunk_wavs,
+    input_dir,
+    high_f,
+    quality,
+    f_filt,
+    pulse_rate,
+    dtype=np.float64,
+    thresholds=None,
+    wlt_filt="Yes",
+):
+    """
+    Import and band-pass filter a chunk of files and measure their band energy ratio and envelope modulation. With thresholds (min_band_ratio, min_modulation), the filtered signals of the files kept are also denoised (if wlt_filt is "Yes") and returned after their measures, None for the files excluded.
+    """
+    list_arr, sf = utils.import_wavs(chunk_wavs, input_dir, high_f, quality, dtype)
+    metrics = []
+    for arr in list_arr:
+        arr_filt = filtering.butterfilter(arr, sf, f_filt)
+        ratio = filtering.band_energy_ratio(arr, arr_filt)
+        modulation = filtering.envelope_modulation(arr_filt, sf, pulse_rate)
+        if thresholds is None:
+            metrics.append((ratio, modulation))
+            continue
+        signal = None
+        if not _screened_out(ratio, modulation, *thresholds):
+            signal = filtering.wlt_denoise(arr_filt) if wlt_filt == "Yes" else arr_filt
+        metrics.append((ratio, modulation, signal))
+    return metrics
+
+
+def _screened_out(ratios, modulations, min_band_ratio, min_modulation):
+    """
+    Whether the files are excluded by the screening. The files too short to measure the modulation (NaN) are kept.
+    """
+    return (np.asarray(ratios) < min_band_ratio) | (
+        np.asarray(modulations) < min_modulation
+    )
+
+
+def _expand_distances(dist_reps, groups):
+    """
+    Distance matrix of all the files from the one of the representatives of their groups. The files of no group (-1) are at a distance of 1e10 from all the others, or missing from a sparse matrix. In a sparse matrix, the files of a group are stored at the smallest positive float from each other, as the diagonal of their representative is not stored, see image_matching.sparse_distance_matrix.
+    """
+    kept = groups >= 0
+    index = np.maximum(groups, 0)
+    dist_images = dist_reps[index][:, index]
+    if sparse.issparse(dist_images):
+        mask = sparse.diags(kept.astype(float))
+        dist_images = sparse.csr_matrix(mask @ dist_images @ mask)
+        dist_images.eliminate_zeros()
+        # Pairs of files of the same group
+        rows, cols = [], []
+        for g in np.unique(groups[kept]):
+            members = np.flatnonzero(groups == g)
+            if len(members) > 1:
+                i, j = np.meshgrid(members, members, indexing="ij")
+                rows.append(i[i != j])
+                cols.append(j[i != j])
+        if rows:
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+            duplicates = sparse.csr_matrix(
+                (
+                    np.full(len(rows), np.finfo(dist_images.dtype).tiny),
+                    (rows, cols),
+                ),
+                shape=dist_images.shape,
+            )
+            dist_images = dist_images + duplicates
+    else:
+        dist_images[~kept] = 1e10
+        dist_images[:, ~kept] = 1e10
+    return dist_images
+
+
+def _features_chunk(arr_chunk, sf, f_filt, wlen, ovlp, wlen_env, ovlp_env):
+    """
+    Draw the 8-bit spectrograms of a chunk of padded signals.
+    """
+    spectros = spectro.draw_specs_stack(
+        arr_chunk, wlen, ovlp, wlen_env, ovlp_env, sf, f_filt, dtype=np.uint8
+    )
+    return spectros
+
+
+def _same(a, b):
+    """
+    Compare two parameter values, which can be lists or arrays.
+    """
+    try:
+        return bool(np.array_equal(a, b))
+    except Exception:
+        return a == b
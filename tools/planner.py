@@ -0,0 +1,458 @@
+# Planning of a run from the headers of the sound files: sizes, memory and runtime of the analysis, before it starts
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.signal import ShortTimeFFT
+from scipy.signal.windows import hamming
+
+from . import utils, catalog, image_matching, pipeline, resources
+
+# Runtime of each stage on a single worker, in seconds per unit (see plan_sizes for the units), measured
+# on 120 short recordings with the default parameters, see calibrate. The per-file stages are divided between the workers
+stage_costs = {
+    "signals": 4.0,  # import, resampling, filtering and wavelet denoising, per million resampled samples
+    "spectrogram": 0.7,  # per million padded samples
+    "detect": 0.03,  # per million pixels of spectrograms
+    "match": 0.012,  # per million pairs of descriptors compared
+    "cluster": 2.5,  # per million entries of the distance matrix, for each fit
+}
+# Speed-up of the matching of SIFT and KAZE with matcher="blas", measured with about 100 keypoints per spectrogram
+# (more with more keypoints), see benchmarks/l2_matcher_benchmark.py
+blas_match_speedup = 5
+# Memory of the program and of the libraries it loads, in bytes
+base_memory = 200e6
+# Bytes of the descriptor of a keypoint, see image_matching.feature_detector_matcher
+descriptor_bytes = {"SIFT": 512, "ORB": 32, "ORB custom": 32, "AKAZE": 61, "KAZE": 256}
+# Bytes of a cv2.KeyPoint object kept with its descriptor
+keypoint_bytes = 100
+# Copies of a signal made while it is imported, filtered and denoised, in float
+signal_copies = 8
+# Copies of the distance matrix made by the clustering, in float 64 bits
+cluster_copies = 6
+# Clusterings whose number of clusters is chosen with the silhouette score, fitted once per number of clusters
+silhouette_clusterings = [
+    "Agglomerative",
+    "Gaussian Mixture Model",
+    "K-Means",
+    "Bisecting K-Means",
+]
+
+
+def read_headers(list_wavs, input_dir, n_readers=16):
+    """
+    Read the sampling frequency and the number of samples of the sound files from their headers only, see utils.wav_info. The headers are read in parallel, as the time is mostly spent waiting for the disk.
+
+    Parameters
+    ----------
+    list_wavs: list of str, list of file names.
+    input_dir: str, path of the directory containing the files.
+    n_readers: int, number of threads reading the headers.
+
+    Returns
+    -------
+    df_files: a pandas DataFrame with the "File" names, their "Sampling_frequency", number of "Samples" and "Duration" (in seconds).
+    """
+    paths = [os.path.join(input_dir, w) for w in list_wavs]
+    with ThreadPoolExecutor(max_workers=n_readers) as pool:
+        infos = list(pool.map(utils.wav_info, paths))
+    df_files = pd.DataFrame(
+        {
+            "File": list(list_wavs),
+            "Sampling_frequency": [int(sf) for sf, _ in infos],
+            "Samples": [int(n) for _, n in infos],
+        }
+    )
+    df_files["Duration"] = df_files.Samples / df_files.Sampling_frequency
+    return df_files
+
+
+def spectrogram_shape(n_samples, sf, f_filt, wlen, ovlp, wlen_env, ovlp_env):
+    """
+    Shape of the combined spectrogram of a signal of n_samples samples, without computing it, see spectro.draw_specs_stack.
+
+    Parameters
+    ----------
+    n_samples: int, number of samples of the (padded) signal.
+    sf: int, sampling frequency.
+    f_filt: a length-2 list, the frequencies of interest [low, high].
+    wlen, ovlp, wlen_env, ovlp_env: int, window lengths and overlaps (in %) of the STFTs of the signal and of its envelope.
+
+    Returns
+    -------
+    shape: tuple, the height and width of the spectrogram.
+    """
+    sizes = []
+    for win_len, overlap, f_mask in [
+        (wlen, ovlp, lambda f: np.logical_and(f_filt[0] < f, f < f_filt[1])),
+        (wlen_env, ovlp_env, lambda f: f <= 160),
+    ]:
+        st_ft = ShortTimeFFT(
+            hamming(win_len, sym=True), hop=int((1 - overlap / 100) * win_len), fs=sf
+        )
+        n_frames = st_ft.p_max(n_samples) - st_ft.p_min
+        sizes.append((np.count_nonzero(f_mask(st_ft.f)), n_frames))
+    height = int(max(sizes[0][0], sizes[1][0]))
+    width = int(max(sizes[0][1], sizes[1][1]))
+    return 2 * height, width
+
+
+def plan_sizes(df_files, **params):
+    """
+    Sizes of the data of a run, from the headers of its files (see read_headers).
+
+    Parameters
+    ----------
+    df_files: pandas DataFrame, the headers of the files, see read_headers.
+    **params: the parameters of the analysis, see pipeline.default_params.
+
+    Returns
+    -------
+    sizes: dict, with the number of files in "n_files", their total duration in seconds in "duration", the sampling frequency after resampling in "sf", the total number of resampled samples in "resampled_samples", the largest one in "max_samples", the padded length in "pad_len", the shape of each spectrogram in "spectrogram_shape", the number of keypoints per spectrogram in "nfeatures", the number of pairs of spectrograms matched in "n_pairs", the number of clustering fits in "n_fits", the bytes of a float in "itemsize", and the "detector_methode", "matcher", "wlen" and "wlen_env" used by estimate_memory and estimate_runtime.
+    """
+    p = dict(pipeline.default_params)
+    p.update(params)
+    n_files = len(df_files)
+    sf = int(2 * (p["f_filt"][1] + 100))
+    resampled = np.ceil(df_files.Samples * sf / df_files.Sampling_frequency)
+    max_samples = int(resampled.max()) if n_files else 0
+    pad_len = max_samples if p["pad_len"] is None else int(p["pad_len"])
+    nfeatures = p["nfeatures"]
+    if nfeatures is None:
+        nfeatures = image_matching.default_nfeatures[p["detector_methode"]]
+    elif nfeatures == "auto":
+        nfeatures = image_matching.feature_budget(
+            p["detector_methode"], int(p["n_matches"]), n_files
+        )
+    if p["n_candidates"] is not None:
+        n_pairs = n_files * min(int(p["n_candidates"]), n_files)
+    else:
+        n_pairs = n_files**2
+    n_fits = max(n_files - 2, 0) + 1 if p["clustering"] in silhouette_clusterings else 1
+    sizes = {
+        "n_files": n_files,
+        "duration": float(df_files.Duration.sum()),
+        "sf": sf,
+        "resampled_samples": int(resampled.sum()),
+        "max_samples": max_samples,
+        "pad_len": pad_len,
+        "spectrogram_shape": spectrogram_shape(
+            max(pad_len, 1),
+            sf,
+            p["f_filt"],
+            int(p["wlen"]),
+            int(p["ovlp"]),
+            int(p["wlen_env"]),
+            int(p["ovlp_env"]),
+        ),
+        "nfeatures": int(nfeatures),
+        "n_pairs": n_pairs,
+        "n_fits": n_fits,
+        "itemsize": np.dtype(p["precision"]).itemsize,
+        "detector_methode": p["detector_methode"],
+        "matcher": p["matcher"],
+        "wlen": int(p["wlen"]),
+        "wlen_env": int(p["wlen_env"]),
+    }
+    return sizes
+
+
+def estimate_memory(sizes, n_workers=1, chunk_size=16, checkpoint=True):
+    """
+    Peak memory of each stage of a run, including the memory of the program itself (see base_memory). The results of the stages are kept by the pipeline, so the memory of a stage includes the results of the previous ones, plus the arrays of the chunks processed by the workers and of the chunks waiting to be collected (twice the number of workers, see pipeline.Pipeline._imap).
+
+    Parameters
+    ----------
+    sizes: dict, see plan_sizes.
+    n_workers: int, number of workers of the per-file stages.
+    chunk_size: int, number of files of each task of the per-file stages.
+    checkpoint: bool, True if the distance matrix is computed by tiles, see pipeline.Pipeline.
+
+    Returns
+    -------
+    memory: dict, the peak memory of "signals", "pad", "spectrogram", "detect", "match" and "cluster", in bytes.
+    """
+    n = sizes["n_files"]
+    item = sizes["itemsize"]
+    height, width = sizes["spectrogram_shape"]
+    n_chunks = min(n_workers, -(-n // chunk_size)) if n else 0
+    in_flight = n_chunks * chunk_size
+    # Results of the stages, kept until the end of the run
+    signals = sizes["resampled_samples"] * item
+    padded = n * sizes["pad_len"] * item
+    spectrograms = n * height * width
+    keypoints = n * sizes["nfeatures"]
+    descriptors = keypoints * (
+        descriptor_bytes[sizes["detector_methode"]] + keypoint_bytes
+    )
+    distances = n**2 * item
+    # Arrays of the files being processed: the signal, its full STFTs and its envelope (complex)
+    work_signal = sizes["max_samples"] * item * signal_copies
+    n_frames = width
+    work_spectro = (
+        n_frames * (sizes["wlen"] // 2 + 1) * 2 * item
+        + n_frames * (sizes["wlen_env"] // 2 + 1) * 2 * item
+        + sizes["pad_len"] * 2 * item * 3
+        + height * width * 4
+    )
+    # The distances of the rows being matched are first kept as Python floats
+    match_rows = min(n, pipeline.match_tile_rows) if checkpoint else n
+    work_match = match_rows * n * 32
+    if sizes.get("matcher") == "blas":
+        # Padded block of descriptors, products and squared distances of image_matching.L2Matcher
+        work_match += 3 * image_matching.l2_block_size * 4
+    memory = {
+        "signals": in_flight * work_signal
+        + 2 * in_flight * sizes["max_samples"] * item
+        + signals,
+        "pad": signals + padded,
+        "spectrogram": signals + padded + spectrograms + in_flight * work_spectro,
+        "detect": signals
+        + padded
+        + spectrograms
+        + descriptors
+        + in_flight * height * width * 4,
+        "match": signals + padded + spectrograms + descriptors + distances + work_match,
+        "cluster": signals
+        + padded
+        + spectrograms
+        + descriptors
+        + distances
+        + n**2 * 8 * cluster_copies,
+    }
+    memory = {stage: base_memory + m for stage, m in memory.items()}
+    return memory
+
+
+def estimate_runtime(sizes, n_workers=1, costs=None):
+    """
+    Runtime of each stage of a run, from the cost of each stage per unit of data (see stage_costs and calibrate). The per-file stages are divided between the workers.
+
+    Parameters
+    ----------
+    sizes: dict, see plan_sizes.
+    n_workers: int, number of workers of the per-file stages.
+    costs: dict, the cost of each stage, None for stage_costs.
+
+    Returns
+    -------
+    runtime: dict, the runtime of "signals", "spectrogram", "detect", "match" and "cluster", in seconds.
+    """
+    if costs is None:
+        costs = stage_costs
+    units = _units(sizes)
+    n_workers = max(1, min(n_workers, sizes["n_files"]))
+    runtime = {}
+    for stage, unit in units.items():
+        runtime[stage] = costs[stage] * unit
+        if stage in ["signals", "spectrogram", "detect"]:
+            runtime[stage] /= n_workers
+        elif stage == "match" and sizes.get("matcher") == "blas":
+            runtime[stage] /= blas_match_speedup
+    return runtime
+
+
+def choose_resources(
+    sizes, memory_budget, n_workers=None, chunk_size=16, checkpoint=True
+):
+    """
+    Choose the number of workers and the chunk size of the per-file stages so that the peak memory of the run fits in the memory budget: the largest number of workers up to n_workers for which a chunk size fits, with the largest chunk size up to chunk_size.
+
+    Parameters
+    ----------
+    sizes: dict, see plan_sizes.
+    memory_budget: float, memory available for the run, in bytes.
+    n_workers: int, largest number of workers, None for the number of processors.
+    chunk_size: int, largest chunk size.
+    checkpoint: bool, see estimate_memory.
+
+    Returns
+    -------
+    n_workers: int, number of workers.
+    chunk_size: int, chunk size.
+    fits: bool, False if the run does not fit in the budget even with a single worker and chunks of one file.
+    """
+    if n_workers is None:
+        n_workers = resources.resource_config()["n_workers"]
+    list_chunks = [c for c in [chunk_size, 16, 8, 4, 2, 1] if c <= chunk_size]
+    for w in range(int(n_workers), 0, -1):
+        for c in sorted(set(list_chunks), reverse=True):
+            memory = estimate_memory(sizes, w, c, checkpoint)
+            if max(memory.values()) <= memory_budget:
+                return w, c, True
+    return 1, 1, False
+
+
+def available_memory():
+    """
+    Memory available on the machine, in bytes: the available memory given by the system on Linux, the physical memory otherwise (None if unknown).
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def plan_run(
+    input_dir,
+    n_workers=None,
+    chunk_size=16,
+    memory_budget=None,
+    checkpoint=True,
+    costs=None,
+    n_readers=16,
+    **params,
+):
+    """
+    Plan a run before it starts, from the headers of the files only: the sizes of its data, the peak memory and the runtime of each stage, and the number of workers and chunk size fitting in the memory budget.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory containing the sound files.
+    n_workers: int, largest number of workers of the per-file stages, None for the number of processors.
+    chunk_size: int, largest number of files of each task of the per-file stages.
+    memory_budget: float, memory available for the run, in bytes, None for 80% of the available memory (see available_memory).
+    checkpoint: bool, True if the run stores checkpoints, see pipeline.Pipeline.
+    costs: dict, the cost of each stage, None for stage_costs, see calibrate.
+    n_readers: int, number of threads reading the headers.
+    **params: the parameters of the analysis, see pipeline.default_params. list_wavs is the list of file names, None for all the sound files of input_dir (and of its subdirectories with recursive="Yes").
+
+    Returns
+    -------
+    plan: dict, with the headers of the files in "files" (see read_headers), the sizes of the data in "sizes" (see plan_sizes), a pandas DataFrame with the peak "Memory" (in bytes) and the "Runtime" (in seconds) of each "Stage" in "stages", the "peak_memory", the total "runtime", the "memory_budget", the chosen "n_workers" and "chunk_size" and whether the run "fits" in the budget.
+    """
+    list_wavs = params.get("list_wavs")
+    if list_wavs is None:
+        recursive = params.get("recursive", "No") == "Yes"
+        list_wavs = catalog.scan_audio(input_dir, recursive).File
+    df_files = read_headers(list_wavs, input_dir, n_readers)
+    sizes = plan_sizes(df_files, **params)
+    if memory_budget is None:
+        memory = available_memory()
+        memory_budget = np.inf if memory is None else 0.8 * memory
+    n_workers, chunk_size, fits = choose_resources(
+        sizes, memory_budget, n_workers, chunk_size, checkpoint
+    )
+    memory = estimate_memory(sizes, n_workers, chunk_size, checkpoint)
+    runtime = estimate_runtime(sizes, n_workers, costs)
+    df_stages = pd.DataFrame(
+        {
+            "Stage": list(memory),
+            "Memory": list(memory.values()),
+            "Runtime": [runtime.get(s, 0.0) for s in memory],
+        }
+    )
+    plan = {
+        "files": df_files,
+        "sizes": sizes,
+        "stages": df_stages,
+        "peak_memory": max(memory.values()),
+        "runtime": sum(runtime.values()),
+        "memory_budget": memory_budget,
+        "n_workers": n_workers,
+        "chunk_size": chunk_size,
+        "fits": fits,
+    }
+    return plan
+
+
+def plan_summary(plan):
+    """
+    Text summary of a plan, see plan_run.
+    """
+    sizes = plan["sizes"]
+    height, width = sizes["spectrogram_shape"]
+    lines = [
+        "Files: %d (%.1f hours of recordings)"
+        % (sizes["n_files"], sizes["duration"] / 3600),
+        "Padded length: %d samples, spectrograms of %d x %d pixels (%.0f MB)"
+        % (
+            sizes["pad_len"],
+            height,
+            width,
+            sizes["n_files"] * height * width / 1e6,
+        ),
+        "Distance matrix: %.0f MB, %d pairs matched, %d clustering fits"
+        % (
+            sizes["n_files"] ** 2 * sizes["itemsize"] / 1e6,
+            sizes["n_pairs"],
+            sizes["n_fits"],
+        ),
+        "Estimated peak memory: %.2f GB" % (plan["peak_memory"] / 1e9),
+        "Estimated runtime: %s" % _format_duration(plan["runtime"]),
+        "Workers and chunk size fitting in %.2f GB: %d workers, %d files per chunk"
+        % (plan["memory_budget"] / 1e9, plan["n_workers"], plan["chunk_size"]),
+    ]
+    if not plan["fits"]:
+        lines.append(
+            "Warning: the run may not fit in memory, consider float32 precision, deduplication or fewer files."
+        )
+    return "\n".join(lines)
+
+
+def calibrate(input_dir, n_files=32, **params):
+    """
+    Measure the cost of each stage per unit of data (see stage_costs) on this machine, by running the analysis on a sample of the files with a single worker.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory containing the sound files.
+    n_files: int, number of files of the sample, taken evenly among the files.
+    **params: the parameters of the analysis, see pipeline.default_params.
+
+    Returns
+    -------
+    costs: dict, the cost of each stage, to be given to plan_run or estimate_runtime.
+    """
+    list_wavs = params.pop("list_wavs", None)
+    if list_wavs is None:
+        recursive = params.get("recursive", "No") == "Yes"
+        list_wavs = catalog.scan_audio(input_dir, recursive).File
+    sample = np.asarray(list_wavs)[
+        np.unique(
+            np.linspace(0, len(list_wavs) - 1, min(n_files, len(list_wavs))).astype(int)
+        )
+    ]
+    pipe = pipeline.Pipeline(input_dir, executor="serial", list_wavs=sample, **params)
+    pipe.result("cluster")
+    sizes = plan_sizes(read_headers(sample, input_dir), **pipe.params)
+    timings = dict(pipe.timings)
+    timings["signals"] = sum(timings.get(s, 0.0) for s in pipeline.signal_stages)
+    timings["spectrogram"] = timings.get("spectrogram", 0.0) + timings.get("pad", 0.0)
+    units = _units(sizes)
+    costs = {s: float(timings[s] / max(units[s], 1e-12)) for s in units}
+    return costs
+
+
+def _units(sizes):
+    """
+    Units of data of each stage, in millions, see stage_costs.
+    """
+    height, width = sizes["spectrogram_shape"]
+    n = sizes["n_files"]
+    units = {
+        "signals": sizes["resampled_samples"] / 1e6,
+        "spectrogram": n * sizes["pad_len"] / 1e6,
+        "detect": n * height * width / 1e6,
+        "match": sizes["n_pairs"] * sizes["nfeatures"] ** 2 / 1e6,
+        "cluster": sizes["n_fits"] * n**2 / 1e6,
+    }
+    return units
+
+
+def _format_duration(seconds):
+    """
+    Duration in seconds, minutes or hours, e.g. "12 min".
+    """
+    if seconds < 60:
+        return "%.0f s" % seconds
+    if seconds < 3600:
+        return "%.0f min" % (seconds / 60)
+    return "%.1f h" % (seconds / 3600)
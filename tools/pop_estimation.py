@@ -1,8 +1,19 @@
 # Librairies
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, date
 import numpy as np
 import pandas as pd
 
+from . import resources
+
+# Timestamps of the filenames of common recorders, as a regular expression capturing the timestamp and its format, see parse_filename_dates
+filename_date_formats = {
+    # xxxxx_20230619_xxxxxx.wav, the date in the second field separated by underscores
+    "default": (r"^[^_]*_([^_.]*)", "%Y%m%d"),
+    # 20230619_053000.WAV, AudioMoth and other recorders naming the files by their start time
+    "audiomoth": (r"(\d{8}_\d{6})", "%Y%m%d_%H%M%S"),
+}
+
 
 def estimate_number_of_individuals(pi_pop):
     """
@@ -34,12 +45,7 @@ def estimate_number_of_individuals(pi_pop):
     n_indiv: int, the estimated number of individuals based on the PIC.
     df_pic: a pandas DataFrame containing 3 columns: the number of clusters in "Number_of_clusters", the corresponding PPI in "Population_Presence_Index" and
     """
-    pic = np.array(
-        [
-            2 * (k + 1) / len(pi_pop) - 2 * np.log(1 + pi_pop[k])
-            for k in range(len(pi_pop))
-        ]
-    )
+    pic = population_information_criterion(pi_pop)
     df_pic = pd.DataFrame(
         {
             "Number_of_clusters": np.arange(1, len(pi_pop) + 1),
@@ -52,6 +58,69 @@ def estimate_number_of_individuals(pi_pop):
     return (int(n_indiv), df_pic)
 
 
+def population_information_criterion(pi_pop):
+    """
+    Population Information Criterion of the populations of 1 to n clusters, see estimate_number_of_individuals.
+
+    Parameters
+    ----------
+    pi_pop: a 1D array, result from population_presence_index.
+
+    Returns
+    -------
+    pic: a 1D array, the PIC for a number of clusters ranging from 1 to the total number of clusters.
+    """
+    return 2 * np.arange(1, len(pi_pop) + 1) / len(pi_pop) - 2 * np.log(1 + pi_pop)
+
+
+def estimate_population(df_res_with_date, pi_threshold=0.01):
+    """
+    Perform the whole population estimation from the clustering results: number of clusters per day, presence of each cluster per day, Presence Index of each cluster and PPI/PIC, and estimate the number of individuals using the PI and the PIC.
+
+    Parameters
+    ----------
+    df_res_with_date: a pandas DataFrame with at least 2 columns, "Date" and "Cluster", see add_date_to_df.
+    pi_threshold: float, the Presence Index above which a cluster is considered as a resident individual, see presence_index_arr.
+
+    Returns
+    -------
+    dict_pop: a dict with the following keys:
+    "clusters_per_day", the result of daily_vocalize_clusters,
+    "presence", the result of presence_clusters,
+    "presence_index", a pandas DataFrame with the result of presence_index_arr sorted by decreasing Presence Index,
+    "ppi_pic", the DataFrame returned by estimate_number_of_individuals,
+    "n_indiv_pi", the estimated number of resident individuals using the Presence Index,
+    "n_indiv_pic", the estimated number of individuals using the PIC.
+    """
+    n_clusts_per_day = daily_vocalize_clusters(df_res_with_date)
+    pres = presence_clusters(df_res_with_date)
+    pi_arr = presence_index_arr(df_res_with_date)
+    pi_df = pd.DataFrame(
+        pi_arr,
+        columns=[
+            "Cluster",
+            "Days_of_presence",
+            "Number_of_sounds",
+            "Presence_index",
+        ],
+    )
+    sorted_pi_df = pi_df.sort_values(by="Presence_index", ascending=False)
+    # Estimation of resident individuals according to Presence Index
+    n_indiv_pi = int(np.count_nonzero(pi_arr[:, 3] >= pi_threshold))
+    # Estimation of the whole population using Population Information Criterion
+    pi_pop = population_presence_index(pi_arr, pres)
+    n_indiv_pic, df_pic = estimate_number_of_individuals(pi_pop)
+    dict_pop = {
+        "clusters_per_day": n_clusts_per_day,
+        "presence": pres,
+        "presence_index": sorted_pi_df,
+        "ppi_pic": df_pic,
+        "n_indiv_pi": n_indiv_pi,
+        "n_indiv_pic": n_indiv_pic,
+    }
+    return dict_pop
+
+
 def population_presence_index(pi_arr, presence):
     """
     We can generalize the Presence Index (see presence_index_arr) to a population as the Population Presence Index (PPI) of n clusters as:
@@ -72,22 +141,287 @@ def population_presence_index(pi_arr, presence):
     """
     # From DatFrame to array
     presence_arr = presence.to_numpy()
-    # Get the indices of the decreasing order of PI
-    clusters_ordered = np.argsort(pi_arr[:, 3])[::-1]
-    # Create the list with the clusters in the growing population
-    pops = [clusters_ordered[:k] for k in range(1, len(clusters_ordered) + 1)]
-    # Number of sounds covered by the population
-    n_sounds_pop = np.array([np.sum(pi_arr[p, 2]) for p in pops])
-    # Number of days where we have at least a cluster of the population
-    sounds_pop_per_day = [np.sum(presence_arr[p, :], axis=0) for p in pops]
-    n_days_pop = np.array([len(np.nonzero(s)[0]) for s in sounds_pop_per_day])
-    # Population presence index
-    pi_pop = (n_sounds_pop / np.sum(presence_arr)) * (
-        n_days_pop / presence_arr.shape[1]
-    )
+    return _growing_population_pi(pi_arr[:, 3], pi_arr[:, 2], presence_arr > 0)
+
+
+def _growing_population_pi(presence_index, n_sounds, present):
+    """
+    Population Presence Index of the populations made of the 1 to n clusters of highest Presence Index, see population_presence_index. Each day is counted from the first cluster of the growing population present on that day, so all the populations are computed at once.
+
+    Parameters
+    ----------
+    presence_index: 1D array, the Presence Index of each cluster.
+    n_sounds: 1D array, the number of sounds of each cluster.
+    present: 2D array of bool of shape (number of clusters, number of days), the presence of each cluster per day.
+
+    Returns
+    -------
+    pi_pop: 1D array, the Population Presence Index for a number of clusters ranging from 1 to the number of clusters.
+    """
+    n_clust, n_days = present.shape
+    # Rank of each cluster in the decreasing order of PI
+    clusters_ordered = np.argsort(presence_index)[::-1]
+    rank = np.empty(n_clust, dtype=int)
+    rank[clusters_ordered] = np.arange(n_clust)
+    # Size of the smallest population present on each day
+    first_rank = np.where(present, rank[:, None], n_clust).min(axis=0, initial=n_clust)
+    n_days_pop = np.cumsum(np.bincount(first_rank, minlength=n_clust + 1)[:n_clust])
+    n_sounds_pop = np.cumsum(n_sounds[clusters_ordered])
+    pi_pop = (n_sounds_pop / np.sum(n_sounds)) * (n_days_pop / n_days)
     return pi_pop
 
 
+def rolling_population(
+    df_res_with_date,
+    window_days=7,
+    step_days=1,
+    expanding=False,
+    pi_threshold=0.01,
+):
+    """
+    Presence Index, Population Presence Index and Population Information Criterion (see estimate_population) over windows of days, to follow the estimated population through the season.
+    The number of sounds and of days of presence of each cluster in each window are obtained from prefix sums of the cluster x day count matrix (see count_matrix) along the days, so moving the window does not recount the sounds. In each window, the days, sounds and clusters are the ones recorded in the window.
+
+    Parameters
+    ----------
+    df_res_with_date: a pandas DataFrame with at least 2 columns, "Date" and "Cluster", see add_date_to_df.
+    window_days: int, length of the windows, in calendar days.
+    step_days: int, number of days between the starts (sliding windows) or the ends (expanding windows) of two consecutive windows.
+    expanding: bool, False for sliding windows of window_days days, True for windows all starting on the first day and growing by step_days days from window_days days.
+    pi_threshold: float, the Presence Index above which a cluster is considered as a resident individual, see presence_index_arr.
+
+    Returns
+    -------
+    df_rolling: a tidy pandas DataFrame with one row per window and cluster recorded in the window: the first and last days of the window in "Start" and "End", the number of days with recordings and of sounds in the window in "Days_in_window" and "Sounds_in_window", the "Cluster", its "Days_of_presence", "Number_of_sounds" and "Presence_index", its "Rank" in the decreasing order of PI, the PPI and PIC of the population made of the clusters up to this rank in "Population_Presence_Index" and "Population_Information_Criterion", and the estimated number of individuals of the window using the PI and the PIC in "Individuals_PI" and "Individuals_PIC".
+    """
+    if window_days < 1 or step_days < 1:
+        raise ValueError("The window and the step must be at least 1 day.")
+    clusters, days, counts = count_matrix(df_res_with_date)
+    days = pd.DatetimeIndex(days)
+    day_numbers = ((days - days[0]) // pd.Timedelta(days=1)).to_numpy()
+    last = day_numbers[-1]
+    # Prefix sums of the sounds and of the days of presence along the days
+    cum_sounds = np.zeros((len(clusters), len(days) + 1))
+    np.cumsum(counts, axis=1, out=cum_sounds[:, 1:])
+    cum_days = np.zeros((len(clusters), len(days) + 1), dtype=int)
+    np.cumsum(counts > 0, axis=1, out=cum_days[:, 1:])
+    if expanding:
+        ends = np.arange(window_days, last + step_days + 1, step_days)
+        ends = np.unique(np.minimum(ends, last + 1))
+        starts = np.zeros_like(ends)
+    else:
+        starts = np.arange(0, max(last - window_days + 1, 0) + 1, step_days)
+        ends = starts + window_days
+    lo = np.searchsorted(day_numbers, starts)
+    hi = np.searchsorted(day_numbers, ends)
+    list_df = []
+    for start, end, a, b in zip(starts, ends, lo, hi):
+        if a == b:
+            # No recording in the window
+            continue
+        n_sounds = cum_sounds[:, b] - cum_sounds[:, a]
+        kept = n_sounds > 0
+        n_sounds = n_sounds[kept]
+        n_days = (cum_days[:, b] - cum_days[:, a])[kept]
+        presence_index = n_days * n_sounds / (np.sum(n_sounds) * (b - a))
+        pi_pop = _growing_population_pi(presence_index, n_sounds, counts[kept, a:b] > 0)
+        pic = population_information_criterion(pi_pop)
+        rank = np.empty(len(n_sounds), dtype=int)
+        rank[np.argsort(presence_index)[::-1]] = np.arange(len(n_sounds))
+        list_df.append(
+            pd.DataFrame(
+                {
+                    "Start": days[0] + pd.Timedelta(days=int(start)),
+                    "End": days[0] + pd.Timedelta(days=int(end) - 1),
+                    "Days_in_window": b - a,
+                    "Sounds_in_window": int(np.sum(n_sounds)),
+                    "Cluster": clusters[kept],
+                    "Days_of_presence": n_days,
+                    "Number_of_sounds": n_sounds.astype(int),
+                    "Presence_index": presence_index,
+                    "Rank": rank + 1,
+                    "Population_Presence_Index": pi_pop[rank],
+                    "Population_Information_Criterion": pic[rank],
+                    "Individuals_PI": int(
+                        np.count_nonzero(presence_index >= pi_threshold)
+                    ),
+                    "Individuals_PIC": int(1 + np.argmin(pic)),
+                }
+            ).sort_values("Rank")
+        )
+    if not list_df:
+        return pd.DataFrame(
+            columns=[
+                "Start",
+                "End",
+                "Days_in_window",
+                "Sounds_in_window",
+                "Cluster",
+                "Days_of_presence",
+                "Number_of_sounds",
+                "Presence_index",
+                "Rank",
+                "Population_Presence_Index",
+                "Population_Information_Criterion",
+                "Individuals_PI",
+                "Individuals_PIC",
+            ]
+        )
+    return pd.concat(list_df, ignore_index=True)
+
+
+def bootstrap_population(
+    df_res_with_date,
+    n_replicates=1000,
+    confidence=0.95,
+    pi_threshold=0.01,
+    batch_size=100,
+    executor="serial",
+    n_workers=None,
+    threads_per_worker=None,
+    random_state=0,
+):
+    """
+    Confidence intervals of the number of individuals estimated using the PI and the PIC (see estimate_population) by bootstrap: the recording days are drawn with replacement, then the sounds of each drawn day are drawn with replacement among the sounds recorded on that day.
+    The replicates are drawn directly on the cluster x day count matrix (see count_matrix) and their PI, PPI and PIC are computed together by batches of replicates with array operations, the batches being computed in parallel with executor.
+
+    Parameters
+    ----------
+    df_res_with_date: a pandas DataFrame with at least 2 columns, "Date" and "Cluster", see add_date_to_df.
+    n_replicates: int, number of bootstrap replicates.
+    confidence: float, confidence level of the intervals, in ]0, 1[.
+    pi_threshold: float, the Presence Index above which a cluster is considered as a resident individual, see presence_index_arr.
+    batch_size: int, number of replicates computed at once, the memory used growing with batch_size x number of clusters x number of days.
+    executor: str, "serial", "thread" or "process", to compute the batches.
+    n_workers: int, number of workers, see resources.resource_config.
+    threads_per_worker: int, number of threads of each worker, see resources.resource_config.
+    random_state: int, seed of the bootstrap, the replicates not depending on the executor.
+
+    Returns
+    -------
+    dict_boot: a dict with the following keys:
+    "replicates", a pandas DataFrame with the number of individuals estimated in each replicate using the PI and the PIC in "Individuals_PI" and "Individuals_PIC",
+    "intervals", a pandas DataFrame with one row per "Estimator" ("PI" and "PIC"): the number of individuals estimated on the data in "Estimate", the mean over the replicates in "Mean", the bounds of the percentile interval in "Lower" and "Upper" and the "Confidence" level.
+    """
+    if n_replicates < 1 or batch_size < 1:
+        raise ValueError(
+            "The number of replicates and the batch size must be at least 1."
+        )
+    if not 0 < confidence < 1:
+        raise ValueError("The confidence level must be in ]0, 1[.")
+    _, _, counts = count_matrix(df_res_with_date)
+    counts = counts.astype(np.int64)
+    sizes = [
+        min(batch_size, n_replicates - start)
+        for start in range(0, n_replicates, batch_size)
+    ]
+    # One independent stream of random numbers per batch
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    res_config = resources.resource_config(
+        1 if executor == "serial" else n_workers, threads_per_worker
+    )
+    threads = res_config["threads_per_worker"]
+    args = ([counts] * len(sizes), sizes, seeds, [pi_threshold] * len(sizes))
+    if executor == "serial":
+        with resources.limit_threads(threads):
+            list_res = list(map(_bootstrap_batch, *args))
+    elif executor in ["thread", "process"]:
+        if executor == "process":
+            pool = ProcessPoolExecutor(
+                max_workers=res_config["n_workers"],
+                initializer=resources.init_worker,
+                initargs=(threads,),
+            )
+        else:
+            pool = ThreadPoolExecutor(max_workers=res_config["n_workers"])
+        with pool, resources.limit_threads(threads):
+            list_res = list(pool.map(_bootstrap_batch, *args))
+    else:
+        raise ValueError("The executor must be 'serial', 'thread' or 'process'.")
+    n_indiv_pi = np.concatenate([r[0] for r in list_res])
+    n_indiv_pic = np.concatenate([r[1] for r in list_res])
+    est_pi, est_pic = _population_estimates(counts[None], pi_threshold)
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
+    bounds_pi = np.quantile(n_indiv_pi, quantiles)
+    bounds_pic = np.quantile(n_indiv_pic, quantiles)
+    df_intervals = pd.DataFrame(
+        {
+            "Estimator": ["PI", "PIC"],
+            "Estimate": [int(est_pi[0]), int(est_pic[0])],
+            "Mean": [np.mean(n_indiv_pi), np.mean(n_indiv_pic)],
+            "Lower": [bounds_pi[0], bounds_pic[0]],
+            "Upper": [bounds_pi[1], bounds_pic[1]],
+            "Confidence": confidence,
+        }
+    )
+    dict_boot = {
+        "replicates": pd.DataFrame(
+            {"Individuals_PI": n_indiv_pi, "Individuals_PIC": n_indiv_pic}
+        ),
+        "intervals": df_intervals,
+    }
+    return dict_boot
+
+
+def _bootstrap_batch(counts, n_batch, seed, pi_threshold):
+    """
+    Draw a batch of bootstrap replicates of the cluster x day count matrix and estimate their number of individuals, see bootstrap_population.
+    """
+    rng = np.random.default_rng(seed)
+    n_days = counts.shape[1]
+    day_sounds = counts.sum(axis=0)
+    # Days drawn with replacement, then the sounds of each drawn day among the sounds of that day
+    drawn = rng.integers(0, n_days, size=(n_batch, n_days))
+    boot = rng.multinomial(day_sounds[drawn], (counts / day_sounds).T[drawn])
+    return _population_estimates(np.swapaxes(boot, 1, 2), pi_threshold)
+
+
+def _population_estimates(counts, pi_threshold):
+    """
+    Number of individuals estimated using the PI and the PIC (see estimate_population) of a stack of count matrices at once, the clusters without sound in a matrix being left out of its population.
+
+    Parameters
+    ----------
+    counts: 3D array of shape (number of matrices, number of clusters, number of days), see count_matrix.
+    pi_threshold: float, the Presence Index above which a cluster is considered as a resident individual.
+
+    Returns
+    -------
+    n_indiv_pi: 1D array, the number of individuals of each matrix estimated using the PI.
+    n_indiv_pic: 1D array, the number of individuals of each matrix estimated using the PIC.
+    """
+    n_mat, n_clust, n_days = counts.shape
+    present = counts > 0
+    n_sounds = counts.sum(axis=2)
+    total = n_sounds.sum(axis=1, keepdims=True)
+    presence_index = present.sum(axis=2) * n_sounds / (total * n_days)
+    n_indiv_pi = np.count_nonzero(
+        (presence_index >= pi_threshold) & (n_sounds > 0), axis=1
+    )
+    # Ranks in the decreasing order of PI, the clusters without sound (PI of 0) coming last
+    order = np.argsort(presence_index, axis=1)[:, ::-1]
+    rank = np.empty_like(order)
+    np.put_along_axis(
+        rank, order, np.broadcast_to(np.arange(n_clust), order.shape), axis=1
+    )
+    # Same as _growing_population_pi, for all the matrices at once
+    first_rank = np.where(present, rank[:, :, None], n_clust).min(axis=1)
+    offsets = (n_clust + 1) * np.arange(n_mat)[:, None]
+    n_days_pop = np.cumsum(
+        np.bincount(
+            (first_rank + offsets).reshape(-1), minlength=n_mat * (n_clust + 1)
+        ).reshape((n_mat, n_clust + 1))[:, :n_clust],
+        axis=1,
+    )
+    n_sounds_pop = np.cumsum(np.take_along_axis(n_sounds, order, axis=1), axis=1)
+    pi_pop = (n_sounds_pop / total) * (n_days_pop / n_days)
+    n_kept = np.count_nonzero(n_sounds, axis=1)[:, None]
+    n_pop = np.arange(1, n_clust + 1)[None, :]
+    pic = np.where(n_pop <= n_kept, 2 * n_pop / n_kept - 2 * np.log(1 + pi_pop), np.inf)
+    n_indiv_pic = 1 + np.argmin(pic, axis=1)
+    return n_indiv_pi, n_indiv_pic
+
+
 def daily_vocalize_clusters(df):
     """
     Get the number of different clusters per date.
@@ -101,18 +435,13 @@ def daily_vocalize_clusters(df):
     n_clust_voc_per_day: a pandas DataFrame of shape (number of different dates, 3). The first column, "Date", contains the different days of the dataset. The second, "Number_Clusters" contains the number of clusters present per day. The third, "Number_Sounds" represents the number of sounds recorded for each date.
 
     """
-    date_uniq = np.unique(df.Date)
-    nb_clusts = []
-    nb_sounds = []
-    for d in date_uniq:
-        clust = df.Cluster[df.Date == d]
-        nb_clusts.append(len(np.unique(clust)))
-        nb_sounds.append(len(clust))
-    n_clusts_sounds_per_day = np.column_stack(
-        (date_uniq, np.array(nb_clusts), np.array(nb_sounds))
-    )
+    _, days, counts = count_matrix(df)
     n_clusts_sounds_per_day = pd.DataFrame(
-        n_clusts_sounds_per_day, columns=["Date", "Number_Clusters", "Number_Sounds"]
+        {
+            "Date": days,
+            "Number_Clusters": np.count_nonzero(counts, axis=0),
+            "Number_Sounds": counts.sum(axis=0).astype(int),
+        }
     )
     return n_clusts_sounds_per_day
 
@@ -141,8 +470,7 @@ def presence_index_arr(df):
     The forth, the presence index of each cluster.
 
     """
-    uniq_cluster = np.unique(df.Cluster)
-    presence = presence_clusters(df)
+    uniq_cluster, _, presence = count_matrix(df)
     # Number of days where each cluster is present
     nb_days = np.count_nonzero(presence, axis=1)
     # Number of sounds of each cluster
@@ -174,19 +502,79 @@ def presence_clusters(df):
     presence: a pandas DataFrame of shape (number of clusters, number of dates), with each line representing the number of sounds assigned to a particular cluster per day.
 
     """
-    clusters = np.unique(df.Cluster)
-    nb_clusters = len(clusters)
-    days = np.unique(df.Date)
-    n_days = len(days)
-    presence = np.zeros((nb_clusters, n_days))
-    for c in clusters:
-        for d in days:
-            n = len(df.Cluster[np.logical_and(df.Cluster == c, df.Date == d)])
-            presence[clusters == c, days == d] = n
+    _, days, presence = count_matrix(df)
     presence_df = pd.DataFrame(presence, columns=days)
     return presence_df
 
 
+def count_matrix(df):
+    """
+    Number of sounds of each cluster per day, counted at once from the integer codes of the clusters and of the days.
+
+    Parameters
+    ----------
+    df: a pandas DataFrame with at least 2 columns, "Date" and "Cluster", see add_date_to_df. With a categorical "Date", its codes are used directly as the index of the days.
+
+    Returns
+    -------
+    clusters: 1D array, the sorted cluster ids.
+    days: 1D array or pandas Index, the sorted days with at least one sound.
+    counts: 2D array of shape (number of clusters, number of days), the number of sounds of each cluster per day.
+    """
+    clusters, clust_idx = np.unique(df.Cluster.to_numpy(), return_inverse=True)
+    if isinstance(df.Date.dtype, pd.CategoricalDtype):
+        used, day_idx = np.unique(df.Date.cat.codes.to_numpy(), return_inverse=True)
+        days = df.Date.cat.categories[used]
+    else:
+        days, day_idx = np.unique(df.Date.to_numpy(), return_inverse=True)
+    n_days = len(days)
+    counts = np.bincount(
+        clust_idx.reshape(-1) * n_days + day_idx.reshape(-1),
+        minlength=len(clusters) * n_days,
+    ).reshape((len(clusters), n_days))
+    return clusters, days, counts.astype(float)
+
+
+def parse_filename_dates(
+    files, date_pattern="default", date_format=None, time_of_day=False
+):
+    """
+    Get the timestamps of the filenames at once, using a regular expression and pandas.to_datetime.
+
+    Parameters
+    ----------
+    files: list or pandas Series of str, the filenames, or their paths (see catalog.scan_audio).
+    date_pattern: str, name of a format of filename_date_formats, or a regular expression whose first group captures the timestamp.
+    date_format: str, format of the captured timestamp (see datetime.strptime), None to use the one of the named date_pattern.
+    time_of_day: bool, True to keep the time of day of the timestamps, False to only keep the day.
+
+    Returns
+    -------
+    timestamps: pandas Series of datetime64, the timestamp of each file. Raise a ValueError if a filename does not contain a timestamp in the expected format.
+    """
+    if date_pattern in filename_date_formats:
+        date_pattern, default_format = filename_date_formats[date_pattern]
+        if date_format is None:
+            date_format = default_format
+    if date_format is None:
+        raise ValueError("The date format must be given with a custom date pattern.")
+    # Only the name of the file is parsed, not the directories of its path
+    names = pd.Series(np.asarray(files, dtype=str)).str.replace(
+        r"^.*[/\\]", "", regex=True
+    )
+    captured = names.str.extract(date_pattern, expand=False)
+    if isinstance(captured, pd.DataFrame):
+        captured = captured.iloc[:, 0]
+    if captured.isna().any():
+        raise ValueError(
+            "No timestamp found in the filename %s." % names[captured.isna()].iloc[0]
+        )
+    timestamps = pd.to_datetime(captured, format=date_format)
+    if not time_of_day:
+        timestamps = timestamps.dt.normalize()
+    return timestamps
+
+
 def get_date_from_filename(name):
     """
     Get the date from a filename.
@@ -207,18 +595,31 @@ def get_date_from_filename(name):
     return date
 
 
-def add_date_to_df(df_clustrering):
+def add_date_to_df(
+    df_clustrering, date_pattern="default", date_format=None, time_of_day=False
+):
     """
-    Add a "Date" column to a pandas DataFrame resulting from the clustering of the sounds.
+    Add a "Date" column to a pandas DataFrame resulting from the clustering of the sounds. The dates of all the files are parsed at once, see parse_filename_dates, and stored as a categorical column whose integer codes index the days, so that the presence computations (see count_matrix) do not compare the dates row by row.
 
     Parameters
     ----------
-    df_clustering: a pandas DataFrame containing the results of the clustering in the column "Cluster" and the name of each file in the "File" column. The filenames must be split in different part, separated by undescores, with the date in the second position and with the following format: yearmonthday.
+    df_clustering: a pandas DataFrame containing the results of the clustering in the column "Cluster" and the name of each file in the "File" column. By default, the filenames must be split in different part, separated by undescores, with the date in the second position and with the following format: yearmonthday.
     For example:  "xxxxx_20230619_xxxxxx.wav" means that the following file was recorded in June 13, 2023.
+    date_pattern: str, name of a format of filename_date_formats (e.g. "audiomoth" for "20230619_053000.WAV") or a regular expression whose first group captures the timestamp.
+    date_format: str, format of the captured timestamp, None to use the one of the named date_pattern.
+    time_of_day: bool, True to also add a "Time" column with the full timestamp of each file.
 
     Returns
     -------
-    df_clust_with_date: pandas DataFrame, with the "Date" column added.
+    df_clust_with_date: pandas DataFrame, with the "Date" column added, and the "Time" column with time_of_day.
     """
-    df_clustrering["Date"] = df_clustrering.File.apply(get_date_from_filename)
+    timestamps = parse_filename_dates(
+        df_clustrering.File, date_pattern, date_format, time_of_day
+    )
+    days = timestamps.dt.normalize()
+    df_clustrering["Date"] = pd.Categorical(
+        days.to_numpy(), categories=np.unique(days.to_numpy())
+    )
+    if time_of_day:
+        df_clustrering["Time"] = timestamps.to_numpy()
     return df_clustrering
@@ -0,0 +1,321 @@
+# Reference library of the individuals already identified, to label new recordings without clustering them again
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from . import image_matching, pipeline, resources, watcher
+from .checkpoint import _to_json
+
+# Parameters of the pipeline that are not part of the analysis and are not stored in the library
+_unsaved_params = ["input_dir", "output_dir", "list_wavs", "recursive"]
+
+
+def exemplar_indices(dist_images, labels, n_exemplars=5, method="medoid"):
+    """
+    Choose the exemplars of each cluster: the files that represent it best.
+
+    Parameters
+    ----------
+    dist_images: 2D array, the distance matrix between the files, see image_matching.distance_matrix.
+    labels: 1D array, the cluster of each file, -1 for the files excluded from the clustering.
+    n_exemplars: int, maximum number of exemplars per cluster.
+    method: str, "medoid" for the files with the smallest sum of matching distances to the other files of their cluster, or "affinity" for the exemplars in the sense of Affinity Propagation: clustering_matches clusters the rows of the distance matrix with the negative squared euclidean distance as similarity, and the exemplar of a cluster is the file whose row is the most similar to the rows of the other files of the cluster.
+
+    Returns
+    -------
+    exemplars: dict, with the clusters as keys and the indices of their exemplars, best first, as values.
+    """
+    if method not in ["medoid", "affinity"]:
+        raise ValueError("The method must be 'medoid' or 'affinity'.")
+    exemplars = {}
+    for c in np.unique(labels[labels >= 0]):
+        idx = np.nonzero(labels == c)[0]
+        if method == "medoid":
+            score = np.sum(dist_images[np.ix_(idx, idx)], axis=1)
+        else:
+            # Sum of the squared distances between the row of each file and the other rows of the cluster
+            rows = dist_images[idx].astype(np.float64)
+            score = len(idx) * np.sum(rows**2, axis=1) - 2 * rows @ rows.sum(axis=0)
+        exemplars[int(c)] = idx[np.argsort(score, kind="stable")[:n_exemplars]]
+    return exemplars
+
+
+def build_library(
+    pipe,
+    library_dir,
+    individuals=None,
+    n_exemplars=5,
+    method="medoid",
+    threshold=None,
+):
+    """
+    Store the exemplars of the clusters confirmed as individuals in a reference library, so that new recordings can be labelled by matching them against the exemplars only (see identify), instead of clustering all the files again. If the library already exists, the new exemplars are added to it: the analysis parameters must be the same (with pad_len set to the one of the library, so that the spectrograms have the same size), and the exemplars of an individual already in the library are added to its own.
+
+    Parameters
+    ----------
+    pipe: pipeline.Pipeline, the analysis whose clusters are stored (with the "matching" similarity).
+    library_dir: str, path of the directory of the library.
+    individuals: dict, with the confirmed clusters as keys and the names of the individuals as values, None to store all the clusters (named "Individual_<cluster>").
+    n_exemplars: int, maximum number of exemplars stored per cluster.
+    method: str, how the exemplars are chosen, see exemplar_indices.
+    threshold: float, maximum matching distance between a file and the closest exemplar of an individual to be labelled as this individual. None to use the 90th percentile of the distance of each file of the confirmed clusters to the closest other file of its cluster (or the threshold of the existing library).
+
+    Returns
+    -------
+    library: dict, see load_library.
+    """
+    if pipe.params["similarity"] != "matching":
+        raise ValueError("The library only works with the 'matching' similarity.")
+    labels = pipe.result("cluster")
+    dist_images = pipe.result("match")
+    if sparse.issparse(dist_images):
+        dist_images = image_matching.dense_distance_matrix(
+            dist_images, pipe.params["fill_value"]
+        )
+    if individuals is None:
+        individuals = {
+            int(c): "Individual_%d" % c for c in np.unique(labels[labels >= 0])
+        }
+    unknown = [c for c in individuals if c not in labels]
+    if unknown:
+        raise ValueError("The clusters %s have no file." % unknown)
+    confirmed = np.where(np.isin(labels, list(individuals)), labels, -1)
+    exemplars = exemplar_indices(dist_images, confirmed, n_exemplars, method)
+    descriptors = [kd[1] for kd in pipe.result("detect")]
+    rows = []
+    for c, idx in exemplars.items():
+        for i in idx:
+            rows.append((str(individuals[c]), pipe.list_wavs[i], descriptors[i]))
+    if threshold is None:
+        intra_dist = []
+        for c in exemplars:
+            idx = np.nonzero(confirmed == c)[0]
+            if len(idx) > 1:
+                # On the scale of the stored descriptors, see watcher.uncompressed_distances
+                sub = watcher.uncompressed_distances(pipe, dist_images, idx)
+                sub = sub + np.diag(np.full(len(idx), np.inf))
+                intra_dist.append(np.min(sub, axis=1))
+        if intra_dist:
+            threshold = float(np.percentile(np.concatenate(intra_dist), 90))
+    params = {k: v for k, v in pipe.params.items() if k not in _unsaved_params}
+    params["pad_len"] = int(pipe.result("pad").shape[1])
+    if os.path.isfile(os.path.join(library_dir, "library.json")):
+        # The parameters of the library are kept, with the pad length of its first analysis
+        library = load_library(library_dir)
+        check_params(library, params)
+        if threshold is None:
+            threshold = library["threshold"]
+        rows = [
+            (ind, f, des)
+            for ind, f, des in zip(
+                library["exemplars"].Individual,
+                library["exemplars"].File,
+                library["descriptors"],
+            )
+        ] + rows
+    else:
+        library = {"params": params}
+    if threshold is None:
+        raise ValueError(
+            "The threshold cannot be estimated without a cluster of several files, give it."
+        )
+    library["exemplars"] = pd.DataFrame(
+        {"Individual": [r[0] for r in rows], "File": [r[1] for r in rows]}
+    )
+    library["descriptors"] = [r[2] for r in rows]
+    library["threshold"] = threshold
+    save_library(library, library_dir)
+    return library
+
+
+def nearest_individuals(
+    library, descriptors, threshold=None, n_workers=None, threads_per_worker=None
+):
+    """
+    Find the individual of the library closest to each file: each file is only matched against the exemplars of the library, see image_matching.distance_matches, so the cost is proportional to the number of files times the number of exemplars. The distance to an individual is the distance to its closest exemplar.
+
+    Parameters
+    ----------
+    library: dict, see load_library.
+    descriptors: list of 2D arrays, the descriptors of each file, see image_matching.detect_keypoints.
+    threshold: float, maximum distance to the closest individual for a file to be labelled as this individual, None for the threshold of the library.
+    n_workers: int, number of threads matching the files, see resources.resource_config.
+    threads_per_worker: int, number of threads of OpenCV in each worker, see resources.resource_config.
+
+    Returns
+    -------
+    df_ident: a pandas DataFrame with, for each file, the closest individual in "Closest_individual", the "Distance" to it (inf for the files without descriptors), the file of the closest "Exemplar" and the "Individual", the closest individual if its distance is at most threshold, "new" otherwise.
+    """
+    if threshold is None:
+        threshold = library["threshold"]
+    res_config = resources.resource_config(n_workers, threads_per_worker)
+    ex_individuals = library["exemplars"].Individual.to_numpy()
+    ex_files = library["exemplars"].File.to_numpy()
+    match_file = partial(
+        _distances_to_exemplars,
+        ex_descriptors=library["descriptors"],
+        detector_methode=library["params"]["detector_methode"],
+        n_matches=int(library["params"]["n_matches"]),
+        matcher=library["params"].get("matcher", "opencv"),
+    )
+    with ThreadPoolExecutor(max_workers=res_config["n_workers"]) as pool:
+        with resources.limit_threads(res_config["threads_per_worker"]):
+            dist_ex = np.array(list(pool.map(match_file, descriptors)), dtype=float)
+    dist_ex = dist_ex.reshape((len(descriptors), len(ex_files)))
+    if len(ex_files):
+        closest = np.argmin(dist_ex, axis=1)
+        dist = dist_ex[np.arange(len(descriptors)), closest]
+        closest_individual = ex_individuals[closest]
+        exemplar = ex_files[closest]
+    else:
+        dist = np.full(len(descriptors), np.inf)
+        closest_individual = exemplar = np.full(len(descriptors), "")
+    df_ident = pd.DataFrame(
+        {
+            "Individual": np.where(dist <= threshold, closest_individual, "new"),
+            "Closest_individual": closest_individual,
+            "Distance": dist,
+            "Exemplar": exemplar,
+        }
+    )
+    return df_ident
+
+
+def identify(
+    library_dir,
+    input_dir,
+    list_wavs=None,
+    threshold=None,
+    executor="thread",
+    n_workers=None,
+    threads_per_worker=None,
+    recursive="No",
+):
+    """
+    Label new recordings with the individuals of a reference library, see build_library. The spectrograms and descriptors of the new files are computed with the parameters of the library, then each file is matched against the exemplars only, see nearest_individuals.
+
+    Parameters
+    ----------
+    library_dir: str, path of the directory of the library.
+    input_dir: str, path of the directory containing the new sound files.
+    list_wavs: list of str, the file names to label, None for all the sound files of input_dir.
+    threshold: float, maximum matching distance to the closest individual, None for the threshold of the library.
+    executor: str, executor of the pipeline, see pipeline.Pipeline.
+    n_workers: int, number of workers, see pipeline.Pipeline.
+    threads_per_worker: int, number of threads of each worker, see pipeline.Pipeline.
+    recursive: str, "Yes" to also label the files of the subdirectories of input_dir.
+
+    Returns
+    -------
+    df_ident: a pandas DataFrame with the "File" names and their "Individual", "Closest_individual", "Distance" and "Exemplar", see nearest_individuals.
+    """
+    library = load_library(library_dir)
+    pipe = pipeline.Pipeline(
+        input_dir,
+        executor=executor,
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        list_wavs=list_wavs,
+        recursive=recursive,
+        **library["params"],
+    )
+    descriptors = [kd[1] for kd in pipe.result("detect")]
+    df_ident = nearest_individuals(
+        library,
+        descriptors,
+        threshold,
+        pipe.resources["n_workers"],
+        pipe.resources["threads_per_worker"],
+    )
+    df_ident.insert(0, "File", pipe.list_wavs)
+    return df_ident
+
+
+def check_params(library, params):
+    """
+    Check that the parameters of the analysis are the ones of the library, as the stored exemplars would not be comparable with the new files otherwise. Raise a ValueError otherwise.
+    """
+    changed = [
+        p
+        for p, v in params.items()
+        if p in library["params"]
+        and p != "pad_len"
+        and not pipeline._same(library["params"][p], v)
+    ]
+    if changed:
+        raise ValueError(
+            "The parameters %s are different from the ones of the library."
+            % ", ".join(changed)
+        )
+
+
+def load_library(library_dir):
+    """
+    Load a reference library, see build_library. Raise a ValueError if there is no library in library_dir.
+
+    Parameters
+    ----------
+    library_dir: str, path of the directory of the library.
+
+    Returns
+    -------
+    library: dict, with a pandas DataFrame with the "Individual" and "File" of each exemplar in "exemplars", their descriptors in "descriptors", the maximum matching distance to label a file as an individual in "threshold" and the parameters of the analysis in "params".
+    """
+    path = os.path.join(library_dir, "library.json")
+    if not os.path.isfile(path):
+        raise ValueError("No reference library in %s." % library_dir)
+    with open(path) as f:
+        library = json.load(f)
+    library["exemplars"] = pd.read_csv(
+        os.path.join(library_dir, "exemplars.csv"), dtype=str
+    )
+    with np.load(os.path.join(library_dir, "exemplars.npz")) as arrays:
+        library["descriptors"] = [
+            arrays["des_%d" % k] if "des_%d" % k in arrays else None
+            for k in range(len(library["exemplars"]))
+        ]
+    return library
+
+
+def save_library(library, library_dir):
+    """
+    Save a reference library, see load_library.
+    """
+    os.makedirs(library_dir, exist_ok=True)
+    library["exemplars"].to_csv(os.path.join(library_dir, "exemplars.csv"), index=False)
+    np.savez(
+        os.path.join(library_dir, "exemplars.npz"),
+        **{
+            "des_%d" % k: des
+            for k, des in enumerate(library["descriptors"])
+            if des is not None
+        },
+    )
+    with open(os.path.join(library_dir, "library.json"), "w") as f:
+        json.dump(
+            {"threshold": library["threshold"], "params": library["params"]},
+            f,
+            indent=1,
+            default=_to_json,
+        )
+
+
+def _distances_to_exemplars(
+    des, ex_descriptors, detector_methode, n_matches, matcher="opencv"
+):
+    """
+    Matching distances between the descriptors of a file and the ones of each exemplar, see watcher.distance_to_exemplar. Each call creates its own matcher, so that the files can be matched by several threads. With the "blas" matcher, the file is matched against all the exemplars at once, see image_matching.L2Matcher.
+    """
+    _, matcher = image_matching.feature_detector_matcher(
+        detector_methode, matcher=matcher
+    )
+    if isinstance(matcher, image_matching.L2Matcher):
+        return list(matcher.distances(des, ex_descriptors, n_matches))
+    return [
+        watcher.distance_to_exemplar(matcher, des, des_ex, n_matches)
+        for des_ex in ex_descriptors
+    ]
@@ -0,0 +1,121 @@
+# Split of the processors between the workers and the threads of OpenCV and of the BLAS and OpenMP libraries
+import os
+from contextlib import contextmanager
+import cv2  # opencv-python
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    # The BLAS and OpenMP threads are left unchanged without threadpoolctl
+    threadpool_limits = None
+
+
+def resource_config(n_workers=None, threads_per_worker=None, n_cpus=None):
+    """
+    Split the processors between workers (processes or threads of a pool) and the threads used inside each worker by OpenCV and by the BLAS and OpenMP libraries (numpy, scipy, scikit-learn), so that they do not oversubscribe the processors.
+    Without n_workers and threads_per_worker, one worker is used per processor, each with a single thread.
+
+    Parameters
+    ----------
+    n_workers: int, number of workers, None to use the number of processors divided by threads_per_worker.
+    threads_per_worker: int, number of threads of each worker, None to use the number of processors divided by n_workers.
+    n_cpus: int, number of processors, None to use the number of processors of the machine.
+
+    Returns
+    -------
+    resources: dict, with the number of workers in "n_workers", the number of threads of each worker in "threads_per_worker", "cv2_threads" and "blas_threads", and the number of threads of the stages running alone (clustering) in "n_jobs".
+    """
+    if n_cpus is None:
+        n_cpus = os.cpu_count() or 1
+    if n_workers is not None and int(n_workers) < 1:
+        raise ValueError("The number of workers must be at least 1.")
+    if threads_per_worker is not None and int(threads_per_worker) < 1:
+        raise ValueError("The number of threads per worker must be at least 1.")
+    if n_workers is None and threads_per_worker is None:
+        threads_per_worker = 1
+    if n_workers is None:
+        n_workers = max(1, n_cpus // int(threads_per_worker))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, n_cpus // int(n_workers))
+    n_workers = int(n_workers)
+    threads_per_worker = int(threads_per_worker)
+    return {
+        "n_workers": n_workers,
+        "threads_per_worker": threads_per_worker,
+        "cv2_threads": threads_per_worker,
+        "blas_threads": threads_per_worker,
+        "n_jobs": n_workers * threads_per_worker,
+    }
+
+
+def parse_resources(text):
+    """
+    Read a resource configuration written as "auto", "n_workers" or "n_workers x threads_per_worker" (e.g. "4x2"), as given on the command line or in the GUI.
+
+    Parameters
+    ----------
+    text: str, the resource configuration.
+
+    Returns
+    -------
+    n_workers: int, number of workers, None for "auto".
+    threads_per_worker: int, number of threads of each worker, None if not given.
+    """
+    text = str(text).strip().lower().replace(" ", "")
+    if text in ["", "auto"]:
+        return None, None
+    parts = text.split("x")
+    try:
+        values = [int(v) for v in parts]
+    except ValueError:
+        values = []
+    if len(values) not in [1, 2] or min(values) < 1:
+        raise ValueError(
+            "The resources must be 'auto', 'n_workers' or 'n_workers x threads_per_worker', not '%s'."
+            % text
+        )
+    if len(values) == 1:
+        return values[0], None
+    return values[0], values[1]
+
+
+@contextmanager
+def limit_threads(n_threads):
+    """
+    Context manager limiting the number of threads used by OpenCV and by the BLAS and OpenMP libraries of the current process, the previous settings being restored afterwards.
+
+    Parameters
+    ----------
+    n_threads: int, maximum number of threads, None to leave the settings unchanged.
+    """
+    if n_threads is None:
+        yield
+        return
+    previous_threads = cv2.getNumThreads()
+    cv2.setNumThreads(int(n_threads))
+    try:
+        if threadpool_limits is None:
+            yield
+        else:
+            with threadpool_limits(limits=int(n_threads)):
+                yield
+    finally:
+        cv2.setNumThreads(previous_threads)
+
+
+def init_worker(n_threads):
+    """
+    Initializer of the worker processes of a pool: limit the number of threads used by OpenCV and by the BLAS and OpenMP libraries for the whole life of the process.
+
+    Parameters
+    ----------
+    n_threads: int, maximum number of threads, None to leave the settings unchanged.
+    """
+    if n_threads is None:
+        return
+    # Libraries imported later by the worker read these variables
+    for var in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[var] = str(int(n_threads))
+    cv2.setNumThreads(int(n_threads))
+    if threadpool_limits is not None:
+        threadpool_limits(limits=int(n_threads))
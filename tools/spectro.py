@@ -1,8 +1,10 @@
 # Function to calculate images based on the STFT (Short-time Fourier transform) and envelope spectrogram
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as sp_fft
+from scipy import sparse
 from scipy.signal import hilbert, ShortTimeFFT
 from scipy.signal.windows import hamming
-from PIL import Image
 
 
 def draw_specs(
@@ -65,17 +67,27 @@ def draw_specs(
 def calc_env(signal):
     """
     Calculate the envelope of a 1D signal using the hilbert transform,
-    see scipy.signal.hilbert.
+    see scipy.signal.hilbert. A float 32 bits signal is transformed in single precision (complex64).
 
     Parameters
     ----------
-    signal: 1D array, the signal.
+    signal: 1D array, the signal (or 2D array, one signal per row).
 
     Returns
     ------
     env: 1D array, the signal envelope.
     """
-    env = abs(hilbert(signal))
+    if signal.dtype != np.float32:
+        env = abs(hilbert(signal))
+        return env
+    # Same as scipy.signal.hilbert, which computes in double precision
+    n = signal.shape[-1]
+    h = np.zeros(n, dtype=np.float32)
+    h[0] = 1
+    h[1 : (n + 1) // 2] = 2
+    if n % 2 == 0:
+        h[n // 2] = 1
+    env = abs(sp_fft.ifft(sp_fft.fft(signal, axis=-1) * h, axis=-1))
     return env
 
 
@@ -93,12 +105,345 @@ def resize_merge_spec(spec1, spec2):
     merged_spec: 2D array, with the two arrays resized and merged.
 
     """
-    s1 = spec1.shape
-    s2 = spec2.shape
-    spec1 /= np.max(spec1)
-    spec2 /= np.max(spec2)
-    final_shape = (max([s1[1], s2[1]]), max([s1[0], s2[0]]))
-    rs_spec1 = np.array(Image.fromarray(spec1).resize(final_shape, Image.LANCZOS))
-    rs_spec2 = np.array(Image.fromarray(spec2).resize(final_shape, Image.LANCZOS))
-    merged_spec = np.vstack((rs_spec1, rs_spec2))
+    merged_spec = resize_merge_stack(spec1[np.newaxis], spec2[np.newaxis])[0]
     return merged_spec
+
+
+def draw_specs_stack(
+    signals,
+    win_len,
+    overlap,
+    win_len_env,
+    overlap_env,
+    sf,
+    freqs_of_interest,
+    dtype=np.uint8,
+    out=None,
+    chunk_size=64,
+    stream_len=2**20,
+):
+    """
+    Same as draw_specs but for several signals of the same length at once, e.g. the result of utils.pad_signals. The STFTs are computed for chunk_size signals together and the combined spectrograms are written in a single 3D array. Signals longer than stream_len samples are transformed one by one and block by block, see draw_specs_stream. Float 32 bits signals are transformed in single precision (complex64 STFTs), see stft_magnitude.
+
+    Parameters
+    ----------
+    signals: 2D array, one signal per row.
+    win_len: int, window length of the stft performed on the signal.
+    overlap: float, overlap (in %) of the stft performed on the signal.
+    win_len_env: int, window length of the stft performed on the envelope.
+    overlap_env: float, overlap (in %) of the stft performed on the envelope.
+    sf: int, sampling frequency.
+    freqs_of_interest: a length-2 list, containing the cut-ofrequencies [low,high] of the frequencies of interest, the frequencies outside this band will be excluded.
+    dtype: numpy dtype of the output, np.uint8 to get the spectrograms directly as 8-bit images (see image_matching.transfo_8bits) or np.float32.
+    out: 3D array, preallocated output of shape (number of signals, height, width), None to allocate it.
+    chunk_size: int, number of signals transformed together, to bound the memory used by the STFTs.
+    stream_len: int, number of samples above which the signals are transformed block by block.
+
+    Returns
+    -------
+    spec_stack: 3D array, the combined spectrogram of each signal.
+    """
+    signals = np.atleast_2d(signals)
+    if signals.shape[1] > stream_len:
+        for k, signal in enumerate(signals):
+            spec = draw_specs_stream(
+                signal,
+                win_len,
+                overlap,
+                win_len_env,
+                overlap_env,
+                sf,
+                freqs_of_interest,
+                dtype,
+                None if out is None else out[k],
+            )
+            if out is None:
+                out = np.empty((len(signals),) + spec.shape, dtype=dtype)
+                out[0] = spec
+        return out
+    if len(signals) > chunk_size:
+        for k in range(0, len(signals), chunk_size):
+            chunk = draw_specs_stack(
+                signals[k : k + chunk_size],
+                win_len,
+                overlap,
+                win_len_env,
+                overlap_env,
+                sf,
+                freqs_of_interest,
+                dtype,
+                None if out is None else out[k : k + chunk_size],
+                chunk_size,
+            )
+            if out is None:
+                out = np.empty((len(signals),) + chunk.shape[1:], dtype=dtype)
+                out[:chunk_size] = chunk
+        return out
+    ovlp = overlap / 100
+    ovlp_env = overlap_env / 100
+    window = hamming(win_len, sym=True)
+    st_ft = ShortTimeFFT(window, hop=int((1 - ovlp) * win_len), fs=sf)
+    window_env = hamming(win_len_env, sym=True)
+    st_ft_env = ShortTimeFFT(window_env, hop=int((1 - ovlp_env) * win_len_env), fs=sf)
+    f_mask = np.logical_and(
+        freqs_of_interest[0] < st_ft.f, st_ft.f < freqs_of_interest[1]
+    )
+    spec = stft_magnitude(st_ft, signals, f_mask)
+    env = calc_env(signals)
+    spec_env = stft_magnitude(st_ft_env, env, st_ft_env.f <= 160)
+    spec_stack = resize_merge_stack(spec, spec_env, dtype, out)
+    return spec_stack
+
+
+def draw_specs_stream(
+    signal,
+    win_len,
+    overlap,
+    win_len_env,
+    overlap_env,
+    sf,
+    freqs_of_interest,
+    dtype=np.float32,
+    out=None,
+    block_len=2**16,
+    margin=1024,
+):
+    """
+    Same as draw_specs, but with a memory bounded by block_len instead of the length of the signal, for long recordings (the signal can be memory-mapped).
+    The STFTs are computed block of frames by block of frames (using the p0 and p1 arguments of ShortTimeFFT.stft) and only the magnitude of the frequencies kept is written in preallocated float 32 bits spectrograms. The envelope is computed on each block only, with a Hilbert transform of the block extended by margin samples on each side (overlap-save), which gives the same envelope as the Hilbert transform of the whole signal up to a small error.
+
+    Parameters
+    ----------
+    signal: 1D array, signal of interest.
+    win_len: int, window length of the stft performed on the signal.
+    overlap: float, overlap (in %) of the stft performed on the signal.
+    win_len_env: int, window length of the stft performed on the envelope.
+    overlap_env: float, overlap (in %) of the stft performed on the envelope.
+    sf: int, sampling frequency.
+    freqs_of_interest: a length-2 list, containing the cut-ofrequencies [low,high] of the frequencies of interest, the frequencies outside this band will be excluded.
+    dtype: numpy dtype of the output, np.float32 or np.uint8 to get the spectrogram directly as an 8-bit image (see image_matching.transfo_8bits).
+    out: 2D array, preallocated output, None to allocate it.
+    block_len: int, approximate number of samples transformed at once.
+    margin: int, number of samples added on each side of a block to compute its envelope.
+
+    Returns
+    -------
+    spec_comb = 2D array, with the two 2D arrays resulting from the STFTs resized and merged.
+    """
+    ovlp = overlap / 100
+    ovlp_env = overlap_env / 100
+    window = hamming(win_len, sym=True)
+    st_ft = ShortTimeFFT(window, hop=int((1 - ovlp) * win_len), fs=sf)
+    window_env = hamming(win_len_env, sym=True)
+    st_ft_env = ShortTimeFFT(window_env, hop=int((1 - ovlp_env) * win_len_env), fs=sf)
+    f_mask = np.logical_and(
+        freqs_of_interest[0] < st_ft.f, st_ft.f < freqs_of_interest[1]
+    )
+    spec = _stream_stft(
+        st_ft,
+        lambda s0, s1: _signal_block(signal, s0, s1),
+        len(signal),
+        f_mask,
+        block_len,
+    )
+    spec_env = _stream_stft(
+        st_ft_env,
+        lambda s0, s1: _env_block(signal, s0, s1, margin),
+        len(signal),
+        st_ft_env.f <= 160,
+        block_len,
+    )
+    spec_comb = resize_merge_stack(
+        spec[np.newaxis],
+        spec_env[np.newaxis],
+        dtype,
+        None if out is None else out[np.newaxis],
+    )[0]
+    return spec_comb
+
+
+def stft_magnitude(st_ft, x, f_mask, p0=None, p1=None):
+    """
+    Magnitude of the STFT of the signals along the last axis of x, for the frequencies in f_mask, see scipy.signal.ShortTimeFFT.stft. ShortTimeFFT always computes in double precision, so for float 32 bits signals the frames are taken as a strided view of the signals and transformed together with scipy.fft.rfft, in complex64.
+
+    Parameters
+    ----------
+    st_ft: scipy.signal.ShortTimeFFT, with the default "onesided" FFT mode and no scaling.
+    x: 1D or 2D array, the signal, or one signal per row.
+    f_mask: 1D array of bool, the frequencies kept (see ShortTimeFFT.f).
+    p0, p1: int, the first and last (excluded) frames, None for all the frames, see ShortTimeFFT.stft.
+
+    Returns
+    -------
+    spec: 2D or 3D array, the magnitude of the STFT of shape (..., number of frequencies kept, number of frames), in float 32 bits for float 32 bits signals.
+    """
+    if x.dtype != np.float32:
+        return abs(st_ft.stft(x, p0, p1, axis=-1)[..., f_mask, :])
+    n = x.shape[-1]
+    p0, p1 = st_ft.p_range(n, p0, p1)
+    hop = st_ft.hop
+    # Samples of the frames, with 0s outside of the signal
+    k0 = p0 * hop - st_ft.m_num_mid
+    k1 = (p1 - 1) * hop - st_ft.m_num_mid + st_ft.m_num
+    i0, i1 = max(k0, 0), min(k1, n)
+    pad_width = [(0, 0)] * (x.ndim - 1) + [(i0 - k0, k1 - i1)]
+    x_pad = np.pad(x[..., i0:i1], pad_width)
+    frames = sliding_window_view(x_pad, st_ft.m_num, axis=-1)[..., ::hop, :]
+    s = sp_fft.rfft(frames * st_ft.win.astype(np.float32), n=st_ft.mfft, axis=-1)
+    spec = np.swapaxes(abs(s[..., f_mask]), -1, -2)
+    return spec
+
+
+def _stream_stft(st_ft, get_block, n, f_mask, block_len):
+    """
+    Magnitude of the STFT of a signal of n samples for the frequencies in f_mask, computed by blocks of frames. get_block(s0, s1) returns the samples s0 to s1 of the signal, with 0s outside of the signal.
+    """
+    p_min, p_max = st_ft.p_min, st_ft.p_max(n)
+    spec = np.empty((np.count_nonzero(f_mask), p_max - p_min), dtype=np.float32)
+    hop = st_ft.hop
+    # Number of frames starting before the first sample of a block
+    lead = -(-st_ft.m_num_mid // hop)
+    frames_per_block = max(block_len // hop, 1)
+    for p0 in range(p_min, p_max, frames_per_block):
+        p1 = min(p0 + frames_per_block, p_max)
+        # The block starts on a frame, so its frames are the ones of the signal shifted by q
+        q = p0 - lead
+        s0 = q * hop
+        s1 = (p1 - 1) * hop - st_ft.m_num_mid + st_ft.m_num
+        spec[:, p0 - p_min : p1 - p_min] = stft_magnitude(
+            st_ft, get_block(s0, s1), f_mask, p0 - q, p1 - q
+        )
+    return spec
+
+
+def _signal_block(signal, s0, s1):
+    """
+    Samples s0 to s1 of a signal, with 0s outside of the signal, in float 32 bits for a float 32 bits signal and 64 bits otherwise.
+    """
+    block = np.zeros(s1 - s0, dtype=_float_dtype(signal))
+    a, b = max(s0, 0), min(s1, len(signal))
+    if b > a:
+        block[a - s0 : b - s0] = signal[a:b]
+    return block
+
+
+def _env_block(signal, s0, s1, margin):
+    """
+    Envelope of the samples s0 to s1 of a signal, computed on the block extended by margin samples on each side, with 0s outside of the signal.
+    """
+    dtype = _float_dtype(signal)
+    block = np.zeros(s1 - s0, dtype=dtype)
+    a, b = max(s0, 0), min(s1, len(signal))
+    if b > a:
+        a_ext, b_ext = max(a - margin, 0), min(b + margin, len(signal))
+        env = calc_env(np.asarray(signal[a_ext:b_ext], dtype=dtype))
+        block[a - s0 : b - s0] = env[a - a_ext : b - a_ext]
+    return block
+
+
+def _float_dtype(signal):
+    """
+    Float dtype used to compute on a signal: float 32 bits for a float 32 bits signal, 64 bits otherwise.
+    """
+    return np.float32 if signal.dtype == np.float32 else np.float64
+
+
+def resize_merge_stack(specs1, specs2, dtype=np.float32, out=None):
+    """
+    Resize and merge two stacks of 2D arrays, here the results of two STFTs on several signals. As all the arrays of a stack have the same shape, the LANCZOS resizing is done with two precomputed resampling matrices applied to the whole stack (see resampling_matrix).
+
+    Parameters
+    ----------
+    specs1: 3D array, first spectrogram of each signal.
+    specs2: 3D array, second spectrogram of each signal.
+    dtype: numpy dtype of the output. With np.uint8, each merged array is normalized by its maximum and converted in 8 bits, see image_matching.transfo_8bits.
+    out: 3D array, preallocated output, None to allocate it.
+
+    Returns
+    -------
+    merged_specs: 3D array, with the arrays of both stacks resized and merged.
+    """
+    s1 = specs1.shape[1:]
+    s2 = specs2.shape[1:]
+    height = max([s1[0], s2[0]])
+    width = max([s1[1], s2[1]])
+    if out is None:
+        out = np.empty((len(specs1), 2 * height, width), dtype=dtype)
+    merged = out if out.dtype == np.float32 else np.empty(out.shape, np.float32)
+    for specs, rows in [(specs1, slice(0, height)), (specs2, slice(height, None))]:
+        # Normalisation by the maximum of each spectrogram, silent ones stay at 0
+        maxi = np.max(specs, axis=(1, 2), keepdims=True)
+        specs = np.divide(
+            specs,
+            maxi,
+            out=np.zeros(specs.shape, np.result_type(specs, np.float32)),
+            where=maxi > 0,
+        )
+        # Float 32 bits spectrograms are resized in single precision
+        r_height = resampling_matrix(specs.shape[1], height).toarray()
+        r_height = r_height.astype(specs.dtype, copy=False)
+        r_width = resampling_matrix(specs.shape[2], width).astype(specs.dtype)
+        if specs.shape[2] * width <= 2**22:
+            merged[:, rows] = r_height @ specs @ r_width.toarray().T
+        else:
+            # Long spectrograms: the banded resampling matrix is kept sparse
+            resized = (r_width @ specs.reshape(-1, specs.shape[2]).T).T
+            merged[:, rows] = r_height @ resized.reshape(len(specs), -1, width)
+    if merged is not out:
+        transfo_8bits_stack(merged, out)
+    return out
+
+
+def transfo_8bits_stack(stack, out=None):
+    """
+    Convert a stack of 2D arrays in 8-bit unsigned integers, each array being normalized by its maximum, see image_matching.transfo_8bits. The conversion is vectorized on the whole stack and done in place in stack (which must be in float).
+
+    Parameters
+    ----------
+    stack: 3D array, the arrays to convert, modified in place.
+    out: 3D array of 8-bit unsigned integers, preallocated output, None to allocate it.
+
+    Returns
+    -------
+    stack_8bits: 3D array of 8-bit unsigned integers.
+    """
+    maxi = np.max(stack, axis=(1, 2), keepdims=True)
+    np.divide(stack, maxi, out=stack, where=maxi > 0)
+    np.multiply(stack, 255, out=stack)
+    np.abs(stack, out=stack)
+    if out is None:
+        out = np.empty(stack.shape, dtype=np.uint8)
+    np.copyto(out, stack, casting="unsafe")
+    return out
+
+
+def resampling_matrix(in_size, out_size):
+    """
+    Matrix resizing an axis of an array from in_size to out_size samples using a LANCZOS filter (same filter and coefficients as PIL.Image.LANCZOS). Resizing a 2D array arr to (new_height, new_width) is done with resampling_matrix(height, new_height) @ arr @ resampling_matrix(width, new_width).T, the matrices being converted to dense arrays (toarray) for small sizes
+
+    Parameters
+    ----------
+    in_size: int, the size of the axis.
+    out_size: int, the new size.
+
+    Returns
+    -------
+    mat: scipy sparse matrix (CSR) of shape (out_size, in_size), each row only having a few non-zero coefficients around its center.
+    """
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 3.0 * filterscale
+    # Same computation as PIL for all the rows at once, each row having at most n_coefs coefficients
+    center = (np.arange(out_size) + 0.5) * scale
+    xmin = np.maximum((center - support + 0.5).astype(int), 0)
+    xmax = np.minimum((center + support + 0.5).astype(int), in_size)
+    n_coefs = int(np.max(xmax - xmin))
+    cols = xmin[:, np.newaxis] + np.arange(n_coefs)
+    valid = cols < xmax[:, np.newaxis]
+    x = (cols - center[:, np.newaxis] + 0.5) / filterscale
+    w = np.where(valid, np.sinc(x) * np.sinc(x / 3) * (np.abs(x) < 3), 0)
+    w /= np.sum(w, axis=1, keepdims=True)
+    mat = sparse.csr_matrix(
+        (w[valid], (np.nonzero(valid)[0], cols[valid])), shape=(out_size, in_size)
+    )
+    return mat
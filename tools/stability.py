@@ -0,0 +1,208 @@
+# Stability of the clusters, estimated by clustering subsamples of the files
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from . import image_matching, resources
+
+# Distances or embeddings shared by the replicates of a worker process, see _init_replicates
+_shared = {}
+
+
+def cluster_stability(
+    dist_images,
+    labels,
+    clustering_name="Affinity Propagation",
+    n_replicates=100,
+    sample_fraction=0.8,
+    embeddings=False,
+    fill_value=None,
+    executor="process",
+    n_workers=None,
+    threads_per_worker=None,
+    block_rows=1024,
+    random_state=0,
+):
+    """
+    Estimate the stability of a clustering by subsampling the files: for each replicate, a random subset of the files is clustered again from the rows and columns of the distance matrix already computed (see image_matching.distance_matrix), without matching the spectrograms again.
+    The replicates are clustered in parallel. The number of times each pair of files is sampled together and clustered together is accumulated from sparse one-hot matrices of the replicates, by blocks of rows, so that the memory used does not depend on the number of replicates.
+
+    Parameters
+    ----------
+    dist_images: 2D array or scipy sparse matrix, the distance matrix between the files, see image_matching.clustering_matches. With embeddings, one row per file, see embedding.encode_spectros.
+    labels: 1D array, the cluster label of each file found on all the files, see image_matching.clustering_matches.
+    clustering_name: str, name of the clustering, see image_matching.clustering_matches.
+    n_replicates: int, number of subsamples clustered.
+    sample_fraction: float, fraction of the files of each subsample, drawn without replacement.
+    embeddings: bool, True if dist_images has one embedding per row, subsampled on the rows only.
+    fill_value: float, distance of the pairs missing from a sparse dist_images, see image_matching.clustering_matches.
+    executor: str, "serial", "thread" or "process", to cluster the replicates.
+    n_workers: int, number of workers, see resources.resource_config.
+    threads_per_worker: int, number of threads of each worker, see resources.resource_config.
+    block_rows: int, number of rows of the co-assignment matrix computed at once.
+    random_state: int, seed of the subsampling.
+
+    Returns
+    -------
+    dict_stab: a dict with the following keys:
+    "coassignment", a 2D array of float 32 bits of shape (number of files, number of files), the fraction of the replicates sampling both files in which they are in the same cluster (NaN if they are never sampled together),
+    "clusters", a pandas DataFrame with, for each "Cluster" of labels, its "Number_of_files", its "Stability" (mean over the replicates of the highest Jaccard similarity between the sampled files of the cluster and a cluster of the replicate) and its "Cohesion" (mean co-assignment of the pairs of files of the cluster),
+    "files", a pandas DataFrame with, for each file, its "Cluster" and its "Stability" (mean co-assignment with the other files of its cluster, NaN for a cluster of a single file).
+    """
+    labels = np.asarray(labels)
+    n_files = len(labels)
+    if not 0 < sample_fraction <= 1:
+        raise ValueError("The sample fraction must be in ]0, 1].")
+    n_sampled = max(2, int(round(sample_fraction * n_files)))
+    if n_sampled > n_files:
+        raise ValueError("At least 2 files are needed to estimate the stability.")
+    rng = np.random.default_rng(random_state)
+    samples = [
+        np.sort(rng.choice(n_files, n_sampled, replace=False))
+        for _ in range(n_replicates)
+    ]
+    if sparse.issparse(dist_images):
+        dist_images = sparse.csr_matrix(dist_images)
+    args = (dist_images, clustering_name, embeddings, fill_value)
+    res_config = resources.resource_config(
+        1 if executor == "serial" else n_workers, threads_per_worker
+    )
+    threads = res_config["threads_per_worker"]
+    if executor == "serial":
+        _shared["args"] = args
+        try:
+            with resources.limit_threads(threads):
+                list_labels = [_replicate_labels(s, threads) for s in samples]
+        finally:
+            _shared.pop("args", None)
+    elif executor in ["thread", "process"]:
+        if executor == "process":
+            pool = ProcessPoolExecutor(
+                max_workers=res_config["n_workers"],
+                initializer=_init_replicates,
+                initargs=(args, threads),
+            )
+        else:
+            _shared["args"] = args
+            pool = ThreadPoolExecutor(max_workers=res_config["n_workers"])
+        try:
+            with pool, resources.limit_threads(threads):
+                list_labels = list(
+                    pool.map(_replicate_labels, samples, [threads] * len(samples))
+                )
+        finally:
+            _shared.pop("args", None)
+    else:
+        raise ValueError("The executor must be 'serial', 'thread' or 'process'.")
+    # One-hot matrices of the samples and of the clusters of the replicates, one row per sample or cluster
+    sampled = _one_hot(
+        samples, [np.zeros(n_sampled, dtype=int)] * len(samples), n_files
+    )
+    assigned = _one_hot(samples, list_labels, n_files)
+    clusters, ref_index = np.unique(labels, return_inverse=True)
+    ref_index = ref_index.reshape(-1)
+    coassignment = np.empty((n_files, n_files), dtype=np.float32)
+    file_stability = np.empty(n_files)
+    for start in range(0, n_files, block_rows):
+        stop = min(start + block_rows, n_files)
+        n_together = (sampled[:, start:stop].T @ sampled).toarray()
+        n_same = (assigned[:, start:stop].T @ assigned).toarray()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            block = n_same / n_together
+        coassignment[start:stop] = block
+        # Mean co-assignment with the other files of the same cluster
+        same = ref_index[start:stop, None] == ref_index[None, :]
+        same[np.arange(stop - start), np.arange(start, stop)] = False
+        same &= n_together > 0
+        with np.errstate(invalid="ignore"):
+            file_stability[start:stop] = np.sum(
+                np.where(same, block, 0), axis=1
+            ) / np.sum(same, axis=1)
+    # Jaccard similarity between each cluster and its best match in each replicate
+    jaccard = np.zeros((len(clusters), n_replicates))
+    n_drawn = np.zeros((len(clusters), n_replicates))
+    for r, (s, lab) in enumerate(zip(samples, list_labels)):
+        ref = ref_index[s]
+        _, rep_index = np.unique(lab, return_inverse=True)
+        rep_index = rep_index.reshape(-1)
+        # Files left as noise (-1) by the clustering belong to no cluster
+        rep_index = np.where(lab >= 0, rep_index, -1)
+        n_rep = rep_index.max() + 1 if len(rep_index) else 0
+        kept = rep_index >= 0
+        inter = np.zeros((len(clusters), max(n_rep, 1)))
+        np.add.at(inter, (ref[kept], rep_index[kept]), 1)
+        size_ref = np.bincount(ref, minlength=len(clusters))
+        size_rep = np.bincount(rep_index[kept], minlength=max(n_rep, 1))
+        union = size_ref[:, None] + size_rep[None, :] - inter
+        with np.errstate(invalid="ignore", divide="ignore"):
+            jaccard[:, r] = np.max(np.where(union > 0, inter / union, 0), axis=1)
+        n_drawn[:, r] = size_ref
+    with np.errstate(invalid="ignore"):
+        stability = np.sum(jaccard * (n_drawn > 0), axis=1) / np.sum(
+            n_drawn > 0, axis=1
+        )
+    valid = ~np.isnan(file_stability)
+    with np.errstate(invalid="ignore"):
+        cohesion = np.bincount(
+            ref_index[valid], file_stability[valid], minlength=len(clusters)
+        ) / np.bincount(ref_index[valid], minlength=len(clusters))
+    df_clusters = pd.DataFrame(
+        {
+            "Cluster": clusters,
+            "Number_of_files": np.bincount(ref_index),
+            "Stability": stability,
+            "Cohesion": cohesion,
+        }
+    )
+    df_files = pd.DataFrame({"Cluster": labels, "Stability": file_stability})
+    dict_stab = {
+        "coassignment": coassignment,
+        "clusters": df_clusters,
+        "files": df_files,
+    }
+    return dict_stab
+
+
+def _one_hot(samples, list_labels, n_files):
+    """
+    Sparse matrix with one row per cluster of each replicate and one column per file, 1 if the file is in the cluster. The files left as noise (-1) are in no cluster.
+    """
+    rows = []
+    cols = []
+    offset = 0
+    for s, lab in zip(samples, list_labels):
+        lab = np.asarray(lab)
+        kept = lab >= 0
+        _, index = np.unique(lab[kept], return_inverse=True)
+        rows.append(offset + index.reshape(-1))
+        cols.append(s[kept])
+        offset += index.max() + 1 if len(index) else 0
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(max(offset, 1), n_files),
+    )
+
+
+def _init_replicates(args, threads):
+    """
+    Initializer of the worker processes: the distances are sent once per worker.
+    """
+    resources.init_worker(threads)
+    _shared["args"] = args
+
+
+def _replicate_labels(sample, n_jobs):
+    """
+    Cluster the files of a subsample, see cluster_stability.
+    """
+    dist_images, clustering_name, embeddings, fill_value = _shared["args"]
+    if embeddings:
+        data = dist_images[sample]
+    else:
+        data = dist_images[sample][:, sample]
+    return image_matching.clustering_matches(
+        data, clustering_name, fill_value=fill_value, n_jobs=n_jobs
+    )
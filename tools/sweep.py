@@ -0,0 +1,291 @@
+# Parameter sweep sharing the upstream stages between configurations
+import itertools
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+import numpy as np
+import pandas as pd
+from sklearn.metrics import silhouette_score
+
+from . import utils, filtering, spectro, image_matching, pop_estimation, resources
+
+# Default values for rock ptarmigan, same as the GUI
+default_sweep_params = {
+    "wlt_filt": "Yes",
+    "f_filt": (950, 2800),
+    "wlen": 281,
+    "ovlp": 75,
+    "wlen_env": 706,
+    "ovlp_env": 90,
+    "n_matches": 53,
+    "detector_methode": "ORB custom",
+    "clustering": "Affinity Propagation",
+}
+
+# Parameters defining each stage of the analysis, the parameters of a stage include the ones of its parent stage
+stage_params = {
+    "import": ["f_filt"],
+    "filter": ["f_filt", "wlt_filt"],
+    "spectro": ["wlen", "ovlp", "wlen_env", "ovlp_env"],
+    "keypoints": ["detector_methode"],
+    "distances": ["n_matches"],
+    "clusters": ["clustering"],
+}
+stage_order = ["import", "filter", "spectro", "keypoints", "distances", "clusters"]
+
+
+def parameter_grid(grid):
+    """
+    Get all the combinations of parameters from a grid of parameters.
+
+    Parameters
+    ----------
+    grid: dict, with the name of the parameters as keys (see default_sweep_params) and a list of values to test for each parameter. The parameters absent from the grid take their default values.
+
+    Returns
+    -------
+    list_configs: list of dict, each dict being a complete configuration of the analysis.
+    """
+    unknown = [k for k in grid if k not in default_sweep_params]
+    if unknown:
+        raise ValueError("Unknown parameters in the grid: %s" % ", ".join(unknown))
+    names = list(grid)
+    list_configs = []
+    for values in itertools.product(*[grid[n] for n in names]):
+        config = dict(default_sweep_params)
+        config.update(zip(names, values))
+        config["f_filt"] = tuple(config["f_filt"])
+        list_configs.append(config)
+    return list_configs
+
+
+def build_stage_graph(list_configs):
+    """
+    Build the graph of stages needed to run all the configurations. Two configurations share a stage (and all its parent stages) when they have the same parameters up to this stage, so each distinct stage is only computed once.
+
+    Parameters
+    ----------
+    list_configs: list of dict, the configurations, see parameter_grid.
+
+    Returns
+    -------
+    nodes: dict, with the key of each distinct stage as keys and a tuple (stage name, key of the parent stage, parameters of the stage) as values.
+    config_nodes: list, the key of the final stage (clustering) of each configuration.
+    """
+    nodes = {}
+    config_nodes = []
+    for config in list_configs:
+        parent = None
+        for stage in stage_order:
+            params = tuple((p, config[p]) for p in stage_params[stage])
+            if stage == "import":
+                # The import only depends on the highest frequency
+                params = (("high_f", config["f_filt"][1]),)
+            key = (parent, stage, params)
+            if key not in nodes:
+                nodes[key] = (stage, parent, dict(params))
+            parent = key
+        config_nodes.append(parent)
+    return nodes, config_nodes
+
+
+def run_stage(stage, parent_result, params, list_wavs, input_dir, config, n_jobs=1):
+    """
+    Run a single stage of the analysis.
+
+    Parameters
+    ----------
+    stage: str, name of the stage, see stage_order.
+    parent_result: the result of the parent stage, None for the import.
+    params: dict, the parameters of the stage.
+    list_wavs: list of str, list of WAV file names.
+    input_dir: str, path of the directory containing the files.
+    config: dict, a configuration using this stage, used to get the parameters of the parent stages.
+    n_jobs: int, number of processes used by the clustering, see image_matching.clustering_matches.
+
+    Returns
+    -------
+    result: the result of the stage.
+    """
+    if stage == "import":
+        list_arr, sf = utils.import_wavs(list_wavs, input_dir, params["high_f"])
+        result = (list_arr, sf)
+    elif stage == "filter":
+        list_arr, sf = parent_result
+        band_freq = list(params["f_filt"])
+        list_arr_filt = [filtering.butterfilter(a, sf, band_freq) for a in list_arr]
+        if params["wlt_filt"] == "Yes":
+            list_arr_filt = [filtering.wlt_denoise(a) for a in list_arr_filt]
+        result = (utils.pad_signals(list_arr_filt), sf)
+    elif stage == "spectro":
+        arr_filt, sf = parent_result
+        result = spectro.draw_specs_stack(
+            arr_filt,
+            int(params["wlen"]),
+            int(params["ovlp"]),
+            int(params["wlen_env"]),
+            int(params["ovlp_env"]),
+            sf,
+            list(config["f_filt"]),
+            dtype=np.uint8,
+        )
+    elif stage == "keypoints":
+        # Only the descriptors are kept, keypoints cannot be sent between processes
+        kp_desc, _ = image_matching.detect_keypoints(
+            parent_result, params["detector_methode"], executor="serial"
+        )
+        result = [kd[1] for kd in kp_desc]
+    elif stage == "distances":
+        _, matcher = image_matching.feature_detector_matcher(config["detector_methode"])
+        result = image_matching.distance_matrix(
+            parent_result, matcher, int(params["n_matches"])
+        )
+    elif stage == "clusters":
+        labels = image_matching.clustering_matches(
+            parent_result, clustering_name=params["clustering"], n_jobs=n_jobs
+        )
+        n_clust = len(np.unique(labels))
+        if 1 < n_clust < len(labels):
+            sil = silhouette_score(parent_result, labels)
+        else:
+            sil = np.nan
+        result = (labels, sil)
+    return result
+
+
+def run_sweep(
+    list_wavs,
+    input_dir,
+    grid,
+    executor="process",
+    n_workers=None,
+    threads_per_worker=None,
+    date_pattern="default",
+    date_format=None,
+):
+    """
+    Run the analysis for all the combinations of a grid of parameters. The stages are shared between configurations: the import, filtering and wavelet denoising are made once per frequency band, the spectrograms once per window setting, the keypoints once per feature extraction algorithm and the distances once per number of matches. The distinct stages are executed in parallel as soon as their parent stage is done.
+
+    Parameters
+    ----------
+    list_wavs: list of str, list of WAV file names.
+    input_dir: str, path of the directory containing the files.
+    grid: dict, with the name of the parameters as keys and a list of values to test for each parameter, see parameter_grid.
+    executor: str, "process" to run the stages in a pool of processes, "thread" for a pool of threads or "serial" to run them one after the other.
+    n_workers: int, number of workers of the pool, None to use the number of processors divided by threads_per_worker.
+    threads_per_worker: int, number of threads used by OpenCV, the BLAS libraries and the clustering in each worker, None to use the number of processors divided by n_workers (1 if both are None), see resources.resource_config.
+    date_pattern: str, pattern of the dates in the filenames, see pop_estimation.parse_filename_dates.
+    date_format: str, format of the dates captured by date_pattern, see pop_estimation.parse_filename_dates.
+
+    Returns
+    -------
+    df_sweep: a pandas DataFrame with one row per configuration, containing the parameters, the number of clusters in "Number_of_clusters", the silhouette score in "Silhouette", and the estimated number of individuals using the PI and the PIC in "Individuals_PI" and "Individuals_PIC" (NaN if the filenames do not contain dates).
+    """
+    list_configs = parameter_grid(grid)
+    nodes, config_nodes = build_stage_graph(list_configs)
+    # A configuration using each node, to get the parameters of the parent stages
+    node_config = {}
+    for config, last in zip(list_configs, config_nodes):
+        key = last
+        while key is not None:
+            node_config.setdefault(key, config)
+            key = nodes[key][1]
+    results = {}
+    # A serial sweep gives all the threads to its single worker
+    res_config = resources.resource_config(
+        1 if executor == "serial" else n_workers, threads_per_worker
+    )
+    threads = res_config["threads_per_worker"]
+    if executor == "serial":
+        # Nodes are created in topological order
+        with resources.limit_threads(threads):
+            for key, (stage, parent, params) in nodes.items():
+                results[key] = run_stage(
+                    stage,
+                    results.get(parent),
+                    params,
+                    list_wavs,
+                    input_dir,
+                    node_config[key],
+                    threads,
+                )
+    else:
+        if executor == "process":
+            pool = ProcessPoolExecutor(
+                max_workers=res_config["n_workers"],
+                initializer=resources.init_worker,
+                initargs=(threads,),
+            )
+        else:
+            pool = ThreadPoolExecutor(max_workers=res_config["n_workers"])
+        children = {key: [] for key in nodes}
+        for key, (_, parent, _) in nodes.items():
+            if parent is not None:
+                children[parent].append(key)
+        with pool, resources.limit_threads(threads):
+
+            def submit(key):
+                stage, parent, params = nodes[key]
+                return pool.submit(
+                    run_stage,
+                    stage,
+                    results.get(parent),
+                    params,
+                    list_wavs,
+                    input_dir,
+                    node_config[key],
+                    threads,
+                )
+
+            running = {
+                submit(key): key for key, node in nodes.items() if node[1] is None
+            }
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    results[key] = future.result()
+                    for child in children[key]:
+                        running[submit(child)] = child
+                    # Free the intermediate results once sent to all the child stages
+                    if children[key]:
+                        results.pop(key)
+    # Table of results
+    rows = []
+    for config, last in zip(list_configs, config_nodes):
+        labels, sil = results[last]
+        n_indiv_pi, n_indiv_pic = _estimate_population(
+            list_wavs, labels, date_pattern, date_format
+        )
+        row = dict(config)
+        row["f_filt"] = "%d-%d" % config["f_filt"]
+        row["Number_of_clusters"] = len(np.unique(labels))
+        row["Silhouette"] = sil
+        row["Individuals_PI"] = n_indiv_pi
+        row["Individuals_PIC"] = n_indiv_pic
+        rows.append(row)
+    df_sweep = pd.DataFrame(rows)
+    return df_sweep
+
+
+def _estimate_population(list_wavs, labels, date_pattern="default", date_format=None):
+    """
+    Estimate the number of individuals using the PI and the PIC, see pop_estimation.
+
+    Returns
+    -------
+    n_indiv_pi: int, estimated number of individuals using the PI, NaN if the filenames do not contain dates.
+    n_indiv_pic: int, estimated number of individuals using the PIC, NaN if the filenames do not contain dates.
+    """
+    df_res = pd.DataFrame({"File": list_wavs, "Cluster": labels})
+    try:
+        df_res_with_date = pop_estimation.add_date_to_df(
+            df_res, date_pattern, date_format
+        )
+    except (ValueError, IndexError):
+        return np.nan, np.nan
+    dict_pop = pop_estimation.estimate_population(df_res_with_date)
+    return dict_pop["n_indiv_pi"], dict_pop["n_indiv_pic"]
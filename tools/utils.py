@@ -1,12 +1,25 @@
 import os
+import struct
 import numpy as np
 import scipy.io.wavfile as wav
-from soxr import resample
+from soxr import resample, ResampleStream
+
+try:
+    import soundfile
+except ImportError:
+    # Only the WAV files can be read without soundfile
+    soundfile = None
+
+# Extensions of the audio files analyzed, the compressed ones being decoded with soundfile
+wav_extensions = [".wav"]
+compressed_extensions = [".flac", ".ogg"]
+# Maximum number of signals resampled together in a single call, see resample_signals
+resample_channels = 64
 
 
 def filter_wavs(dir):
     """
-    Get the files in a directory and return only the list of WAV files.
+    Get the files in a directory and return only the list of audio files, whatever the case of their extension (e.g. ".WAV" for AudioMoth recorders): the WAV files, and the FLAC and OGG files if soundfile is installed.
 
     Parameters
     ----------
@@ -14,57 +27,330 @@ def filter_wavs(dir):
 
     Returns
     -------
-    wav_only: list of str, list of WAV file names in the directory.
+    wav_only: list of str, list of audio file names in the directory.
     """
     files = os.listdir(dir)
-    wav_check = [f.endswith(".wav") for f in files]
+    wav_check = [is_audio_file(f) for f in files]
     list_wavs = np.array(files)[wav_check]
     return list_wavs
 
 
-def import_wavs(list_wavs, dir, high_f):
+def is_audio_file(name):
+    """
+    Check if a file can be analyzed from its extension, see filter_wavs.
+
+    Parameters
+    ----------
+    name: str, the file name.
+
+    Returns
+    -------
+    check: bool, True for a WAV file, or a FLAC or OGG file if soundfile is installed.
+    """
+    ext = os.path.splitext(name)[1].lower()
+    if ext in wav_extensions:
+        return True
+    return soundfile is not None and ext in compressed_extensions
+
+
+def import_wavs(
+    list_wavs, dir, high_f, quality="HQ", dtype=np.float64, stream_len=2**22
+):
     """
     Import WAV files from a list of WAV files. The files can have different sampling frequencies. The files will then be resampled to a sampling frequency equals to 2*(high_f+100) and then normalize by their RMS.
+    The files longer than stream_len samples are memory-mapped and resampled chunk by chunk as soon as they are opened (see resample_stream), the others are read fully and resampled together with the files of the same sampling frequency and length (see resample_signals), by batches released as soon as they are full, so that neither the open files nor the signals waiting to be resampled build up.
+    The FLAC and OGG files are decoded with soundfile chunk by chunk, each chunk being resampled as soon as it is decoded (see import_compressed), so that the whole decoded signal is never stored.
 
     Parameters
     ----------
-    list_wavs: list of str, list of WAV file names.
+    list_wavs: list of str, list of WAV, FLAC or OGG file names.
     dir: str, path of the directory containing the files.
     high_f: int, the highest frequency of interest in the signal.
+    quality: str, quality of the resampling, see resample_signals. Choose from: "HQ", "MQ", "LQ". "MQ" and "LQ" are faster and can be used for quick preview runs.
+    dtype: numpy dtype of the signals, np.float64 or np.float32 to halve the memory used by the signals and the following stages.
+    stream_len: int, number of samples above which a WAV file is memory-mapped and resampled by chunks.
 
     Returns
     -------
-    list_arr: list of 64 bits 1D arrays, each array being a signal corresponding to a file name in list_wavs.
+    list_arr: list of 1D arrays of dtype, each array being a signal corresponding to a file name in list_wavs.
     samp_freq: int, the new sampling frequency.
 
     """
-    list_arr = []
     samp_freq = int(2 * (high_f + 100))
-    for w in list_wavs:
-        # WAV Import
-        sf, sound = wav.read(dir + "/" + w)
-        sound = sound.astype(np.float64)  # conversion in float 64 bits
-        # Resample
-        rs_sound = resample(sound, sf, samp_freq, "HQ")
-        # Normalisation by RMS
-        rs_sound /= np.sqrt(np.mean(rs_sound**2))
-        list_arr.append(rs_sound)
+    list_arr = [None] * len(list_wavs)
+    # Short files waiting to be resampled together, by sampling frequency and length
+    groups = {}
+
+    def resample_group(key):
+        idx, sounds = zip(*groups.pop(key))
+        rs_sounds = resample_signals(
+            list(sounds), [key[0]] * len(idx), samp_freq, quality, dtype=dtype
+        )
+        for k, rs_sound in zip(idx, rs_sounds):
+            list_arr[k] = rs_sound
+
+    for k, w in enumerate(list_wavs):
+        path = dir + "/" + w
+        if os.path.splitext(w)[1].lower() in compressed_extensions:
+            list_arr[k] = import_compressed(path, samp_freq, quality, dtype=dtype)
+            continue
+        if _wav_header(path)[2] > stream_len:
+            # The map is released once the file is resampled
+            try:
+                sf, sound = wav.read(path, mmap=True)
+            except ValueError:
+                sf, sound = wav.read(path)
+            list_arr[k] = resample_signals(
+                [sound], [sf], samp_freq, quality, stream_len=stream_len, dtype=dtype
+            )[0]
+            del sound
+            continue
+        sf, sound = wav.read(path)
+        if sf == samp_freq or sound.ndim > 1:
+            list_arr[k] = resample_signals(
+                [sound], [sf], samp_freq, quality, dtype=dtype
+            )[0]
+            continue
+        key = (sf, len(sound))
+        groups.setdefault(key, []).append((k, sound))
+        if len(groups[key]) == resample_channels:
+            resample_group(key)
+    for key in list(groups):
+        resample_group(key)
+    # Normalisation by RMS, silent files are left as they are
+    for rs_sound in list_arr:
+        rms = np.sqrt(np.mean(rs_sound**2))
+        if rms > 0:
+            rs_sound /= rms
     return list_arr, samp_freq
 
 
-def pad_signals(list_arr):
+def import_compressed(path, samp_freq, quality="HQ", chunk_len=2**18, dtype=np.float64):
+    """
+    Decode a FLAC or OGG file with soundfile chunk by chunk and resample each chunk as soon as it is decoded using soxr.ResampleStream, so that the whole decoded signal is never stored before the resampling.
+
+    Parameters
+    ----------
+    path: str, path of the file.
+    samp_freq: int, the new sampling frequency.
+    quality: str, quality of the resampling. Choose from: "HQ", "MQ", "LQ".
+    chunk_len: int, number of samples decoded at once.
+    dtype: numpy dtype of the decoding and of the resampling, np.float64 or np.float32.
+
+    Returns
+    -------
+    rs_sound: array of dtype, the resampled signal, 1D for a single channel, with one column per channel otherwise.
+    """
+    if soundfile is None:
+        raise ImportError("soundfile is needed to read the FLAC and OGG files.")
+    if quality not in ["HQ", "MQ", "LQ"]:
+        raise ValueError("The resampling quality must be 'HQ', 'MQ' or 'LQ'.")
+    dtype = np.dtype(dtype).name
+    with soundfile.SoundFile(path) as f:
+        sf = f.samplerate
+        if sf == samp_freq:
+            return f.read(dtype=dtype)
+        stream = ResampleStream(sf, samp_freq, f.channels, dtype=dtype, quality=quality)
+        list_chunks = [
+            stream.resample_chunk(chunk)
+            for chunk in f.blocks(blocksize=chunk_len, dtype=dtype)
+        ]
+    # Flush the samples still in the resampler
+    shape = (0,) if f.channels == 1 else (0, f.channels)
+    list_chunks.append(stream.resample_chunk(np.zeros(shape, dtype), last=True))
+    rs_sound = np.concatenate(list_chunks)
+    return rs_sound
+
+
+def wav_info(path):
+    """
+    Get the sampling frequency and the number of samples of a WAV file without reading its signal, see audio_info.
+
+    Parameters
+    ----------
+    path: str, path of the WAV, FLAC or OGG file.
+
+    Returns
+    -------
+    sf: int, sampling frequency.
+    n_samples: int, number of samples (per channel).
+    """
+    sf, _, n_samples = audio_info(path)
+    return sf, n_samples
+
+
+def audio_info(path):
+    """
+    Get the sampling frequency, the number of channels and the number of samples of a sound file from its header only, without reading its signal: the chunks of the WAV files are parsed (see _wav_header), the FLAC and OGG files are read from their header with soundfile.
+
+    Parameters
+    ----------
+    path: str, path of the WAV, FLAC or OGG file.
+
+    Returns
+    -------
+    sf: int, sampling frequency.
+    n_channels: int, number of channels.
+    n_samples: int, number of samples (per channel).
+    """
+    if os.path.splitext(path)[1].lower() in compressed_extensions:
+        if soundfile is None:
+            raise ImportError("soundfile is needed to read the FLAC and OGG files.")
+        info = soundfile.info(path)
+        return info.samplerate, info.channels, info.frames
+    return _wav_header(path)
+
+
+def _wav_header(path):
+    """
+    Read the sampling frequency, the number of channels and the number of samples of a WAV file (RIFF, RIFX or RF64) from its "fmt " chunk and the size of its "data" chunk, the other chunks being skipped. Raise a ValueError if the file is not a WAV file.
+    """
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if riff[:4] not in [b"RIFF", b"RIFX", b"RF64"] or riff[8:12] != b"WAVE":
+            raise ValueError("%s is not a WAV file." % path)
+        order = ">" if riff[:4] == b"RIFX" else "<"
+        fmt = None
+        data_size = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("%s has no data chunk." % path)
+            chunk_id = header[:4]
+            (size,) = struct.unpack(order + "I", header[4:])
+            start = f.tell()
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack(order + "HHIIH", f.read(14))
+            elif chunk_id == b"ds64":
+                # Sizes of the RF64 files, the one of the data chunk being the second
+                (data_size,) = struct.unpack("<Q", f.read(16)[8:])
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("%s has no fmt chunk before its data." % path)
+                if size == 0xFFFFFFFF and data_size is not None:
+                    size = data_size
+                # The header of a file being copied can announce more data than written
+                size = min(size, os.fstat(f.fileno()).st_size - start)
+                _, n_channels, sf, _, block_align = fmt
+                return sf, n_channels, size // block_align
+            # The chunks are aligned on 2 bytes
+            f.seek(start + size + size % 2)
+
+
+def resample_signals(
+    list_sounds,
+    list_sf,
+    samp_freq,
+    quality="HQ",
+    stream_len=2**22,
+    chunk_len=2**18,
+    max_channels=resample_channels,
+    dtype=np.float64,
+):
+    """
+    Resample a list of signals with different sampling frequencies to the same sampling frequency using soxr.
+    - Signals already at the target sampling frequency are only converted in float (64 bits by default, see dtype).
+    - Signals sharing the same sampling frequency and the same length are stacked and resampled together, as channels of a single multi-channel signal.
+    - Signals longer than stream_len are resampled chunk by chunk using soxr.ResampleStream, so that the whole signal is never converted in float at once.
+
+    Parameters
+    ----------
+    list_sounds: list of 1D arrays, the signals to resample, with any dtype (they can be memory-mapped).
+    list_sf: list of int, sampling frequency of each signal of list_sounds.
+    samp_freq: int, the new sampling frequency.
+    quality: str, quality of the resampling. Choose from: "HQ" (high quality), "MQ" (medium quality), "LQ" (low quality).
+    stream_len: int, number of samples above which a signal is resampled by chunks.
+    chunk_len: int, number of samples of each chunk for the signals resampled by chunks.
+    max_channels: int, maximum number of signals resampled together in a single call.
+    dtype: numpy dtype of the resampling and of the resampled signals, np.float64 or np.float32.
+
+    Returns
+    -------
+    list_arr: list of 1D arrays of dtype, the resampled signals, in the same order as list_sounds.
+    """
+    if quality not in ["HQ", "MQ", "LQ"]:
+        raise ValueError("The resampling quality must be 'HQ', 'MQ' or 'LQ'.")
+    list_arr = [None] * len(list_sounds)
+    groups = {}
+    for k, (sf, sound) in enumerate(zip(list_sf, list_sounds)):
+        if sf == samp_freq:
+            # No resampling needed
+            list_arr[k] = np.array(sound, dtype=dtype)
+        elif len(sound) > stream_len:
+            list_arr[k] = resample_stream(
+                sound, sf, samp_freq, quality, chunk_len, dtype
+            )
+        elif sound.ndim > 1:
+            # Multi-channel files are resampled separately
+            list_arr[k] = resample(sound.astype(dtype), sf, samp_freq, quality)
+        else:
+            groups.setdefault((sf, len(sound)), []).append(k)
+    # Resample the signals with the same sampling frequency and length together
+    for (sf, _), idx in groups.items():
+        for start in range(0, len(idx), max_channels):
+            idx_batch = idx[start : start + max_channels]
+            if len(idx_batch) == 1:
+                batch = list_sounds[idx_batch[0]].astype(dtype)
+            else:
+                batch = np.column_stack([list_sounds[i] for i in idx_batch])
+                batch = batch.astype(dtype)
+            rs_batch = resample(batch, sf, samp_freq, quality)
+            if len(idx_batch) == 1:
+                list_arr[idx_batch[0]] = rs_batch
+            else:
+                for c, i in enumerate(idx_batch):
+                    list_arr[i] = np.ascontiguousarray(rs_batch[:, c])
+    return list_arr
+
+
+def resample_stream(
+    sound, sf, samp_freq, quality="HQ", chunk_len=2**18, dtype=np.float64
+):
+    """
+    Resample a long 1D signal chunk by chunk using soxr.ResampleStream. Only one chunk of the original signal is converted in float at a time.
+
+    Parameters
+    ----------
+    sound: 1D array, the signal to resample, with any dtype (it can be memory-mapped).
+    sf: int, sampling frequency of the signal.
+    samp_freq: int, the new sampling frequency.
+    quality: str, quality of the resampling. Choose from: "HQ", "MQ", "LQ".
+    chunk_len: int, number of samples of each chunk.
+    dtype: numpy dtype of the resampling, np.float64 or np.float32.
+
+    Returns
+    -------
+    rs_sound: 1D array of dtype, the resampled signal.
+    """
+    num_channels = 1 if sound.ndim == 1 else sound.shape[1]
+    stream = ResampleStream(
+        sf, samp_freq, num_channels, dtype=np.dtype(dtype).name, quality=quality
+    )
+    list_chunks = []
+    n = len(sound)
+    for start in range(0, n, chunk_len):
+        chunk = np.asarray(sound[start : start + chunk_len], dtype=dtype)
+        list_chunks.append(stream.resample_chunk(chunk, last=start + chunk_len >= n))
+    rs_sound = np.concatenate(list_chunks)
+    return rs_sound
+
+
+def pad_signals(list_arr, length=None):
     """
     Pad arrays with 0s at the end so that all arrays have the same length.
 
     Parameters
     ----------
     list_arr: list of 1D arrays.
+    length: int, the length of the padded arrays, None to use the length of the longest array. Arrays longer than length are padded to the length of the longest array.
 
     Returns
     -------
     arr_arr_pad: array of 1D arrays of the smae length.
     """
     max_len = max([len(a) for a in list_arr])
+    if length is not None:
+        max_len = max(max_len, length)
     list_arr_pad = [np.pad(l, (0, max_len - len(l))) for l in list_arr]
     arr_arr_pad = np.array(list_arr_pad)
     return arr_arr_pad
@@ -0,0 +1,419 @@
+# Watch a folder and cluster incrementally the newly arriving recordings
+import os
+import json
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from . import catalog, image_matching, pipeline, resources
+
+# Name of the directory, inside the output directory, where the state of the watcher is stored
+state_dir_name = "watch_state"
+# Parameters of the pipeline that are not part of the analysis and are not stored in the state
+_unsaved_params = ["input_dir", "output_dir", "list_wavs"]
+
+
+def watch(
+    input_dir,
+    output_dir,
+    interval=3600,
+    min_age=60,
+    max_exemplars=5,
+    threshold=None,
+    run_once=False,
+    executor="thread",
+    n_workers=None,
+    threads_per_worker=None,
+    **params,
+):
+    """
+    Poll an input directory and cluster the new WAV files as they arrive. The first pass clusters all the files present with the usual pipeline, the following ones only process the new files: they are matched against a few stored exemplars of each cluster and assigned to the closest cluster, or grouped in new clusters if they are too far from all of them. After each update, clustering_results.csv and the population estimation files (presence_index.csv, number_of_clusters_per_day.csv, PPI_PIC.csv, ...) are regenerated in the output directory.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory where the WAV files arrive.
+    output_dir: str, path of the directory where the results and the state of the watcher are saved.
+    interval: float, time between two polls of the input directory, in seconds.
+    min_age: float, files modified less than min_age seconds ago are considered as still being copied and are processed at the next poll.
+    max_exemplars: int, maximum number of exemplars stored per cluster.
+    threshold: float, maximum matching distance between a new file and the exemplars of a cluster to be assigned to it. None to use the threshold estimated during the first pass, see initialize.
+    run_once: bool, if True, perform a single update and return.
+    executor: str, executor of the pipeline, see pipeline.Pipeline.
+    n_workers: int, number of workers of the pipeline, see pipeline.Pipeline.
+    threads_per_worker: int, number of threads of each worker of the pipeline, see pipeline.Pipeline.
+    **params: the parameters of the analysis, see pipeline.default_params.
+    """
+    while True:
+        state = load_state(output_dir)
+        known = set() if state is None else set(state["df"].File)
+        recursive = (params if state is None else state["params"]).get(
+            "recursive", pipeline.default_params["recursive"]
+        )
+        # Only the files not processed yet are stat-ed, their headers are then read
+        # by the catalog of the pipeline (see catalog.update_catalog)
+        df_files = catalog.scan_audio(input_dir, recursive == "Yes", skip=known)
+        now = time.time_ns()
+        ready = df_files.File[now - df_files.Mtime >= min_age * 1e9].tolist()
+        if state is None:
+            if ready:
+                state = initialize(
+                    input_dir,
+                    output_dir,
+                    ready,
+                    max_exemplars,
+                    executor,
+                    n_workers,
+                    threads_per_worker,
+                    **params,
+                )
+                _save_results(state, output_dir)
+        else:
+            check_params(state, params)
+            if ready:
+                state = update(
+                    input_dir,
+                    output_dir,
+                    ready,
+                    state,
+                    threshold,
+                    executor,
+                    n_workers,
+                    threads_per_worker,
+                )
+                _save_results(state, output_dir)
+        if run_once:
+            return state
+        time.sleep(interval)
+
+
+def initialize(
+    input_dir,
+    output_dir,
+    list_wavs,
+    max_exemplars=5,
+    executor="thread",
+    n_workers=None,
+    threads_per_worker=None,
+    **params,
+):
+    """
+    First pass of the watcher: cluster all the files with the usual pipeline and store the exemplars of each cluster.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory containing the WAV files.
+    output_dir: str, path of the directory where the results and the state of the watcher are saved.
+    list_wavs: list of str, the WAV file names to cluster.
+    max_exemplars: int, maximum number of exemplars stored per cluster.
+    executor: str, executor of the pipeline, see pipeline.Pipeline.
+    n_workers: int, number of workers of the pipeline, see pipeline.Pipeline.
+    threads_per_worker: int, number of threads of each worker of the pipeline, see pipeline.Pipeline.
+    **params: the parameters of the analysis, see pipeline.default_params.
+
+    Returns
+    -------
+    state: dict, the state of the watcher, see load_state.
+    """
+    pipe = pipeline.Pipeline(
+        input_dir,
+        output_dir,
+        executor=executor,
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        list_wavs=list_wavs,
+        **params,
+    )
+    if pipe.params["similarity"] != "matching":
+        raise ValueError("The watcher only works with the 'matching' similarity.")
+    if pipe.params["screen"] == "Yes" or pipe.params["min_keypoints"] > 0:
+        raise ValueError("The watcher does not support the screening of the files.")
+    image_matching.save_spectros_keypoints(
+        pipe.result("spectrogram"), pipe.result("detect"), pipe.list_wavs, output_dir
+    )
+    clusters = pipe.result("cluster")
+    dist_images = pipe.result("match")
+    if sparse.issparse(dist_images):
+        dist_images = image_matching.dense_distance_matrix(
+            dist_images, pipe.params["fill_value"]
+        )
+    descriptors = [kd[1] for kd in pipe.result("detect")]
+    exemplars = []
+    intra_dist = []
+    # The noise files of HDBSCAN (cluster -1) are not a cluster and get no exemplar
+    for c in np.unique(clusters[clusters >= 0]):
+        idx = np.nonzero(clusters == c)[0]
+        for i in _medoids(dist_images[np.ix_(idx, idx)], max_exemplars):
+            exemplars.append((int(c), pipe.list_wavs[idx[i]], descriptors[idx[i]]))
+        if len(idx) > 1:
+            # Distance of each file to the other files of its cluster
+            sub = uncompressed_distances(pipe, dist_images, idx)
+            sub = sub + np.diag(np.full(len(idx), np.inf))
+            intra_dist.append(np.min(sub, axis=1))
+    # Files further than this distance from all the exemplars of a cluster will not be assigned to it
+    if intra_dist:
+        threshold = float(np.percentile(np.concatenate(intra_dist), 90))
+    else:
+        all_dist = uncompressed_distances(pipe, dist_images, np.arange(len(clusters)))
+        threshold = float(np.median(all_dist[all_dist > 0]))
+    saved_params = {k: v for k, v in pipe.params.items() if k not in _unsaved_params}
+    saved_params["pad_len"] = int(pipe.result("pad").shape[1])
+    state = {
+        "df": pd.DataFrame({"File": pipe.list_wavs, "Cluster": clusters}),
+        "exemplars": exemplars,
+        "threshold": threshold,
+        "params": saved_params,
+        "max_exemplars": max_exemplars,
+    }
+    save_state(state, output_dir)
+    return state
+
+
+def update(
+    input_dir,
+    output_dir,
+    new_wavs,
+    state,
+    threshold=None,
+    executor="thread",
+    n_workers=None,
+    threads_per_worker=None,
+):
+    """
+    Cluster new files incrementally: the spectrograms and descriptors are only computed for the new files, and each new file is only matched against the exemplars of each cluster and the other new files, so that the cost of an update is proportional to the number of new files.
+
+    Parameters
+    ----------
+    input_dir: str, path of the directory containing the WAV files.
+    output_dir: str, path of the directory where the results and the state of the watcher are saved.
+    new_wavs: list of str, the new WAV file names.
+    state: dict, the state of the watcher, see load_state.
+    threshold: float, maximum matching distance between a new file and the exemplars of a cluster to be assigned to it. None to use the threshold of the state.
+    executor: str, executor of the pipeline, see pipeline.Pipeline.
+    n_workers: int, number of workers of the pipeline, see pipeline.Pipeline.
+    threads_per_worker: int, number of threads of each worker of the pipeline, see pipeline.Pipeline.
+
+    Returns
+    -------
+    state: dict, the updated state of the watcher.
+    """
+    params = state["params"]
+    if threshold is None:
+        threshold = state["threshold"]
+    max_exemplars = state.get("max_exemplars", 5)
+    pipe = pipeline.Pipeline(
+        input_dir,
+        output_dir,
+        executor=executor,
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        list_wavs=new_wavs,
+        **params,
+    )
+    kp_desc = pipe.result("detect")
+    image_matching.save_spectros_keypoints(
+        pipe.result("spectrogram"), kp_desc, pipe.list_wavs, output_dir
+    )
+    descriptors = [kd[1] for kd in kp_desc]
+    _, matcher = image_matching.feature_detector_matcher(
+        params["detector_methode"], matcher=params.get("matcher", "opencv")
+    )
+    n_matches = int(params["n_matches"])
+    # Distance between the new files and the exemplars of each cluster
+    exemplars = state["exemplars"]
+    ex_clusters = np.array([e[0] for e in exemplars])
+    dist_ex = np.array(
+        [
+            [distance_to_exemplar(matcher, d, e[2], n_matches) for e in exemplars]
+            for d in descriptors
+        ]
+    ).reshape((len(descriptors), len(exemplars)))
+    new_clusters = np.full(len(descriptors), -1)
+    if len(exemplars):
+        closest = np.argmin(dist_ex, axis=1)
+        assigned = dist_ex[np.arange(len(descriptors)), closest] <= threshold
+        new_clusters[assigned] = ex_clusters[closest[assigned]]
+    # Files too far from all the clusters are clustered together in new clusters
+    unassigned = np.nonzero(new_clusters == -1)[0]
+    next_cluster = int(state["df"].Cluster.max()) + 1 if len(state["df"]) else 0
+    if len(unassigned) > 2:
+        dist_new = image_matching.distance_matrix(
+            [descriptors[i] for i in unassigned], matcher, n_matches
+        )
+        with resources.limit_threads(pipe.resources["n_jobs"]):
+            labels = image_matching.clustering_matches(
+                dist_new,
+                clustering_name=params["clustering"],
+                n_jobs=pipe.resources["n_jobs"],
+            )
+        # The noise files (label -1 of HDBSCAN) are not grouped together, each one gets its own cluster
+        noise = labels < 0
+        grouped = np.unique(labels[~noise], return_inverse=True)[1].reshape(-1)
+        labels = np.empty(len(labels), dtype=int)
+        labels[~noise] = grouped
+        labels[noise] = len(np.unique(grouped)) + np.arange(np.count_nonzero(noise))
+    else:
+        dist_new = np.zeros((len(unassigned), len(unassigned)))
+        labels = np.arange(len(unassigned))
+    new_clusters[unassigned] = next_cluster + labels
+    # Exemplars of the new clusters
+    for lab in np.unique(labels):
+        idx = np.nonzero(labels == lab)[0]
+        for i in _medoids(dist_new[np.ix_(idx, idx)], max_exemplars):
+            k = unassigned[idx[i]]
+            exemplars.append((int(new_clusters[k]), pipe.list_wavs[k], descriptors[k]))
+    # Existing clusters with less exemplars than max_exemplars get the new files as exemplars
+    n_ex = pd.Series([e[0] for e in exemplars]).value_counts().to_dict()
+    for k in np.nonzero(new_clusters >= 0)[0]:
+        c = int(new_clusters[k])
+        if k not in unassigned and n_ex.get(c, 0) < max_exemplars:
+            exemplars.append((c, pipe.list_wavs[k], descriptors[k]))
+            n_ex[c] = n_ex.get(c, 0) + 1
+    df_new = pd.DataFrame({"File": pipe.list_wavs, "Cluster": new_clusters})
+    state["df"] = pd.concat([state["df"], df_new], ignore_index=True)
+    state["exemplars"] = exemplars
+    save_state(state, output_dir)
+    return state
+
+
+def uncompressed_distances(pipe, dist_images, idx):
+    """
+    Matching distances between some files of a pipeline on the scale of the uncompressed descriptors, the ones stored as exemplars and matched by update. They are the distances of the distance matrix, unless the run compressed the descriptors (see image_matching.compress_descriptors): the files are then matched again with their original descriptors.
+
+    Parameters
+    ----------
+    pipe: pipeline.Pipeline, the pipeline of the run.
+    dist_images: the dense distance matrix of the run.
+    idx: array of int, the indices of the files.
+
+    Returns
+    -------
+    dist: 2D array, the distances between the files idx.
+    """
+    if pipe.params["compression"] == "No":
+        return dist_images[np.ix_(idx, idx)]
+    _, matcher = image_matching.feature_detector_matcher(
+        pipe.params["detector_methode"], matcher=pipe.params["matcher"]
+    )
+    descriptors = [pipe.result("detect")[i][1] for i in idx]
+    return image_matching.distance_matrix(
+        descriptors, matcher, int(pipe.params["n_matches"])
+    )
+
+
+def distance_to_exemplar(matcher, des, des_ex, n_matches):
+    """
+    Matching distance between the descriptors of a file and the ones of an exemplar, see image_matching.distance_matches. Files without descriptors are infinitely far from all the exemplars.
+    """
+    if des is None or des_ex is None or len(des) == 0 or len(des_ex) == 0:
+        return np.inf
+    return image_matching.distance_matches(matcher, des, des_ex, n_matches)
+
+
+def check_params(state, params):
+    """
+    Check that the parameters of the analysis did not change since the first pass of the watcher, as the stored exemplars would not be comparable with the new files. Raise a ValueError otherwise.
+    """
+    changed = [
+        p
+        for p, v in params.items()
+        if p in state["params"] and not pipeline._same(state["params"][p], v)
+    ]
+    if changed:
+        raise ValueError(
+            "The parameters %s are different from the ones used to build the clusters in %s."
+            % (", ".join(changed), state_dir_name)
+        )
+
+
+def load_state(output_dir):
+    """
+    Load the state of the watcher from the output directory.
+
+    Parameters
+    ----------
+    output_dir: str, path of the directory where the results and the state of the watcher are saved.
+
+    Returns
+    -------
+    state: dict, None if the watcher was never run in this directory. The keys are:
+    "df", a pandas DataFrame with the "File" and "Cluster" of each file already processed,
+    "exemplars", a list of tuples (cluster, file name, descriptors) with the exemplars of each cluster,
+    "threshold", the maximum matching distance to assign a file to a cluster,
+    "params", the parameters of the analysis,
+    "max_exemplars", the maximum number of exemplars per cluster.
+    """
+    state_dir = os.path.join(output_dir, state_dir_name)
+    if not os.path.isfile(os.path.join(state_dir, "state.json")):
+        return None
+    with open(os.path.join(state_dir, "state.json")) as f:
+        state = json.load(f)
+    state["df"] = pd.read_csv(os.path.join(state_dir, "files.csv"))
+    df_ex = pd.read_csv(os.path.join(state_dir, "exemplars.csv"))
+    with np.load(os.path.join(state_dir, "exemplars.npz")) as arrays:
+        state["exemplars"] = [
+            (int(c), f, arrays["des_%d" % k] if "des_%d" % k in arrays else None)
+            for k, (c, f) in enumerate(zip(df_ex.Cluster, df_ex.File))
+        ]
+    return state
+
+
+def save_state(state, output_dir):
+    """
+    Save the state of the watcher in the output directory, see load_state. Each file is written to a temporary file and replaced at once, state.json last, so an interruption never leaves a partial file.
+    """
+    state_dir = os.path.join(output_dir, state_dir_name)
+    if not os.path.isdir(state_dir):
+        os.mkdir(state_dir)
+    state["df"].to_csv(os.path.join(state_dir, "files.tmp.csv"), index=False)
+    exemplars = state["exemplars"]
+    pd.DataFrame(
+        {"Cluster": [e[0] for e in exemplars], "File": [e[1] for e in exemplars]}
+    ).to_csv(os.path.join(state_dir, "exemplars.tmp.csv"), index=False)
+    np.savez(
+        os.path.join(state_dir, "exemplars.tmp.npz"),
+        **{"des_%d" % k: e[2] for k, e in enumerate(exemplars) if e[2] is not None},
+    )
+    with open(os.path.join(state_dir, "state.tmp.json"), "w") as f:
+        json.dump(
+            {
+                "threshold": state["threshold"],
+                "params": state["params"],
+                "max_exemplars": state.get("max_exemplars", 5),
+            },
+            f,
+            indent=1,
+        )
+    for name in ["files.csv", "exemplars.csv", "exemplars.npz", "state.json"]:
+        root, ext = os.path.splitext(name)
+        os.replace(
+            os.path.join(state_dir, root + ".tmp" + ext),
+            os.path.join(state_dir, name),
+        )
+
+
+def _save_results(state, output_dir):
+    """
+    Regenerate clustering_results.csv and the population estimation files.
+    """
+    state["df"].to_csv(output_dir + "/clustering_results.csv", index=False)
+    try:
+        params = state["params"]
+        pipeline.save_population(
+            state["df"],
+            output_dir,
+            params.get("date_pattern", "default"),
+            params.get("date_format"),
+        )
+    except ValueError:
+        warnings.warn(
+            "Population estimation not performed as the filenames format is wrong."
+        )
+
+
+def _medoids(dist, n):
+    """
+    Indices of the n files with the smallest sum of distances to the others, used as exemplars of a cluster.
+    """
+    return np.argsort(np.sum(dist, axis=1))[:n]
@@ -0,0 +1,83 @@
+### Watch a folder and cluster the new recordings as they arrive
+import argparse
+
+try:
+    from tools import watcher, resources
+except:
+    from LagoPObs.tools import watcher, resources
+
+parser = argparse.ArgumentParser(
+    description="Poll a folder and cluster incrementally the new WAV files. The results (clustering_results.csv, presence_index.csv, number_of_clusters_per_day.csv, PPI_PIC.csv, ...) are regenerated in the output folder after each update."
+)
+parser.add_argument("input_dir", help="folder where the WAV files arrive")
+parser.add_argument("output_dir", help="folder where the results are saved")
+parser.add_argument(
+    "--interval", type=float, default=3600, help="time between two polls (s)"
+)
+parser.add_argument(
+    "--min-age",
+    type=float,
+    default=60,
+    help="files modified more recently than this (s) are processed at the next poll",
+)
+parser.add_argument(
+    "--max-exemplars", type=int, default=5, help="number of exemplars per cluster"
+)
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=None,
+    help="maximum matching distance to assign a file to an existing cluster",
+)
+parser.add_argument("--once", action="store_true", help="perform a single update")
+parser.add_argument(
+    "--resources",
+    default="auto",
+    help="workers x threads per worker, e.g. 4x2, or auto for one single-threaded worker per processor",
+)
+# Parameters of the analysis, same defaults as the GUI
+parser.add_argument("--wlt-filt", default="Yes", choices=["Yes", "No"])
+parser.add_argument("--fmin", type=int, default=950)
+parser.add_argument("--fmax", type=int, default=2800)
+parser.add_argument("--wlen", type=int, default=281)
+parser.add_argument("--ovlp", type=int, default=75)
+parser.add_argument("--wlen-env", type=int, default=706)
+parser.add_argument("--ovlp-env", type=int, default=90)
+parser.add_argument("--n-matches", type=int, default=53)
+parser.add_argument("--detector", default="ORB custom")
+parser.add_argument("--clustering", default="Affinity Propagation")
+parser.add_argument(
+    "--date-pattern",
+    default="default",
+    help="dates in the filenames: default (xxx_20230619_xxx.wav), audiomoth (20230619_053000.WAV) or a regular expression capturing the date",
+)
+parser.add_argument(
+    "--date-format",
+    default=None,
+    help="format of the date captured by a custom --date-pattern, e.g. %%Y-%%m-%%d",
+)
+args = parser.parse_args()
+n_workers, threads_per_worker = resources.parse_resources(args.resources)
+
+watcher.watch(
+    args.input_dir,
+    args.output_dir,
+    interval=args.interval,
+    min_age=args.min_age,
+    max_exemplars=args.max_exemplars,
+    threshold=args.threshold,
+    run_once=args.once,
+    n_workers=n_workers,
+    threads_per_worker=threads_per_worker,
+    wlt_filt=args.wlt_filt,
+    f_filt=[args.fmin, args.fmax],
+    wlen=args.wlen,
+    ovlp=args.ovlp,
+    wlen_env=args.wlen_env,
+    ovlp_env=args.ovlp_env,
+    n_matches=args.n_matches,
+    detector_methode=args.detector,
+    clustering=args.clustering,
+    date_pattern=args.date_pattern,
+    date_format=args.date_format,
+)